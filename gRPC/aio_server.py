@@ -0,0 +1,203 @@
+import asyncio
+import contextvars
+from concurrent import futures
+
+import chat_pb2
+import chat_pb2_grpc
+import grpc
+
+
+class LoopQueue:
+    """
+    Lets the server's worker threads hand messages to a subscription served on the
+    event loop. ChatService.notify_subscribers calls put() from whichever thread
+    committed the message.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue()
+
+    def put(self, item):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+
+
+class AsyncChatService(chat_pb2_grpc.ChatServiceServicer):
+    """
+    Serves ChatService on grpc.aio. Every RPC is a coroutine on one event loop, so an
+    open subscription costs a queue and a paused coroutine rather than a thread, and
+    one process can hold tens of thousands of them. Database work still runs on the
+    wrapped ChatService, off the loop: all writes go through one dedicated writer
+    thread, and reads share a small pool of reader threads, each with its own
+    connection. With group commit on, single sends get a pool of their own instead,
+    since sends waiting in the writer's queue could never share a commit.
+    """
+
+    # threads waiting on group commits at once, and so the most sends one commit can share
+    SEND_WORKERS = 32
+
+    def __init__(self, service, read_workers=4):
+        """
+        Wraps a ChatService whose database has been started.
+
+        Args:
+        - service (ChatService): The service that owns the database and replication state.
+        - read_workers (int): Threads running reads at the same time.
+
+        Returns:
+        None
+        """
+        self.service = service
+        self.writer = futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-writer")
+        self.readers = futures.ThreadPoolExecutor(max_workers=read_workers, thread_name_prefix="chat-reader")
+        # the group committer already serializes the commits
+        self.senders = None
+        if service.group_committer is not None:
+            self.senders = futures.ThreadPoolExecutor(max_workers=self.SEND_WORKERS, thread_name_prefix="chat-sender")
+
+    async def read(self, function, *args):
+        # in the call's context, so a Profiler knows which RPC the work is for
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(self.readers, context.run, function, *args)
+
+    async def write(self, function, *args):
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(self.writer, context.run, function, *args)
+
+    async def send(self, function, *args):
+        """Runs a single send, on the sender pool if there is one and otherwise as a write."""
+        if self.senders is None:
+            return await self.write(function, *args)
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(self.senders, context.run, function, *args)
+
+    def close(self):
+        self.writer.shutdown()
+        self.readers.shutdown()
+        if self.senders is not None:
+            self.senders.shutdown()
+
+    # the checks and metadata come from ChatService, so both servers answer alike;
+    # only aborting differs, since an aio context's abort is a coroutine
+
+    async def check_writable(self, context):
+        """Rejects a client write when ChatService.refuses_writes says so."""
+        if self.service.refuses_writes():
+            context.set_trailing_metadata(self.service.leader_metadata())
+            await context.abort(grpc.StatusCode.FAILED_PRECONDITION, self.service.NOT_PRIMARY)
+
+    async def send_version(self, context):
+        """Attaches this replica's data version to a read, read off the loop."""
+        context.set_trailing_metadata(await self.read(self.service.version_metadata))
+
+    async def LoginClient(self, request, context):
+        await self.send_version(context)
+        return await self.read(self.service.login_processing, request)
+
+    async def CreateAccountClient(self, request, context):
+        await self.check_writable(context)
+        return await self.write(self.service.create_account_processing, request)
+
+    async def DeleteAccountClient(self, request, context):
+        await self.check_writable(context)
+        return await self.write(self.service.delete_account_processing, request)
+
+    async def ListAccountClient(self, request, context):
+        await self.send_version(context)
+        return await self.read(self.service.list_account_processing)
+
+    async def SendMessageClient(self, request, context):
+        await self.check_writable(context)
+        return await self.send(self.service.send_msg_processing, request)
+
+    async def ViewMessageClient(self, request, context):
+        await self.check_writable(context)
+        return await self.write(self.service.view_msg_processing, request)
+
+    async def LogoutClient(self, request, context):
+        return self.service.logout_processing(request)
+
+    async def CheckIncomingMessagesClient(self, request, context):
+        await self.check_writable(context)
+        return await self.write(self.service.check_msg_processing, request)
+
+    async def SendMessage(self, request, context):
+        await self.check_writable(context)
+        return await self.send(self.service.send_request_processing, request)
+
+    async def SendMessages(self, request_iterator, context):
+        await self.check_writable(context)
+        statuses = []
+        batch = []
+        async for request in request_iterator:
+            batch.append(request)
+            if len(batch) == self.service.BULK_SEND_BATCH:
+                statuses.extend(await self.write(self.service.send_batch, batch))
+                batch = []
+        if batch:
+            statuses.extend(await self.write(self.service.send_batch, batch))
+        return chat_pb2.BulkSendReply(statuses=statuses)
+
+    async def ViewInbox(self, request, context):
+        await self.check_writable(context)
+        return await self.write(self.service.view_inbox_processing, request)
+
+    async def ListAccounts(self, request, context):
+        await self.send_version(context)
+        pages = self.service.list_accounts_processing(request)
+        # each page runs its own query, so consecutive pages may use different reader threads
+        while True:
+            page = await self.read(next, pages, None)
+            if page is None:
+                return
+            yield page
+
+    async def FetchMessages(self, request, context):
+        await self.send_version(context)
+        return await self.read(self.service.fetch_msg_processing, request)
+
+    async def AckMessages(self, request, context):
+        await self.check_writable(context)
+        return await self.write(self.service.ack_msg_processing, request)
+
+    async def WhoIsLeader(self, request, context):
+        return self.service.WhoIsLeader(request, context)
+
+    async def SubscribeMessages(self, request, context):
+        """
+        Streams a user's stored messages, then pushes each new one as it is committed,
+        removing each from the inbox once handed to the stream; the same protocol as
+        ChatService.subscribe_processing. The coroutine sleeps on its queue between
+        messages and is cancelled when the client goes away.
+        """
+        await self.check_writable(context)
+        username = request.info
+        if not self.service.is_valid_user(username):
+            yield chat_pb2.ServerMessage(operation=chat_pb2.FAILURE, info="")
+            return
+
+        # register before reading the backlog so nothing committed in between is missed
+        subscription = LoopQueue(asyncio.get_running_loop())
+        with self.service.subscribers_lock:
+            self.service.subscribers.setdefault(username, []).append(subscription)
+        try:
+            last_id = 0
+            for msg_id, msg in await self.read(self.service.backlog, username):
+                yield chat_pb2.ServerMessage(operation=chat_pb2.MESSAGES_EXIST, info=msg)
+                last_id = msg_id
+            if last_id:
+                await self.write(self.service.ack_msg_processing, chat_pb2.AckRequest(user=username, up_to_id=last_id))
+
+            while True:
+                msg_id, msg = await subscription.queue.get()
+                # already sent as part of the backlog
+                if msg_id <= last_id:
+                    continue
+                yield chat_pb2.ServerMessage(operation=chat_pb2.MESSAGES_EXIST, info=msg)
+                # earlier messages were all streamed already, so acknowledge up to this one
+                await self.write(self.service.ack_msg_processing, chat_pb2.AckRequest(user=username, up_to_id=msg_id))
+        finally:
+            with self.service.subscribers_lock:
+                self.service.subscribers[username].remove(subscription)
+                if not self.service.subscribers[username]:
+                    del self.service.subscribers[username]
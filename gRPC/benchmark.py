@@ -0,0 +1,654 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import queue
+import random
+import socket
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent import futures
+
+import chat_pb2
+import chat_pb2_grpc
+import grpc
+from aio_server import AsyncChatService
+from metrics import AsyncMetricsInterceptor, Metrics, MetricsInterceptor
+from replication import ReplicationServicer, Resyncer
+from server import ChatService
+from user import User
+
+
+def populate_db(db, account_count):
+    """
+    Fills a fresh database with the given number of accounts.
+
+    Args:
+    - db (str): Path of the database file to create.
+    - account_count (int): Number of accounts to insert.
+
+    Returns:
+    None
+    """
+    service = ChatService()
+    service.start_db(db)
+    service.c.executemany(
+        "INSERT INTO users (user_name, incoming_messages) VALUES (?, ?)",
+        (("user" + str(i), "") for i in range(account_count)),
+    )
+    service.conn.commit()
+    service.close_db()
+
+
+def time_rpc(function, request, iterations):
+    """
+    Calls a ChatService processing method repeatedly and returns the mean latency.
+
+    Args:
+    - function: The processing method to call, e.g. service.login_processing.
+    - request (ClientMessage): The request passed on every call.
+    - iterations (int): How many calls to time.
+
+    Returns:
+    The mean latency per call in microseconds.
+    """
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function(request)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def bench_account_scaling(account_counts=(100, 1000, 10000, 100000), iterations=2000):
+    """
+    Measures per-RPC latency of the ChatService handlers as the number of accounts grows.
+    Handlers are called directly so the numbers exclude gRPC transport overhead.
+
+    Args:
+    - account_counts (tuple): The account counts to measure at.
+    - iterations (int): How many calls to time per RPC and account count.
+
+    Returns:
+    A list of (account_count, {rpc_name: mean latency in microseconds}) tuples.
+    """
+    results = []
+    for account_count in account_counts:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db = os.path.join(tmpdir, "user_database")
+            populate_db(db, account_count)
+            service = ChatService()
+            service.start_db(db)
+
+            receiver = "user" + str(account_count - 1)
+            latencies = {
+                "login": time_rpc(
+                    service.login_processing, chat_pb2.ClientMessage(info=receiver), iterations
+                ),
+                "login_missing": time_rpc(
+                    service.login_processing, chat_pb2.ClientMessage(info="nobody"), iterations
+                ),
+                "send": time_rpc(
+                    service.send_msg_processing,
+                    chat_pb2.ClientMessage(info="user0\n" + receiver + "\nhello"),
+                    iterations,
+                ),
+                "view": time_rpc(
+                    service.view_msg_processing, chat_pb2.ClientMessage(info=receiver), iterations
+                ),
+            }
+            service.close_db()
+        results.append((account_count, latencies))
+    return results
+
+
+def bench_send_scaling(worker_counts=(1, 2, 4, 8, 10), recipient_count=1000, message_count=4000,
+                       group_commit_ms=None):
+    """
+    Measures send throughput when many workers send to many different recipients at once,
+    the way the gRPC thread pool in start.py would.
+
+    Args:
+    - worker_counts (tuple): The thread pool sizes to measure at.
+    - recipient_count (int): Number of accounts the messages are spread across.
+    - message_count (int): Number of messages sent per worker count.
+    - group_commit_ms (float): Group commit window, or None to commit every send on its own.
+
+    Returns:
+    A list of (worker_count, {"send": messages per second}) tuples.
+    """
+    results = []
+    for worker_count in worker_counts:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db = os.path.join(tmpdir, "user_database")
+            populate_db(db, recipient_count)
+            service = ChatService()
+            service.start_db(db, group_commit_ms)
+
+            requests = [
+                chat_pb2.ClientMessage(info="user0\nuser" + str(i % recipient_count) + "\nhello")
+                for i in range(message_count)
+            ]
+            with futures.ThreadPoolExecutor(max_workers=worker_count) as pool:
+                start = time.perf_counter()
+                list(pool.map(service.send_msg_processing, requests))
+                elapsed = time.perf_counter() - start
+            service.close_db()
+        results.append((worker_count, {"send": message_count / elapsed}))
+    return results
+
+
+def bench_bootstrap(message_counts=(1000, 10000, 100000), batch_size=256):
+    """
+    Measures how long a brand new backup takes to catch up with a primary, replaying the
+    whole log versus loading a snapshot and replaying only the entries after it.
+
+    Args:
+    - message_counts (tuple): The numbers of messages on the primary to measure at.
+    - batch_size (int): Log entries per FetchLog batch.
+
+    Returns:
+    A list of (message_count, {"replay": milliseconds, "snapshot": milliseconds}) tuples.
+    """
+    results = []
+    for message_count in message_counts:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            primary = ChatService()
+            primary.start_db(os.path.join(tmpdir, "user_database"), role=ChatService.PRIMARY)
+            server = grpc.server(futures.ThreadPoolExecutor(max_workers=4))
+            chat_pb2_grpc.add_ReplicationServiceServicer_to_server(ReplicationServicer(primary), server)
+            address = "localhost:" + str(server.add_insecure_port("localhost:0"))
+            server.start()
+
+            for i in range(100):
+                primary.write_account(primary.c, "user" + str(i))
+            for i in range(message_count):
+                primary.write_message(primary.c, "user0", "user" + str(i % 100), "hello", time.time())
+            primary.conn.commit()
+
+            timings = {}
+            for name in ("replay", "snapshot"):
+                if name == "snapshot":
+                    primary.take_snapshot()
+                backup = ChatService()
+                backup.start_db(os.path.join(tmpdir, "user_database_" + name), role=ChatService.BACKUP)
+                resyncer = Resyncer(backup, address, batch_size=batch_size, snapshot_lag=message_count * 2)
+                start = time.perf_counter()
+                resyncer.catch_up()
+                timings[name] = (time.perf_counter() - start) * 1000
+                resyncer.channel.close()
+                backup.close_db()
+            server.stop(None)
+            primary.close_db()
+        results.append((message_count, timings))
+    return results
+
+
+def serve_threaded(service, metrics=None):
+    """Starts the thread-pool server start.py runs by default. Returns (port, stop function)."""
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=10), interceptors=[MetricsInterceptor(metrics)] if metrics else []
+    )
+    chat_pb2_grpc.add_ChatServiceServicer_to_server(service, server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    return port, lambda: server.stop(None)
+
+
+def serve_async(service, metrics=None):
+    """Starts the grpc.aio server start.py runs with --async, on its own event loop thread. Returns (port, stop function)."""
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    async_service = AsyncChatService(service)
+
+    async def start():
+        server = grpc.aio.server(interceptors=[AsyncMetricsInterceptor(metrics)] if metrics else [])
+        chat_pb2_grpc.add_ChatServiceServicer_to_server(async_service, server)
+        port = server.add_insecure_port("localhost:0")
+        await server.start()
+        return server, port
+
+    server, port = asyncio.run_coroutine_threadsafe(start(), loop).result()
+
+    def stop():
+        asyncio.run_coroutine_threadsafe(server.stop(None), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        async_service.close()
+
+    return port, stop
+
+
+def bench_open_streams(stream_counts=(0, 5, 10, 100, 1000), iterations=200, timeout=2.0):
+    """
+    Measures login latency while many clients hold SubscribeMessages streams open, on the
+    thread-pool server and on the grpc.aio server. Each open stream keeps one of the
+    thread-pool server's 10 workers busy, so once they are all taken its calls time out.
+
+    Args:
+    - stream_counts (tuple): The numbers of open streams to measure at.
+    - iterations (int): How many logins to time per server and stream count.
+    - timeout (float): Deadline in seconds for each login.
+
+    Returns:
+    A list of (stream_count, {server: mean latency in microseconds, or nan if calls timed out}) tuples.
+    """
+    results = []
+    for stream_count in stream_counts:
+        latencies = {}
+        for name, serve in (("threads", serve_threaded), ("aio", serve_async)):
+            with tempfile.TemporaryDirectory() as tmpdir:
+                db = os.path.join(tmpdir, "user_database")
+                populate_db(db, max(stream_count, 1))
+                service = ChatService()
+                service.start_db(db)
+                port, stop = serve(service)
+                channel = grpc.insecure_channel("localhost:" + str(port))
+                stub = chat_pb2_grpc.ChatServiceStub(channel)
+                streams = [
+                    stub.SubscribeMessages(chat_pb2.ClientMessage(info="user" + str(i))) for i in range(stream_count)
+                ]
+                request = chat_pb2.ClientMessage(info="user0")
+                try:
+                    start = time.perf_counter()
+                    for _ in range(iterations):
+                        stub.LoginClient(request, timeout=timeout)
+                    latencies[name] = (time.perf_counter() - start) / iterations * 1e6
+                except grpc.RpcError:
+                    latencies[name] = float("nan")
+                for stream in streams:
+                    stream.cancel()
+                channel.close()
+                stop()
+                service.close_db()
+        results.append((stream_count, latencies))
+    return results
+
+
+def worker_main(db, port, worker_count, index):
+    """Runs one server worker process the way start.py --workers does, until terminated."""
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10), options=(("grpc.so_reuseport", 1),))
+    service = ChatService()
+    service.start_db(db)
+    service.start_bus(db + ".workers", index, worker_count)
+    chat_pb2_grpc.add_ChatServiceServicer_to_server(service, server)
+    server.add_insecure_port("localhost:" + str(port))
+    server.start()
+    server.wait_for_termination()
+
+
+def client_main(port, client_index, recipient_count, message_count, start):
+    """Sends message_count messages over its own connection once start is set."""
+    channel = grpc.insecure_channel("localhost:" + str(port))
+    grpc.channel_ready_future(channel).result(timeout=10)
+    stub = chat_pb2_grpc.ChatServiceStub(channel)
+    start.wait()
+    for i in range(message_count):
+        receiver = "user" + str((client_index + i) % recipient_count)
+        stub.SendMessage(chat_pb2.SendRequest(sender="user0", receiver=receiver, body="hello"))
+    channel.close()
+
+
+def bench_workers(worker_counts=(1, 2, 4), client_count=8, recipient_count=1000, message_count=4000):
+    """
+    Measures send throughput through gRPC as the number of server worker processes
+    grows. Each worker is a separate process on the same port, as with start.py
+    --workers, and the load comes from client_count processes with a connection each,
+    which the kernel spreads across the workers.
+
+    Args:
+    - worker_counts (tuple): The worker counts to measure at.
+    - client_count (int): Number of client processes sending at once.
+    - recipient_count (int): Number of accounts the messages are spread across.
+    - message_count (int): Number of messages sent per worker count, split across clients.
+
+    Returns:
+    A list of (worker_count, {"send": messages per second}) tuples.
+    """
+    # forked so the children share this module; no grpc object exists in this process
+    context = multiprocessing.get_context("fork")
+    results = []
+    for worker_count in worker_counts:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db = os.path.join(tmpdir, "user_database")
+            populate_db(db, recipient_count)
+            with socket.socket() as probe:
+                probe.bind(("localhost", 0))
+                port = probe.getsockname()[1]
+            workers = [
+                context.Process(target=worker_main, args=(db, port, worker_count, index), daemon=True)
+                for index in range(worker_count)
+            ]
+            for worker in workers:
+                worker.start()
+            start = context.Event()
+            clients = [
+                context.Process(
+                    target=client_main,
+                    args=(port, index, recipient_count, message_count // client_count, start),
+                )
+                for index in range(client_count)
+            ]
+            for client in clients:
+                client.start()
+            # give every client time to connect before the clock starts
+            time.sleep(2)
+            begin = time.perf_counter()
+            start.set()
+            for client in clients:
+                client.join()
+            elapsed = time.perf_counter() - begin
+            for worker in workers:
+                worker.terminate()
+                worker.join()
+        results.append((worker_count, {"send": message_count // client_count * client_count / elapsed}))
+    return results
+
+
+# relative weights of the operations each simulated client picks from
+DEFAULT_MIX = {"create": 1, "login": 4, "send": 4, "view": 1}
+
+
+def parse_mix(text):
+    """
+    Parses an operation mix such as "create=1,login=4,send=4,view=1".
+
+    Args:
+    - text (str): Comma-separated operation=weight pairs.
+
+    Returns:
+    dict: Maps each operation to its weight.
+
+    Raises:
+    ValueError: If an operation is unknown or a weight is not a number.
+    """
+    mix = {}
+    for pair in text.split(","):
+        operation, weight = pair.split("=")
+        if operation not in DEFAULT_MIX:
+            raise ValueError("unknown operation " + operation + "; use " + ", ".join(DEFAULT_MIX))
+        mix[operation] = float(weight)
+    return mix
+
+
+def percentile(samples, fraction):
+    """Returns the nearest-rank percentile of a sorted, non-empty list."""
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+def run_load_client(address, index, requests, mix, account_count, results, seed):
+    """
+    One simulated client: opens its own connection and makes requests picked at random
+    from the mix, recording each call's latency.
+
+    Args:
+    - address (str): host:port of the server.
+    - index (int): This client's number, which keeps the accounts it creates distinct.
+    - requests (int): How many calls to make.
+    - mix (dict): Relative weight of each operation.
+    - account_count (int): Number of accounts created before the run, user0 onwards.
+    - results (dict): Maps each operation to a list of (seconds, succeeded) samples,
+      appended to without a lock since list.append is atomic.
+    - seed (int): Seed for this client's choices, so runs are repeatable.
+
+    Returns:
+    None
+    """
+    rng = random.Random(seed * 1000003 + index)
+    # a channel of its own, so every client has its own connection, as real clients would
+    channel = grpc.insecure_channel(address, options=(("grpc.use_local_subchannel_pool", 1),))
+    stub = chat_pb2_grpc.ChatServiceStub(channel)
+    operations, weights = list(mix), list(mix.values())
+    for i in range(requests):
+        operation = rng.choices(operations, weights)[0]
+        if operation == "create":
+            call, request = stub.CreateAccountClient, chat_pb2.ClientMessage(info="new" + str(index) + "-" + str(i))
+        elif operation == "login":
+            call, request = stub.LoginClient, chat_pb2.ClientMessage(info="user" + str(rng.randrange(account_count)))
+        elif operation == "send":
+            call, request = stub.SendMessage, chat_pb2.SendRequest(
+                sender="user" + str(rng.randrange(account_count)),
+                receiver="user" + str(rng.randrange(account_count)),
+                body="hello",
+            )
+        else:
+            # reads the first page without acknowledging it, so inboxes keep their size
+            call, request = stub.FetchMessages, chat_pb2.FetchRequest(
+                user="user" + str(rng.randrange(account_count)), limit=100
+            )
+        start = time.perf_counter()
+        try:
+            call(request, timeout=30)
+            succeeded = True
+        except grpc.RpcError:
+            succeeded = False
+        results[operation].append((time.perf_counter() - start, succeeded))
+    channel.close()
+
+
+def bench_load(clients=8, requests=4000, mix=None, account_count=1000, inbox_size=10, group_commit_ms=None,
+               use_async=False, seed=0, use_metrics=False, mailbox_cache_mb=None):
+    """
+    Runs a ChatService on an ephemeral port with a temp database and drives it with
+    concurrent clients making a mix of calls through gRPC.
+
+    Args:
+    - clients (int): Number of simulated clients, each on its own thread and connection.
+    - requests (int): Total calls, split evenly across the clients.
+    - mix (dict): Relative weight of create, login, send and view, DEFAULT_MIX if None.
+      A view fetches the first page of an inbox.
+    - account_count (int): Accounts created before the run.
+    - inbox_size (int): Messages waiting in every account's inbox before the run.
+    - group_commit_ms (float): Group commit window of the server, or None.
+    - use_async (bool): Serve on grpc.aio, as start.py --async does.
+    - seed (int): Seed for the clients' choices.
+    - use_metrics (bool): Count every call with the metrics interceptor, as start.py
+      --metrics-port does, to measure what it costs.
+    - mailbox_cache_mb (float): Size of the server's mailbox cache, as start.py
+      --mailbox-cache-mb sets it, or None for none.
+
+    Returns:
+    dict: The settings, and throughput and latency percentiles overall and per RPC,
+    ready to dump as JSON.
+    """
+    mix = mix or DEFAULT_MIX
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = os.path.join(tmpdir, "user_database")
+        populate_db(db, account_count)
+        if inbox_size:
+            conn = sqlite3.connect(db)
+            conn.executemany(
+                "INSERT INTO messages (sender, receiver, body, created_at) VALUES (?, ?, ?, ?)",
+                (("user0", "user" + str(i), "hello", time.time()) for i in range(account_count) for _ in range(inbox_size)),
+            )
+            conn.commit()
+            conn.close()
+        service = ChatService()
+        service.start_db(db, group_commit_ms)
+        if mailbox_cache_mb is not None:
+            service.start_mailboxes(int(mailbox_cache_mb * (1 << 20)))
+        port, stop = (serve_async if use_async else serve_threaded)(service, Metrics() if use_metrics else None)
+
+        results = {operation: [] for operation in mix}
+        threads = [
+            threading.Thread(
+                target=run_load_client,
+                args=("localhost:" + str(port), index, requests // clients, mix, account_count, results, seed),
+            )
+            for index in range(clients)
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        stop()
+        service.close_db()
+
+    report = {
+        "settings": {
+            "clients": clients, "requests": requests, "mix": mix, "accounts": account_count,
+            "inbox_size": inbox_size, "group_commit_ms": group_commit_ms, "async": use_async, "seed": seed,
+            "metrics": use_metrics, "mailbox_cache_mb": mailbox_cache_mb,
+        },
+        "seconds": elapsed,
+        "throughput": sum(len(samples) for samples in results.values()) / elapsed,
+        "rpcs": {},
+    }
+    for operation, samples in results.items():
+        if not samples:
+            continue
+        latencies = sorted(seconds * 1000 for seconds, _ in samples)
+        report["rpcs"][operation] = {
+            "calls": len(samples),
+            "errors": sum(1 for _, succeeded in samples if not succeeded),
+            "throughput": len(samples) / elapsed,
+            "mean_ms": sum(latencies) / len(latencies),
+            "p50_ms": percentile(latencies, 0.50),
+            "p95_ms": percentile(latencies, 0.95),
+            "p99_ms": percentile(latencies, 0.99),
+        }
+    return report
+
+
+def parse_load_args(argv):
+    """
+    Parses the flags accepted after `benchmark.py load`.
+
+    Args:
+    - argv (list): The command line arguments following "load".
+
+    Returns:
+    An argparse.Namespace with the load settings.
+    """
+    parser = argparse.ArgumentParser(prog="benchmark.py load")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent simulated clients")
+    parser.add_argument("--requests", type=int, default=4000, help="total calls across all clients")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help="relative weights of the operations, e.g. create=1,login=4,send=4,view=1")
+    parser.add_argument("--accounts", type=int, default=1000, help="accounts created before the run")
+    parser.add_argument("--inbox-size", type=int, default=10, help="messages waiting in every inbox before the run")
+    parser.add_argument("--group-commit-ms", type=float, default=None, help="group commit window of the server")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="serve on grpc.aio")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the clients' choices")
+    parser.add_argument("--metrics", dest="use_metrics", action="store_true",
+                        help="count every call with the metrics interceptor")
+    parser.add_argument("--mailbox-cache-mb", type=float, default=None,
+                        help="serve inboxes from a write-back cache of this many MiB")
+    parser.add_argument("--output", default=None, help="write the JSON report to this file instead of stdout")
+    return parser.parse_args(argv)
+
+
+class QueueMailbox:
+    """The mailbox layout User had before it was made compact, with two queue.Queue objects per user."""
+
+    def __init__(self, username):
+        self.username = username
+        self.logged_in = True
+        self.undelivered_messages = queue.Queue()
+        self.immediate_messages = queue.Queue()
+
+
+def mailbox_bytes(layout, usernames):
+    """Returns the memory taken by one idle mailbox of the given layout per username, in bytes."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    mailboxes = [layout(username) for username in usernames]
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del mailboxes
+    return used
+
+
+def bench_mailbox_memory(user_counts=(1000, 100000, 1000000), queue_sample=20000):
+    """
+    Measures the memory idle users' mailboxes take, compact User against the former
+    layout with two queue.Queue objects each. Usernames are allocated beforehand, so
+    only the mailboxes are counted.
+
+    Args:
+    - user_counts (tuple): The numbers of users to measure at.
+    - queue_sample (int): The most queue-based mailboxes to allocate; larger counts are
+      scaled up from this many, as a million of them take several gigabytes.
+
+    Returns:
+    A list of (user_count, {"compact": MiB, "queues": MiB}) tuples.
+    """
+    results = []
+    for user_count in user_counts:
+        usernames = ["user" + str(i) for i in range(user_count)]
+        sample = usernames[:queue_sample]
+        results.append((user_count, {
+            "compact": mailbox_bytes(User, usernames) / (1 << 20),
+            "queues": mailbox_bytes(QueueMailbox, sample) * user_count / len(sample) / (1 << 20),
+        }))
+    return results
+
+
+def print_results(results, label="accounts", unit="us"):
+    """Prints benchmark results as a table with one row per measured setting."""
+    names = list(results[0][1].keys())
+    print(label.rjust(10) + "".join((name + " (" + unit + ")").rjust(20) for name in names))
+    for setting, values in results:
+        print(str(setting).rjust(10) + "".join(("%.1f" % values[name]).rjust(20) for name in names))
+
+
+if __name__ == "__main__":
+
+  if len(sys.argv) < 2 or sys.argv[1] == "accounts":
+    print_results(bench_account_scaling())
+
+  elif sys.argv[1] == "send":
+    # a commit per send is one SQLite writer at a time whatever the locking, so this
+    # measures with group commit, to many receivers and to few that share lock stripes
+    runs = {
+        "1000 users": bench_send_scaling(group_commit_ms=2.0),
+        "10 users": bench_send_scaling(recipient_count=10, group_commit_ms=2.0),
+    }
+    worker_counts = [workers for workers, _ in runs["1000 users"]]
+    print_results(
+        [(workers, {name: run[i][1]["send"] for name, run in runs.items()}) for i, workers in enumerate(worker_counts)],
+        label="workers", unit="msg/s",
+    )
+
+  elif sys.argv[1] == "groupcommit":
+    runs = {
+        "commit each": bench_send_scaling(),
+        "group 0ms": bench_send_scaling(group_commit_ms=0),
+        "group 2ms": bench_send_scaling(group_commit_ms=2.0),
+    }
+    worker_counts = [workers for workers, _ in runs["commit each"]]
+    print_results(
+        [(workers, {name: run[i][1]["send"] for name, run in runs.items()}) for i, workers in enumerate(worker_counts)],
+        label="workers", unit="msg/s",
+    )
+
+  elif sys.argv[1] == "bootstrap":
+    print_results(bench_bootstrap(), label="messages", unit="ms")
+
+  elif sys.argv[1] == "streams":
+    print_results(bench_open_streams(), label="streams", unit="us")
+
+  elif sys.argv[1] == "workers":
+    print_results(bench_workers(), label="workers", unit="msg/s")
+
+  elif sys.argv[1] == "mailboxes":
+    print_results(bench_mailbox_memory(), label="users", unit="MiB")
+
+  elif sys.argv[1] == "load":
+    args = parse_load_args(sys.argv[2:])
+    report = bench_load(args.clients, args.requests, args.mix, args.accounts, args.inbox_size,
+                        args.group_commit_ms, args.use_async, args.seed, args.use_metrics, args.mailbox_cache_mb)
+    if args.output:
+      with open(args.output, "w") as output:
+        json.dump(report, output, indent=2)
+    else:
+      print(json.dumps(report, indent=2))
+
+  else:
+    print("please specify a benchmark: accounts, send, groupcommit, bootstrap, streams, workers, mailboxes, load")
@@ -13,19 +13,61 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\nchat.proto\"\x1d\n\rClientMessage\x12\x0c\n\x04info\x18\x01 \x01(\t\"B\n\rServerMessage\x12#\n\toperation\x18\x01 \x01(\x0e\x32\x10.ServerOperation\x12\x0c\n\x04info\x18\x02 \x01(\t*\xb4\x01\n\x0fServerOperation\x12\x0b\n\x07SUCCESS\x10\x00\x12\x0b\n\x07\x46\x41ILURE\x10\x01\x12\x1a\n\x16\x41\x43\x43OUNT_ALREADY_EXISTS\x10\x02\x12\x1a\n\x16\x41\x43\x43OUNT_DOES_NOT_EXIST\x10\x03\x12\x14\n\x10LIST_OF_ACCOUNTS\x10\x04\x12\x14\n\x10LIST_OF_MESSAGES\x10\x05\x12\x0f\n\x0bNO_MESSAGES\x10\x06\x12\x12\n\x0eMESSAGES_EXIST\x10\x07\x32\xc8\x03\n\x0b\x43hatService\x12/\n\x0bLoginClient\x12\x0e.ClientMessage\x1a\x0e.ServerMessage\"\x00\x12\x37\n\x13\x43reateAccountClient\x12\x0e.ClientMessage\x1a\x0e.ServerMessage\"\x00\x12\x37\n\x13\x44\x65leteAccountClient\x12\x0e.ClientMessage\x1a\x0e.ServerMessage\"\x00\x12\x35\n\x11ListAccountClient\x12\x0e.ClientMessage\x1a\x0e.ServerMessage\"\x00\x12\x35\n\x11SendMessageClient\x12\x0e.ClientMessage\x1a\x0e.ServerMessage\"\x00\x12\x35\n\x11ViewMessageClient\x12\x0e.ClientMessage\x1a\x0e.ServerMessage\"\x00\x12\x30\n\x0cLogoutClient\x12\x0e.ClientMessage\x1a\x0e.ServerMessage\"\x00\x12?\n\x1b\x43heckIncomingMessagesClient\x12\x0e.ClientMessage\x1a\x0e.ServerMessage\"\x00\x62\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\nchat.proto\"\x1d\n\rClientMessage\x12\x0c\n\x04info\x18\x01 \x01(\t\"B\n\rServerMessage\x12#\n\toperation\x18\x01 \x01(\x0e\x32\x10.ServerOperation\x12\x0c\n\x04info\x18\x02 \x01(\t\"=\n\x0bSendRequest\x12\x0e\n\x06sender\x18\x01 \x01(\t\x12\x10\n\x08receiver\x18\x02 \x01(\t\x12\x0c\n\x04\x62ody\x18\x03 \x01(\t\"F\n\x07Message\x12\n\n\x02id\x18\x01 \x01(\x03\x12\x0e\n\x06sender\x18\x02 \x01(\t\x12\x0c\n\x04\x62ody\x18\x03 \x01(\t\x12\x11\n\ttimestamp\x18\x04 \x01(\x01\"H\n\x05Inbox\x12#\n\toperation\x18\x01 \x01(\x0e\x32\x10.ServerOperation\x12\x1a\n\x08messages\x18\x02 \x03(\x0b\x32\x08.Message\"I\n\x13ListAccountsRequest\x12\x0f\n\x07pattern\x18\x01 \x01(\t\x12\x11\n\tpage_size\x18\x02 \x01(\x05\x12\x0e\n\x06\x63ursor\x18\x03 \x01(\t\"5\n\x0b\x41\x63\x63ountPage\x12\x11\n\tusernames\x18\x01 \x03(\t\x12\x13\n\x0bnext_cursor\x18\x02 \x01(\t\"=\n\x0c\x46\x65tchRequest\x12\x0c\n\x04user\x18\x01 \x01(\t\x12\x10\n\x08\x61\x66ter_id\x18\x02 \x01(\x03\x12\r\n\x05limit\x18\x03 \x01(\x05\",\n\nAckRequest\x12\x0c\n\x04user\x18\x01 \x01(\t\x12\x10\n\x08up_to_id\x18\x02 \x01(\x03\"3\n\rBulkSendReply\x12\"\n\x08statuses\x18\x01 \x03(\x0e\x32\x10.ServerOperation\"}\n\x08LogEntry\x12\x0b\n\x03seq\x18\x01 \x01(\x03\x12\x11\n\toperation\x18\x02 \x01(\t\x12\x0c\n\x04user\x18\x03 \x01(\t\x12\x0e\n\x06sender\x18\x04 \x01(\t\x12\x0c\n\x04\x62ody\x18\x05 \x01(\t\x12\x12\n\nmessage_id\x18\x06 \x01(\x03\x12\x11\n\ttimestamp\x18\x07 \x01(\x01\"]\n\rAppendRequest\x12\x12\n\nleader_seq\x18\x01 \x01(\x03\x12\x1a\n\x07\x65ntries\x18\x02 \x03(\x0b\x32\t.LogEntry\x12\x0c\n\x04term\x18\x03 \x01(\x03\x12\x0e\n\x06leader\x18\x04 \x01(\t\"A\n\x0b\x41ppendReply\x12\x0f\n\x07success\x18\x01 \x01(\x08\x12\x13\n\x0b\x61pplied_seq\x18\x02 \x01(\x03\x12\x0c\n\x04term\x18\x03 \x01(\x03\"B\n\x0fReplicaProgress\x12\x0f\n\x07\x61\x64\x64ress\x18\x01 \x01(\t\x12\x11\n\tacked_seq\x18\x02 \x01(\x03\x12\x0b\n\x03lag\x18\x03 \x01(\x03\"\x80\x01\n\x16ReplicationStatusReply\x12\x0c\n\x04role\x18\x01 \x01(\t\x12\x13\n\x0b\x61pplied_seq\x18\x02 \x01(\x03\x12\x12\n\nleader_seq\x18\x03 \x01(\x03\x12\x0b\n\x03lag\x18\x04 \x01(\x03\x12\"\n\x08replicas\x18\x05 \x03(\x0b\x32\x10.ReplicaProgress\".\n\nLogRequest\x12\x11\n\tafter_seq\x18\x01 \x01(\x03\x12\r\n\x05limit\x18\x02 \x01(\x05\"*\n\nUserDigest\x12\x0c\n\x04user\x18\x01 \x01(\t\x12\x0e\n\x06\x64igest\x18\x02 \x01(\t\"?\n\nDigestPage\x12\x1c\n\x07\x64igests\x18\x01 \x03(\x0b\x32\x0b.UserDigest\x12\x13\n\x0bnext_cursor\x18\x02 \x01(\t\"*\n\rSnapshotChunk\x12\x0b\n\x03seq\x18\x01 \x01(\x03\x12\x0c\n\x04\x64\x61ta\x18\x02 \x01(\x0c\"@\n\x0bVoteRequest\x12\x0c\n\x04term\x18\x01 \x01(\x03\x12\x11\n\tcandidate\x18\x02 \x01(\t\x12\x10\n\x08last_seq\x18\x03 \x01(\x03\"*\n\tVoteReply\x12\x0c\n\x04term\x18\x01 \x01(\x03\x12\x0f\n\x07granted\x18\x02 \x01(\x08\"<\n\x0bLeaderReply\x12\x0e\n\x06leader\x18\x01 \x01(\t\x12\x0c\n\x04term\x18\x02 \x01(\x03\x12\x0f\n\x07\x61\x64\x64ress\x18\x03 \x01(\t*\xb4\x01\n\x0fServerOperation\x12\x0b\n\x07SUCCESS\x10\x00\x12\x0b\n\x07\x46\x41ILURE\x10\x01\x12\x1a\n\x16\x41\x43\x43OUNT_ALREADY_EXISTS\x10\x02\x12\x1a\n\x16\x41\x43\x43OUNT_DOES_NOT_EXIST\x10\x03\x12\x14\n\x10LIST_OF_ACCOUNTS\x10\x04\x12\x14\n\x10LIST_OF_MESSAGES\x10\x05\x12\x0f\n\x0bNO_MESSAGES\x10\x06\x12\x12\n\x0eMESSAGES_EXIST\x10\x07\x32\xc8\x06\n\x0b\x43hatService\x12/\n\x0bLoginClient\x12\x0e.ClientMessage\x1a\x0e.ServerMessage\"\x00\x12\x37\n\x13\x43reateAccountClient\x12\x0e.ClientMessage\x1a\x0e.ServerMessage\"\x00\x12\x37\n\x13\x44\x65leteAccountClient\x12\x0e.ClientMessage\x1a\x0e.ServerMessage\"\x00\x12\x35\n\x11ListAccountClient\x12\x0e.ClientMessage\x1a\x0e.ServerMessage\"\x00\x12\x35\n\x11SendMessageClient\x12\x0e.ClientMessage\x1a\x0e.ServerMessage\"\x00\x12\x35\n\x11ViewMessageClient\x12\x0e.ClientMessage\x1a\x0e.ServerMessage\"\x00\x12\x30\n\x0cLogoutClient\x12\x0e.ClientMessage\x1a\x0e.ServerMessage\"\x00\x12?\n\x1b\x43heckIncomingMessagesClient\x12\x0e.ClientMessage\x1a\x0e.ServerMessage\"\x00\x12\x37\n\x11SubscribeMessages\x12\x0e.ClientMessage\x1a\x0e.ServerMessage\"\x00\x30\x01\x12\x30\n\x0cSendMessages\x12\x0c.SendRequest\x1a\x0e.BulkSendReply\"\x00(\x01\x12-\n\x0bSendMessage\x12\x0c.SendRequest\x1a\x0e.ServerMessage\"\x00\x12%\n\tViewInbox\x12\x0e.ClientMessage\x1a\x06.Inbox\"\x00\x12\x36\n\x0cListAccounts\x12\x14.ListAccountsRequest\x1a\x0c.AccountPage\"\x00\x30\x01\x12(\n\rFetchMessages\x12\r.FetchRequest\x1a\x06.Inbox\"\x00\x12,\n\x0b\x41\x63kMessages\x12\x0b.AckRequest\x1a\x0e.ServerMessage\"\x00\x12-\n\x0bWhoIsLeader\x12\x0e.ClientMessage\x1a\x0c.LeaderReply\"\x00\x32\xf5\x02\n\x12ReplicationService\x12/\n\rAppendEntries\x12\x0e.AppendRequest\x1a\x0c.AppendReply\"\x00\x12>\n\x11ReplicationStatus\x12\x0e.ClientMessage\x1a\x17.ReplicationStatusReply\"\x00\x12+\n\x08\x46\x65tchLog\x12\x0b.LogRequest\x1a\x0e.AppendRequest\"\x00\x30\x01\x12\x33\n\rFetchSnapshot\x12\x0e.ClientMessage\x1a\x0e.SnapshotChunk\"\x00\x30\x01\x12\x32\n\x0bUserDigests\x12\x14.ListAccountsRequest\x1a\x0b.DigestPage\"\x00\x12-\n\tFetchUser\x12\x0e.ClientMessage\x1a\x0e.AppendRequest\"\x00\x12)\n\x0bRequestVote\x12\x0c.VoteRequest\x1a\n.VoteReply\"\x00\x62\x06proto3')
 
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, globals())
 _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'chat_pb2', globals())
 if _descriptor._USE_C_DESCRIPTORS == False:
 
   DESCRIPTOR._options = None
-  _SERVEROPERATION._serialized_start=114
-  _SERVEROPERATION._serialized_end=294
+  _SERVEROPERATION._serialized_start=1476
+  _SERVEROPERATION._serialized_end=1656
   _CLIENTMESSAGE._serialized_start=14
   _CLIENTMESSAGE._serialized_end=43
   _SERVERMESSAGE._serialized_start=45
   _SERVERMESSAGE._serialized_end=111
-  _CHATSERVICE._serialized_start=297
-  _CHATSERVICE._serialized_end=753
+  _SENDREQUEST._serialized_start=113
+  _SENDREQUEST._serialized_end=174
+  _MESSAGE._serialized_start=176
+  _MESSAGE._serialized_end=246
+  _INBOX._serialized_start=248
+  _INBOX._serialized_end=320
+  _LISTACCOUNTSREQUEST._serialized_start=322
+  _LISTACCOUNTSREQUEST._serialized_end=395
+  _ACCOUNTPAGE._serialized_start=397
+  _ACCOUNTPAGE._serialized_end=450
+  _FETCHREQUEST._serialized_start=452
+  _FETCHREQUEST._serialized_end=513
+  _ACKREQUEST._serialized_start=515
+  _ACKREQUEST._serialized_end=559
+  _BULKSENDREPLY._serialized_start=561
+  _BULKSENDREPLY._serialized_end=612
+  _LOGENTRY._serialized_start=614
+  _LOGENTRY._serialized_end=739
+  _APPENDREQUEST._serialized_start=741
+  _APPENDREQUEST._serialized_end=834
+  _APPENDREPLY._serialized_start=836
+  _APPENDREPLY._serialized_end=901
+  _REPLICAPROGRESS._serialized_start=903
+  _REPLICAPROGRESS._serialized_end=969
+  _REPLICATIONSTATUSREPLY._serialized_start=972
+  _REPLICATIONSTATUSREPLY._serialized_end=1100
+  _LOGREQUEST._serialized_start=1102
+  _LOGREQUEST._serialized_end=1148
+  _USERDIGEST._serialized_start=1150
+  _USERDIGEST._serialized_end=1192
+  _DIGESTPAGE._serialized_start=1194
+  _DIGESTPAGE._serialized_end=1257
+  _SNAPSHOTCHUNK._serialized_start=1259
+  _SNAPSHOTCHUNK._serialized_end=1301
+  _VOTEREQUEST._serialized_start=1303
+  _VOTEREQUEST._serialized_end=1367
+  _VOTEREPLY._serialized_start=1369
+  _VOTEREPLY._serialized_end=1411
+  _LEADERREPLY._serialized_start=1413
+  _LEADERREPLY._serialized_end=1473
+  _CHATSERVICE._serialized_start=1659
+  _CHATSERVICE._serialized_end=2499
+  _REPLICATIONSERVICE._serialized_start=2502
+  _REPLICATIONSERVICE._serialized_end=2875
 # @@protoc_insertion_point(module_scope)
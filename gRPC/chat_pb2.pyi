@@ -1,7 +1,8 @@
+from google.protobuf.internal import containers as _containers
 from google.protobuf.internal import enum_type_wrapper as _enum_type_wrapper
 from google.protobuf import descriptor as _descriptor
 from google.protobuf import message as _message
-from typing import ClassVar as _ClassVar, Optional as _Optional, Union as _Union
+from typing import ClassVar as _ClassVar, Iterable as _Iterable, Mapping as _Mapping, Optional as _Optional, Union as _Union
 
 ACCOUNT_ALREADY_EXISTS: ServerOperation
 ACCOUNT_DOES_NOT_EXIST: ServerOperation
@@ -13,12 +14,174 @@ MESSAGES_EXIST: ServerOperation
 NO_MESSAGES: ServerOperation
 SUCCESS: ServerOperation
 
+class AccountPage(_message.Message):
+    __slots__ = ["next_cursor", "usernames"]
+    NEXT_CURSOR_FIELD_NUMBER: _ClassVar[int]
+    USERNAMES_FIELD_NUMBER: _ClassVar[int]
+    next_cursor: str
+    usernames: _containers.RepeatedScalarFieldContainer[str]
+    def __init__(self, usernames: _Optional[_Iterable[str]] = ..., next_cursor: _Optional[str] = ...) -> None: ...
+
+class AckRequest(_message.Message):
+    __slots__ = ["up_to_id", "user"]
+    UP_TO_ID_FIELD_NUMBER: _ClassVar[int]
+    USER_FIELD_NUMBER: _ClassVar[int]
+    up_to_id: int
+    user: str
+    def __init__(self, user: _Optional[str] = ..., up_to_id: _Optional[int] = ...) -> None: ...
+
+class AppendReply(_message.Message):
+    __slots__ = ["applied_seq", "success", "term"]
+    APPLIED_SEQ_FIELD_NUMBER: _ClassVar[int]
+    SUCCESS_FIELD_NUMBER: _ClassVar[int]
+    TERM_FIELD_NUMBER: _ClassVar[int]
+    applied_seq: int
+    success: bool
+    term: int
+    def __init__(self, success: bool = ..., applied_seq: _Optional[int] = ..., term: _Optional[int] = ...) -> None: ...
+
+class AppendRequest(_message.Message):
+    __slots__ = ["entries", "leader", "leader_seq", "term"]
+    ENTRIES_FIELD_NUMBER: _ClassVar[int]
+    LEADER_FIELD_NUMBER: _ClassVar[int]
+    LEADER_SEQ_FIELD_NUMBER: _ClassVar[int]
+    TERM_FIELD_NUMBER: _ClassVar[int]
+    entries: _containers.RepeatedCompositeFieldContainer[LogEntry]
+    leader: str
+    leader_seq: int
+    term: int
+    def __init__(self, leader_seq: _Optional[int] = ..., entries: _Optional[_Iterable[_Union[LogEntry, _Mapping]]] = ..., term: _Optional[int] = ..., leader: _Optional[str] = ...) -> None: ...
+
+class BulkSendReply(_message.Message):
+    __slots__ = ["statuses"]
+    STATUSES_FIELD_NUMBER: _ClassVar[int]
+    statuses: _containers.RepeatedScalarFieldContainer[ServerOperation]
+    def __init__(self, statuses: _Optional[_Iterable[_Union[ServerOperation, str]]] = ...) -> None: ...
+
 class ClientMessage(_message.Message):
     __slots__ = ["info"]
     INFO_FIELD_NUMBER: _ClassVar[int]
     info: str
     def __init__(self, info: _Optional[str] = ...) -> None: ...
 
+class DigestPage(_message.Message):
+    __slots__ = ["digests", "next_cursor"]
+    DIGESTS_FIELD_NUMBER: _ClassVar[int]
+    NEXT_CURSOR_FIELD_NUMBER: _ClassVar[int]
+    digests: _containers.RepeatedCompositeFieldContainer[UserDigest]
+    next_cursor: str
+    def __init__(self, digests: _Optional[_Iterable[_Union[UserDigest, _Mapping]]] = ..., next_cursor: _Optional[str] = ...) -> None: ...
+
+class FetchRequest(_message.Message):
+    __slots__ = ["after_id", "limit", "user"]
+    AFTER_ID_FIELD_NUMBER: _ClassVar[int]
+    LIMIT_FIELD_NUMBER: _ClassVar[int]
+    USER_FIELD_NUMBER: _ClassVar[int]
+    after_id: int
+    limit: int
+    user: str
+    def __init__(self, user: _Optional[str] = ..., after_id: _Optional[int] = ..., limit: _Optional[int] = ...) -> None: ...
+
+class Inbox(_message.Message):
+    __slots__ = ["messages", "operation"]
+    MESSAGES_FIELD_NUMBER: _ClassVar[int]
+    OPERATION_FIELD_NUMBER: _ClassVar[int]
+    messages: _containers.RepeatedCompositeFieldContainer[Message]
+    operation: ServerOperation
+    def __init__(self, operation: _Optional[_Union[ServerOperation, str]] = ..., messages: _Optional[_Iterable[_Union[Message, _Mapping]]] = ...) -> None: ...
+
+class LeaderReply(_message.Message):
+    __slots__ = ["address", "leader", "term"]
+    ADDRESS_FIELD_NUMBER: _ClassVar[int]
+    LEADER_FIELD_NUMBER: _ClassVar[int]
+    TERM_FIELD_NUMBER: _ClassVar[int]
+    address: str
+    leader: str
+    term: int
+    def __init__(self, leader: _Optional[str] = ..., term: _Optional[int] = ..., address: _Optional[str] = ...) -> None: ...
+
+class ListAccountsRequest(_message.Message):
+    __slots__ = ["cursor", "page_size", "pattern"]
+    CURSOR_FIELD_NUMBER: _ClassVar[int]
+    PAGE_SIZE_FIELD_NUMBER: _ClassVar[int]
+    PATTERN_FIELD_NUMBER: _ClassVar[int]
+    cursor: str
+    page_size: int
+    pattern: str
+    def __init__(self, pattern: _Optional[str] = ..., page_size: _Optional[int] = ..., cursor: _Optional[str] = ...) -> None: ...
+
+class LogEntry(_message.Message):
+    __slots__ = ["body", "message_id", "operation", "sender", "seq", "timestamp", "user"]
+    BODY_FIELD_NUMBER: _ClassVar[int]
+    MESSAGE_ID_FIELD_NUMBER: _ClassVar[int]
+    OPERATION_FIELD_NUMBER: _ClassVar[int]
+    SENDER_FIELD_NUMBER: _ClassVar[int]
+    SEQ_FIELD_NUMBER: _ClassVar[int]
+    TIMESTAMP_FIELD_NUMBER: _ClassVar[int]
+    USER_FIELD_NUMBER: _ClassVar[int]
+    body: str
+    message_id: int
+    operation: str
+    sender: str
+    seq: int
+    timestamp: float
+    user: str
+    def __init__(self, seq: _Optional[int] = ..., operation: _Optional[str] = ..., user: _Optional[str] = ..., sender: _Optional[str] = ..., body: _Optional[str] = ..., message_id: _Optional[int] = ..., timestamp: _Optional[float] = ...) -> None: ...
+
+class LogRequest(_message.Message):
+    __slots__ = ["after_seq", "limit"]
+    AFTER_SEQ_FIELD_NUMBER: _ClassVar[int]
+    LIMIT_FIELD_NUMBER: _ClassVar[int]
+    after_seq: int
+    limit: int
+    def __init__(self, after_seq: _Optional[int] = ..., limit: _Optional[int] = ...) -> None: ...
+
+class Message(_message.Message):
+    __slots__ = ["body", "id", "sender", "timestamp"]
+    BODY_FIELD_NUMBER: _ClassVar[int]
+    ID_FIELD_NUMBER: _ClassVar[int]
+    SENDER_FIELD_NUMBER: _ClassVar[int]
+    TIMESTAMP_FIELD_NUMBER: _ClassVar[int]
+    body: str
+    id: int
+    sender: str
+    timestamp: float
+    def __init__(self, id: _Optional[int] = ..., sender: _Optional[str] = ..., body: _Optional[str] = ..., timestamp: _Optional[float] = ...) -> None: ...
+
+class ReplicaProgress(_message.Message):
+    __slots__ = ["acked_seq", "address", "lag"]
+    ACKED_SEQ_FIELD_NUMBER: _ClassVar[int]
+    ADDRESS_FIELD_NUMBER: _ClassVar[int]
+    LAG_FIELD_NUMBER: _ClassVar[int]
+    acked_seq: int
+    address: str
+    lag: int
+    def __init__(self, address: _Optional[str] = ..., acked_seq: _Optional[int] = ..., lag: _Optional[int] = ...) -> None: ...
+
+class ReplicationStatusReply(_message.Message):
+    __slots__ = ["applied_seq", "lag", "leader_seq", "replicas", "role"]
+    APPLIED_SEQ_FIELD_NUMBER: _ClassVar[int]
+    LAG_FIELD_NUMBER: _ClassVar[int]
+    LEADER_SEQ_FIELD_NUMBER: _ClassVar[int]
+    REPLICAS_FIELD_NUMBER: _ClassVar[int]
+    ROLE_FIELD_NUMBER: _ClassVar[int]
+    applied_seq: int
+    lag: int
+    leader_seq: int
+    replicas: _containers.RepeatedCompositeFieldContainer[ReplicaProgress]
+    role: str
+    def __init__(self, role: _Optional[str] = ..., applied_seq: _Optional[int] = ..., leader_seq: _Optional[int] = ..., lag: _Optional[int] = ..., replicas: _Optional[_Iterable[_Union[ReplicaProgress, _Mapping]]] = ...) -> None: ...
+
+class SendRequest(_message.Message):
+    __slots__ = ["body", "receiver", "sender"]
+    BODY_FIELD_NUMBER: _ClassVar[int]
+    RECEIVER_FIELD_NUMBER: _ClassVar[int]
+    SENDER_FIELD_NUMBER: _ClassVar[int]
+    body: str
+    receiver: str
+    sender: str
+    def __init__(self, sender: _Optional[str] = ..., receiver: _Optional[str] = ..., body: _Optional[str] = ...) -> None: ...
+
 class ServerMessage(_message.Message):
     __slots__ = ["info", "operation"]
     INFO_FIELD_NUMBER: _ClassVar[int]
@@ -27,5 +190,39 @@ class ServerMessage(_message.Message):
     operation: ServerOperation
     def __init__(self, operation: _Optional[_Union[ServerOperation, str]] = ..., info: _Optional[str] = ...) -> None: ...
 
+class SnapshotChunk(_message.Message):
+    __slots__ = ["data", "seq"]
+    DATA_FIELD_NUMBER: _ClassVar[int]
+    SEQ_FIELD_NUMBER: _ClassVar[int]
+    data: bytes
+    seq: int
+    def __init__(self, seq: _Optional[int] = ..., data: _Optional[bytes] = ...) -> None: ...
+
+class UserDigest(_message.Message):
+    __slots__ = ["digest", "user"]
+    DIGEST_FIELD_NUMBER: _ClassVar[int]
+    USER_FIELD_NUMBER: _ClassVar[int]
+    digest: str
+    user: str
+    def __init__(self, user: _Optional[str] = ..., digest: _Optional[str] = ...) -> None: ...
+
+class VoteReply(_message.Message):
+    __slots__ = ["granted", "term"]
+    GRANTED_FIELD_NUMBER: _ClassVar[int]
+    TERM_FIELD_NUMBER: _ClassVar[int]
+    granted: bool
+    term: int
+    def __init__(self, term: _Optional[int] = ..., granted: bool = ...) -> None: ...
+
+class VoteRequest(_message.Message):
+    __slots__ = ["candidate", "last_seq", "term"]
+    CANDIDATE_FIELD_NUMBER: _ClassVar[int]
+    LAST_SEQ_FIELD_NUMBER: _ClassVar[int]
+    TERM_FIELD_NUMBER: _ClassVar[int]
+    candidate: str
+    last_seq: int
+    term: int
+    def __init__(self, term: _Optional[int] = ..., candidate: _Optional[str] = ..., last_seq: _Optional[int] = ...) -> None: ...
+
 class ServerOperation(int, metaclass=_enum_type_wrapper.EnumTypeWrapper):
     __slots__ = []
@@ -54,6 +54,46 @@ class ChatServiceStub(object):
                 request_serializer=chat__pb2.ClientMessage.SerializeToString,
                 response_deserializer=chat__pb2.ServerMessage.FromString,
                 )
+        self.SubscribeMessages = channel.unary_stream(
+                '/ChatService/SubscribeMessages',
+                request_serializer=chat__pb2.ClientMessage.SerializeToString,
+                response_deserializer=chat__pb2.ServerMessage.FromString,
+                )
+        self.SendMessages = channel.stream_unary(
+                '/ChatService/SendMessages',
+                request_serializer=chat__pb2.SendRequest.SerializeToString,
+                response_deserializer=chat__pb2.BulkSendReply.FromString,
+                )
+        self.SendMessage = channel.unary_unary(
+                '/ChatService/SendMessage',
+                request_serializer=chat__pb2.SendRequest.SerializeToString,
+                response_deserializer=chat__pb2.ServerMessage.FromString,
+                )
+        self.ViewInbox = channel.unary_unary(
+                '/ChatService/ViewInbox',
+                request_serializer=chat__pb2.ClientMessage.SerializeToString,
+                response_deserializer=chat__pb2.Inbox.FromString,
+                )
+        self.ListAccounts = channel.unary_stream(
+                '/ChatService/ListAccounts',
+                request_serializer=chat__pb2.ListAccountsRequest.SerializeToString,
+                response_deserializer=chat__pb2.AccountPage.FromString,
+                )
+        self.FetchMessages = channel.unary_unary(
+                '/ChatService/FetchMessages',
+                request_serializer=chat__pb2.FetchRequest.SerializeToString,
+                response_deserializer=chat__pb2.Inbox.FromString,
+                )
+        self.AckMessages = channel.unary_unary(
+                '/ChatService/AckMessages',
+                request_serializer=chat__pb2.AckRequest.SerializeToString,
+                response_deserializer=chat__pb2.ServerMessage.FromString,
+                )
+        self.WhoIsLeader = channel.unary_unary(
+                '/ChatService/WhoIsLeader',
+                request_serializer=chat__pb2.ClientMessage.SerializeToString,
+                response_deserializer=chat__pb2.LeaderReply.FromString,
+                )
 
 
 class ChatServiceServicer(object):
@@ -107,6 +147,54 @@ class ChatServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def SubscribeMessages(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def SendMessages(self, request_iterator, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def SendMessage(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def ViewInbox(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def ListAccounts(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def FetchMessages(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def AckMessages(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def WhoIsLeader(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_ChatServiceServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -150,6 +238,46 @@ def add_ChatServiceServicer_to_server(servicer, server):
                     request_deserializer=chat__pb2.ClientMessage.FromString,
                     response_serializer=chat__pb2.ServerMessage.SerializeToString,
             ),
+            'SubscribeMessages': grpc.unary_stream_rpc_method_handler(
+                    servicer.SubscribeMessages,
+                    request_deserializer=chat__pb2.ClientMessage.FromString,
+                    response_serializer=chat__pb2.ServerMessage.SerializeToString,
+            ),
+            'SendMessages': grpc.stream_unary_rpc_method_handler(
+                    servicer.SendMessages,
+                    request_deserializer=chat__pb2.SendRequest.FromString,
+                    response_serializer=chat__pb2.BulkSendReply.SerializeToString,
+            ),
+            'SendMessage': grpc.unary_unary_rpc_method_handler(
+                    servicer.SendMessage,
+                    request_deserializer=chat__pb2.SendRequest.FromString,
+                    response_serializer=chat__pb2.ServerMessage.SerializeToString,
+            ),
+            'ViewInbox': grpc.unary_unary_rpc_method_handler(
+                    servicer.ViewInbox,
+                    request_deserializer=chat__pb2.ClientMessage.FromString,
+                    response_serializer=chat__pb2.Inbox.SerializeToString,
+            ),
+            'ListAccounts': grpc.unary_stream_rpc_method_handler(
+                    servicer.ListAccounts,
+                    request_deserializer=chat__pb2.ListAccountsRequest.FromString,
+                    response_serializer=chat__pb2.AccountPage.SerializeToString,
+            ),
+            'FetchMessages': grpc.unary_unary_rpc_method_handler(
+                    servicer.FetchMessages,
+                    request_deserializer=chat__pb2.FetchRequest.FromString,
+                    response_serializer=chat__pb2.Inbox.SerializeToString,
+            ),
+            'AckMessages': grpc.unary_unary_rpc_method_handler(
+                    servicer.AckMessages,
+                    request_deserializer=chat__pb2.AckRequest.FromString,
+                    response_serializer=chat__pb2.ServerMessage.SerializeToString,
+            ),
+            'WhoIsLeader': grpc.unary_unary_rpc_method_handler(
+                    servicer.WhoIsLeader,
+                    request_deserializer=chat__pb2.ClientMessage.FromString,
+                    response_serializer=chat__pb2.LeaderReply.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'ChatService', rpc_method_handlers)
@@ -295,3 +423,404 @@ class ChatService(object):
             chat__pb2.ServerMessage.FromString,
             options, channel_credentials,
             insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def SubscribeMessages(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(request, target, '/ChatService/SubscribeMessages',
+            chat__pb2.ClientMessage.SerializeToString,
+            chat__pb2.ServerMessage.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def SendMessages(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_unary(request_iterator, target, '/ChatService/SendMessages',
+            chat__pb2.SendRequest.SerializeToString,
+            chat__pb2.BulkSendReply.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def SendMessage(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/ChatService/SendMessage',
+            chat__pb2.SendRequest.SerializeToString,
+            chat__pb2.ServerMessage.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def ViewInbox(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/ChatService/ViewInbox',
+            chat__pb2.ClientMessage.SerializeToString,
+            chat__pb2.Inbox.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def ListAccounts(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(request, target, '/ChatService/ListAccounts',
+            chat__pb2.ListAccountsRequest.SerializeToString,
+            chat__pb2.AccountPage.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def FetchMessages(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/ChatService/FetchMessages',
+            chat__pb2.FetchRequest.SerializeToString,
+            chat__pb2.Inbox.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def AckMessages(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/ChatService/AckMessages',
+            chat__pb2.AckRequest.SerializeToString,
+            chat__pb2.ServerMessage.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def WhoIsLeader(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/ChatService/WhoIsLeader',
+            chat__pb2.ClientMessage.SerializeToString,
+            chat__pb2.LeaderReply.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+
+class ReplicationServiceStub(object):
+    """internal service the primary uses to stream its write log to the backups
+    """
+
+    def __init__(self, channel):
+        """Constructor.
+
+        Args:
+            channel: A grpc.Channel.
+        """
+        self.AppendEntries = channel.unary_unary(
+                '/ReplicationService/AppendEntries',
+                request_serializer=chat__pb2.AppendRequest.SerializeToString,
+                response_deserializer=chat__pb2.AppendReply.FromString,
+                )
+        self.ReplicationStatus = channel.unary_unary(
+                '/ReplicationService/ReplicationStatus',
+                request_serializer=chat__pb2.ClientMessage.SerializeToString,
+                response_deserializer=chat__pb2.ReplicationStatusReply.FromString,
+                )
+        self.FetchLog = channel.unary_stream(
+                '/ReplicationService/FetchLog',
+                request_serializer=chat__pb2.LogRequest.SerializeToString,
+                response_deserializer=chat__pb2.AppendRequest.FromString,
+                )
+        self.FetchSnapshot = channel.unary_stream(
+                '/ReplicationService/FetchSnapshot',
+                request_serializer=chat__pb2.ClientMessage.SerializeToString,
+                response_deserializer=chat__pb2.SnapshotChunk.FromString,
+                )
+        self.UserDigests = channel.unary_unary(
+                '/ReplicationService/UserDigests',
+                request_serializer=chat__pb2.ListAccountsRequest.SerializeToString,
+                response_deserializer=chat__pb2.DigestPage.FromString,
+                )
+        self.FetchUser = channel.unary_unary(
+                '/ReplicationService/FetchUser',
+                request_serializer=chat__pb2.ClientMessage.SerializeToString,
+                response_deserializer=chat__pb2.AppendRequest.FromString,
+                )
+        self.RequestVote = channel.unary_unary(
+                '/ReplicationService/RequestVote',
+                request_serializer=chat__pb2.VoteRequest.SerializeToString,
+                response_deserializer=chat__pb2.VoteReply.FromString,
+                )
+
+
+class ReplicationServiceServicer(object):
+    """internal service the primary uses to stream its write log to the backups
+    """
+
+    def AppendEntries(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def ReplicationStatus(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def FetchLog(self, request, context):
+        """entries after a sequence number, in batches, for a backup catching up after a restart
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def FetchSnapshot(self, request, context):
+        """the server's latest snapshot file, for a backup too far behind to replay the log
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def UserDigests(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def FetchUser(self, request, context):
+        """one user's account and messages as entries, as of leader_seq
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def RequestVote(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+
+def add_ReplicationServiceServicer_to_server(servicer, server):
+    rpc_method_handlers = {
+            'AppendEntries': grpc.unary_unary_rpc_method_handler(
+                    servicer.AppendEntries,
+                    request_deserializer=chat__pb2.AppendRequest.FromString,
+                    response_serializer=chat__pb2.AppendReply.SerializeToString,
+            ),
+            'ReplicationStatus': grpc.unary_unary_rpc_method_handler(
+                    servicer.ReplicationStatus,
+                    request_deserializer=chat__pb2.ClientMessage.FromString,
+                    response_serializer=chat__pb2.ReplicationStatusReply.SerializeToString,
+            ),
+            'FetchLog': grpc.unary_stream_rpc_method_handler(
+                    servicer.FetchLog,
+                    request_deserializer=chat__pb2.LogRequest.FromString,
+                    response_serializer=chat__pb2.AppendRequest.SerializeToString,
+            ),
+            'FetchSnapshot': grpc.unary_stream_rpc_method_handler(
+                    servicer.FetchSnapshot,
+                    request_deserializer=chat__pb2.ClientMessage.FromString,
+                    response_serializer=chat__pb2.SnapshotChunk.SerializeToString,
+            ),
+            'UserDigests': grpc.unary_unary_rpc_method_handler(
+                    servicer.UserDigests,
+                    request_deserializer=chat__pb2.ListAccountsRequest.FromString,
+                    response_serializer=chat__pb2.DigestPage.SerializeToString,
+            ),
+            'FetchUser': grpc.unary_unary_rpc_method_handler(
+                    servicer.FetchUser,
+                    request_deserializer=chat__pb2.ClientMessage.FromString,
+                    response_serializer=chat__pb2.AppendRequest.SerializeToString,
+            ),
+            'RequestVote': grpc.unary_unary_rpc_method_handler(
+                    servicer.RequestVote,
+                    request_deserializer=chat__pb2.VoteRequest.FromString,
+                    response_serializer=chat__pb2.VoteReply.SerializeToString,
+            ),
+    }
+    generic_handler = grpc.method_handlers_generic_handler(
+            'ReplicationService', rpc_method_handlers)
+    server.add_generic_rpc_handlers((generic_handler,))
+
+
+ # This class is part of an EXPERIMENTAL API.
+class ReplicationService(object):
+    """internal service the primary uses to stream its write log to the backups
+    """
+
+    @staticmethod
+    def AppendEntries(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/ReplicationService/AppendEntries',
+            chat__pb2.AppendRequest.SerializeToString,
+            chat__pb2.AppendReply.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def ReplicationStatus(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/ReplicationService/ReplicationStatus',
+            chat__pb2.ClientMessage.SerializeToString,
+            chat__pb2.ReplicationStatusReply.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def FetchLog(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(request, target, '/ReplicationService/FetchLog',
+            chat__pb2.LogRequest.SerializeToString,
+            chat__pb2.AppendRequest.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def FetchSnapshot(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(request, target, '/ReplicationService/FetchSnapshot',
+            chat__pb2.ClientMessage.SerializeToString,
+            chat__pb2.SnapshotChunk.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def UserDigests(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/ReplicationService/UserDigests',
+            chat__pb2.ListAccountsRequest.SerializeToString,
+            chat__pb2.DigestPage.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def FetchUser(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/ReplicationService/FetchUser',
+            chat__pb2.ClientMessage.SerializeToString,
+            chat__pb2.AppendRequest.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def RequestVote(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/ReplicationService/RequestVote',
+            chat__pb2.VoteRequest.SerializeToString,
+            chat__pb2.VoteReply.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
@@ -1,9 +1,14 @@
 import curses
+import heapq
 import threading
+import time
+from concurrent import futures
 from typing import List
-from chat_pb2 import ServerMessage
+import grpc
+from chat_pb2 import BulkSendReply, Inbox, ServerMessage
 
 from menu import menu
+from router import ReplicaRouter
 
 from chat_pb2_grpc import ChatServiceStub
 
@@ -14,6 +19,300 @@ class Client:
     SESSION_INFO = {"username": ""} # store who is logged in at the moment
     CLIENT_LOCK = threading.Lock() # dealing with thread safety in functions accessing shared resources
     RECEIVE_EVENT = threading.Event() # event for controlling the background thread listening loop
+    FETCH_LIMIT = 100 # most messages fetched from the server per chunk when viewing the inbox
+    RESUBSCRIBE_SECONDS = 1.0 # pause before retrying the servers when every subscription failed
+    VERSION_KEY = "x-data-version" # trailing metadata key servers report their data version under
+    LEADER_KEY = "x-leader" # trailing metadata key a backup names the primary under when refusing a write
+    subscription = None # the SubscribeMessages call the background thread is reading from
+
+    def __init__(self, deadline=5.0, required_acks=1, write_once=False, required_reads=1, shard_map=None):
+        """
+        Initializes a Client.
+
+        Args:
+            deadline (float): Seconds each call to a server may take before it is abandoned.
+            required_acks (int): How many servers must acknowledge a write before it returns.
+            write_once (bool): Send each write to the first server that accepts it, for
+                servers that replicate writes among themselves. Backups refuse writes,
+                so this finds the primary. required_acks is ignored.
+            required_reads (int): How many servers must answer a read; the answer from
+                the server with the newest data wins. With required_acks + required_reads
+                greater than the number of servers, every read sees every acknowledged write.
+            shard_map (ShardMap): Which servers hold which users. When given, each call
+                goes to the servers of the shard owning the username involved, instead
+                of the stubs passed to it, and listings gather every shard.
+
+        Returns:
+            None
+        """
+        self.deadline = deadline
+        self.write_once = write_once
+        self.required_acks = 1 if write_once else required_acks
+        self.required_reads = required_reads
+        # runs multi-call operations, like draining an inbox, against every server at once
+        self.executor = futures.ThreadPoolExecutor(max_workers=8)
+        # tracks each server's latency and circuit breaker to pick where calls go first
+        self.router = ReplicaRouter(probe_timeout=deadline)
+        # the stub that last accepted a write-once write, and each stub's server address
+        self.leader_stub = None
+        self.stub_addresses = {}
+        self.shard_map = shard_map
+        self.shard_stubs = {}
+        self.channels = []
+        if shard_map is not None:
+            for shard in shard_map.names():
+                channels = [grpc.insecure_channel(host) for host in shard_map.hosts(shard)]
+                self.channels.extend(channels)
+                self.shard_stubs[shard] = [ChatServiceStub(channel) for channel in channels]
+
+    def close(self):
+        """
+        Stops the router's prober, shuts down the executor and closes the channels the
+        client opened itself. Channels behind stubs passed in are left to their owner.
+
+        Returns:
+            None
+        """
+        self.router.stop()
+        self.executor.shutdown()
+        for channel in self.channels:
+            channel.close()
+
+    def route(self, username, stubs: List[ChatServiceStub]):
+        """
+        Returns the servers to call for a username: those of the shard owning it, or the
+        given stubs when there is no shard map.
+
+        Args:
+            username (str): The username the call is about.
+            stubs (List[ChatServiceStub]): The stubs to use without a shard map.
+
+        Returns:
+            List[ChatServiceStub]: The stubs to call.
+        """
+        if self.shard_map is None:
+            return stubs
+        return self.shard_stubs[self.shard_map.owner(username)]
+
+    def scatter(self, function, *args):
+        """
+        Calls a function once per shard at the same time, passing each shard's stubs last.
+
+        Args:
+            function: Called as function(*args, stubs) for every shard.
+            args: Passed on to every call.
+
+        Returns:
+            list: The results, one per shard.
+
+        Raises:
+            Whatever a call raised.
+        """
+        # a pool of its own, since the functions may use self.executor themselves
+        with futures.ThreadPoolExecutor(max_workers=len(self.shard_stubs)) as pool:
+            calls = [pool.submit(function, *args, stubs) for stubs in self.shard_stubs.values()]
+            return [call.result() for call in calls]
+
+    def fan_out(self, method_name, request, stubs: List[ChatServiceStub], streaming=False):
+        """
+        Sends the same request to every server concurrently under the client deadline.
+
+        Args:
+            method_name (str): The name of the RPC to call on each stub.
+            request: The request message, or a list of request messages for a
+                client-streaming RPC.
+            stubs (List[ChatServiceStub]): A list of gRPC stubs for the chat server.
+            streaming (bool): Whether request is a list to stream to each server.
+
+        Returns:
+            list: The responses received by the time enough servers acknowledged.
+        """
+        if self.write_once:
+            # try the last known primary first, then the others, following any redirect
+            order = self.leader_first(stubs)
+            while order:
+                stub = order.pop(0)
+                try:
+                    response = self.router.call(
+                        stub, getattr(stub, method_name), iter(request) if streaming else request, timeout=self.deadline
+                    )
+                except grpc.RpcError as error:
+                    leader = self.redirect(error, stubs)
+                    if leader in order:
+                        order.remove(leader)
+                        order.insert(0, leader)
+                    continue
+                self.leader_stub = stub
+                return [response]
+            return []
+        calls = [
+            self.router.track(
+                stub, getattr(stub, method_name).future(iter(request) if streaming else request, timeout=self.deadline)
+            )
+            for stub in stubs
+        ]
+        return self.wait_for_acks(calls)
+
+    def find_leader(self, stubs: List[ChatServiceStub]):
+        """
+        Asks every reachable server who the primary is, trusting the answer from the
+        newest election term, and remembers which stub reaches it.
+
+        Args:
+            stubs (List[ChatServiceStub]): A list of gRPC stubs for the chat server.
+
+        Returns:
+            ChatServiceStub: The primary's stub, or None if no server knows of one.
+        """
+        calls = {
+            stub: self.executor.submit(stub.WhoIsLeader, chat_pb2.ClientMessage(), timeout=self.deadline)
+            for stub in self.router.available(stubs)
+        }
+        replies = []
+        for stub, call in calls.items():
+            try:
+                reply = call.result()
+            except grpc.RpcError:
+                continue
+            self.stub_addresses[stub] = reply.address
+            replies.append(reply)
+        if not replies:
+            return None
+        newest = max(replies, key=lambda reply: reply.term)
+        self.leader_stub = self.stub_for(newest.leader, stubs)
+        return self.leader_stub
+
+    def stub_for(self, address, stubs: List[ChatServiceStub]):
+        for stub in stubs:
+            if address and self.stub_addresses.get(stub) == address:
+                return stub
+        return None
+
+    def redirect(self, error, stubs: List[ChatServiceStub]):
+        """
+        Finds the stub for the primary named by a backup that refused a write.
+
+        Args:
+            error (grpc.RpcError): The refusal.
+            stubs (List[ChatServiceStub]): A list of gRPC stubs for the chat server.
+
+        Returns:
+            ChatServiceStub: The primary's stub, or None if it is not known.
+        """
+        if error.code() != grpc.StatusCode.FAILED_PRECONDITION:
+            return None
+        leader = dict(error.trailing_metadata() or ()).get(self.LEADER_KEY, "")
+        stub = self.stub_for(leader, stubs)
+        if stub is None and leader:
+            # learn which stub has that address
+            stub = self.find_leader(stubs)
+        return stub
+
+    def leader_first(self, stubs: List[ChatServiceStub]):
+        """
+        Returns:
+            list: The reachable servers, with the last known primary first.
+        """
+        order = self.router.available(stubs)
+        if self.leader_stub in order:
+            order.remove(self.leader_stub)
+            order.insert(0, self.leader_stub)
+        return order
+
+    def wait_for_acks(self, calls, required=None):
+        """
+        Waits until enough of the given calls succeed or all of them finish.
+        Calls still running keep going in the background, so slower servers still
+        receive the write.
+
+        Args:
+            calls (list): gRPC or concurrent.futures futures, one per server.
+            required (int): How many successes to wait for; required_acks by default.
+
+        Returns:
+            list: The results of the calls that succeeded so far, in completion order.
+        """
+        if required is None:
+            required = self.required_acks
+        done = threading.Condition()
+        responses = []
+        finished = [0]
+
+        def on_done(call):
+            with done:
+                finished[0] += 1
+                try:
+                    responses.append(call.result())
+                except Exception:
+                    pass
+                done.notify()
+
+        for call in calls:
+            call.add_done_callback(on_done)
+        with done:
+            done.wait_for(lambda: len(responses) >= required or finished[0] == len(calls))
+            return list(responses)
+
+    def read_quorum(self, read, stubs: List[ChatServiceStub]):
+        """
+        Runs a read against the servers and waits for required_reads of them to answer.
+        A single read goes to the fastest healthy server, moving on to the next fastest
+        only if it fails. Larger quorums go to every healthy server concurrently.
+
+        Args:
+            read: A function taking a stub and returning (data version, result).
+            stubs (List[ChatServiceStub]): A list of gRPC stubs for the chat server.
+
+        Returns:
+            The result from the answering server with the newest data.
+
+        Raises:
+            grpc.RpcError: If fewer than required_reads servers answered.
+        """
+        candidates = self.router.fastest(stubs)
+        if self.required_reads == 1:
+            for i, stub in enumerate(candidates):
+                try:
+                    return self.router.call(stub, read, stub)[1]
+                except grpc.RpcError:
+                    # try the next server, raising if it was the last one
+                    if i == len(candidates) - 1:
+                        raise
+
+        if len(candidates) < self.required_reads:
+            candidates = stubs
+        calls = [self.router.track(stub, self.executor.submit(read, stub)) for stub in candidates]
+        responses = self.wait_for_acks(calls, self.required_reads)
+        if len(responses) < self.required_reads:
+            errors = [call.exception() for call in calls if call.done() and call.exception() is not None]
+            raise errors[0] if errors else grpc.RpcError("not enough servers answered")
+        return max(responses, key=lambda response: response[0])[1]
+
+    def data_version(self, call):
+        """
+        Returns:
+            int: The data version a server attached to a finished call, or 0 if none.
+        """
+        for key, value in call.trailing_metadata() or ():
+            if key == self.VERSION_KEY:
+                return int(value)
+        return 0
+
+    def unary_read(self, method_name, request):
+        """
+        Returns a read function for read_quorum that makes one unary call.
+
+        Args:
+            method_name (str): The name of the RPC to call.
+            request: The request message.
+
+        Returns:
+            A function taking a stub and returning (data version, response).
+        """
+        def read(stub):
+            response, call = getattr(stub, method_name).with_call(request, timeout=self.deadline)
+            return self.data_version(call), response
+        return read
 
     def login(self, username, stubs: List[ChatServiceStub]):
         """
@@ -30,15 +329,11 @@ class Client:
         """
         # send server request to login with username and process response from there
         try:
-            received_info = stubs[0].LoginClient(chat_pb2.ClientMessage(info=username))
+            received_info = self.read_quorum(
+                self.unary_read("LoginClient", chat_pb2.ClientMessage(info=username)), self.route(username, stubs)
+            )
         except:
-            try:
-                received_info = stubs[1].LoginClient(chat_pb2.ClientMessage(info=username))
-            except:
-                try:
-                    received_info = stubs[2].LoginClient(chat_pb2.ClientMessage(info=username))
-                except:
-                    return 1
+            return 1
 
         return self.login_processing(username, received_info)
 
@@ -55,24 +350,11 @@ class Client:
                 username already exists on the server, or None if there was an
                 error.
         """
-        # send server request to create account with username and process response from there
-        fail_count = 0
-        try:
-            received_info = stubs[0].CreateAccountClient(chat_pb2.ClientMessage(info=username))
-            print(received_info)
-        except:
-            fail_count += 1
-
-        try:
-            received_info = stubs[1].CreateAccountClient(chat_pb2.ClientMessage(info=username))
-        except:
-            fail_count += 1
-        try:
-            received_info = stubs[2].CreateAccountClient(chat_pb2.ClientMessage(info=username))
-        except:
-            fail_count += 1
-        if fail_count == 3:
+        # send server request to create account with username to every server at once
+        responses = self.fan_out("CreateAccountClient", chat_pb2.ClientMessage(info=username), self.route(username, stubs))
+        if len(responses) < self.required_acks:
             return 1
+        received_info = responses[0]
         return self.create_account_processing(username, received_info)
 
     def delete_account(self, username, stubs: List[ChatServiceStub]):
@@ -87,22 +369,11 @@ class Client:
             int: 0 if the account deletion was successful, 1 if there was a
                 deletion failure, or None if there was an error.
         """
-        # send server request to delete account with username and process response from there
-        fail_count = 0
-        try:
-            received_info = stubs[0].DeleteAccountClient(chat_pb2.ClientMessage(info=username))
-        except:
-            fail_count += 1
-        try:
-            received_info = stubs[1].DeleteAccountClient(chat_pb2.ClientMessage(info=username))
-        except:
-            fail_count += 1
-        try:
-            received_info = stubs[2].DeleteAccountClient(chat_pb2.ClientMessage(info=username))
-        except:
-            fail_count += 1
-        if fail_count == 3:
+        # send server request to delete account with username to every server at once
+        responses = self.fan_out("DeleteAccountClient", chat_pb2.ClientMessage(info=username), self.route(username, stubs))
+        if len(responses) < self.required_acks:
             return 1
+        received_info = responses[0]
         return self.delete_account_processing(username, received_info)
     
     def logout(self):
@@ -133,19 +404,129 @@ class Client:
             int: a string of joined usernames if successful, 1 if there was an error.
         """
         # send server request to list accounts and process response from there
+        read = self.unary_read("ListAccountClient", chat_pb2.ClientMessage(info=""))
         try:
-            received_info = stubs[0].ListAccountClient(chat_pb2.ClientMessage(info=""))
+            if self.shard_map is None:
+                received_info = self.read_quorum(read, stubs)
+            else:
+                # every shard lists only its own users
+                replies = self.scatter(self.read_quorum, read)
+                accounts = sorted(username for reply in replies for username in reply.info.split("\n") if username)
+                received_info = ServerMessage(operation=chat_pb2.SUCCESS, info="\n".join(accounts))
         except:
-            try:
-                received_info = stubs[1].ListAccountClient(chat_pb2.ClientMessage(info=""))
-            except:
-                try:
-                    received_info = stubs[2].ListAccountClient(chat_pb2.ClientMessage(info=""))
-                except:
-                    return 1
-        
+            return 1
+
         return self.list_account_processing(received_info)
 
+    def account_pages(self, pattern, stubs: List[ChatServiceStub], page_size=100):
+        """
+        Streams the accounts matching a text wildcard page by page. With a shard map,
+        every shard is listed at once and their sorted listings are merged.
+
+        Args:
+            pattern (str): The fnmatch-style wildcard to filter accounts with.
+            stubs (List[ChatServiceStub]): A list of gRPC stubs for the chat server.
+            page_size (int): The number of accounts per page.
+
+        Yields:
+            List[str]: Each page of matching usernames, in sorted order.
+
+        Raises:
+            grpc.RpcError: If every server of a shard failed.
+        """
+        if self.shard_map is None:
+            yield from self.group_account_pages(pattern, stubs, page_size)
+            return
+        listings = self.scatter(
+            lambda pattern, page_size, stubs: [
+                username for page in self.group_account_pages(pattern, stubs, page_size) for username in page
+            ],
+            pattern, page_size,
+        )
+        accounts = list(heapq.merge(*listings))
+        for start in range(0, len(accounts), page_size):
+            yield accounts[start:start + page_size]
+
+    def group_account_pages(self, pattern, stubs: List[ChatServiceStub], page_size=100):
+        """
+        Streams the accounts matching a text wildcard from one group of servers page by
+        page. If a server fails partway through, the listing resumes on the next server
+        after the last account already received.
+
+        Args:
+            pattern (str): The fnmatch-style wildcard to filter accounts with.
+            stubs (List[ChatServiceStub]): A list of gRPC stubs for the chat server.
+            page_size (int): The number of accounts per page.
+
+        Yields:
+            List[str]: Each page of matching usernames, in sorted order.
+
+        Raises:
+            grpc.RpcError: If every server failed.
+        """
+        if self.required_reads > 1:
+            # compare whole listings from several servers, then page through the newest
+            accounts = self.read_quorum(
+                lambda stub: self.read_account_listing(pattern, stub, page_size), stubs
+            )
+            for start in range(0, len(accounts), page_size):
+                yield accounts[start:start + page_size]
+            return
+
+        cursor = ""
+        stubs = self.router.fastest(stubs)
+        for i, stub in enumerate(stubs):
+            try:
+                pages = stub.ListAccounts(
+                    chat_pb2.ListAccountsRequest(pattern=pattern, page_size=page_size, cursor=cursor)
+                )
+                for page in pages:
+                    cursor = page.next_cursor
+                    yield list(page.usernames)
+                return
+            except grpc.RpcError as error:
+                self.router.record_failure(stub, error)
+                # try the next server, raising if it was the last one
+                if i == len(stubs) - 1:
+                    raise
+
+    def read_account_listing(self, pattern, stub: ChatServiceStub, page_size=100):
+        """
+        Reads every account matching a text wildcard from one server.
+
+        Args:
+            pattern (str): The fnmatch-style wildcard to filter accounts with.
+            stub (ChatServiceStub): The gRPC stub for the server to read from.
+            page_size (int): The number of accounts per page.
+
+        Returns:
+            (int, List[str]): The server's data version and the matching usernames.
+        """
+        pages = stub.ListAccounts(
+            chat_pb2.ListAccountsRequest(pattern=pattern, page_size=page_size), timeout=self.deadline
+        )
+        accounts = [username for page in pages for username in page.usernames]
+        return self.data_version(pages), accounts
+
+    def list_accounts_matching(self, pattern, stubs: List[ChatServiceStub]):
+        """
+        Attempts to list the accounts matching a text wildcard, filtered by the server.
+
+        Args:
+            pattern (str): The fnmatch-style wildcard to filter accounts with.
+            stubs (List[ChatServiceStub]): A list of gRPC stubs for the chat server.
+
+        Returns:
+            List[str]: The matching usernames in sorted order, or 1 if every server failed.
+        """
+        accounts = []
+        try:
+            for page in self.account_pages(pattern, stubs):
+                accounts.extend(page)
+        except grpc.RpcError:
+            return 1
+        return accounts
+
     def send_message(self, sender, receiver, msg, stubs: List[ChatServiceStub]):
         """
         Attempts to send a message from a sender account to a receiver account.
@@ -159,26 +540,64 @@ class Client:
         Returns:
             int: 0 if the send was successful, 1 if there was a send failure.
         """
-        # turn all the info into a string separated by an enter character
-        total_info = sender + "\n" + receiver + "\n" + msg
-        # send server request to send message to receiver and process response from there
-        fail_count = 0
-        try:
-            received_info = stubs[0].SendMessageClient(chat_pb2.ClientMessage(info=total_info))
-        except:
-            fail_count += 1
-        try:
-            received_info = stubs[1].SendMessageClient(chat_pb2.ClientMessage(info=total_info))
-        except:
-            fail_count += 1
-        try:
-            received_info = stubs[2].SendMessageClient(chat_pb2.ClientMessage(info=total_info))
-        except:
-            fail_count += 1
-        if fail_count == 3:
+        send_request = chat_pb2.SendRequest(sender=sender, receiver=receiver, body=msg)
+        # send server request to send message to receiver to every server at once
+        # the message is stored with the receiver, on the shard owning the receiver
+        responses = self.fan_out("SendMessage", send_request, self.route(receiver, stubs))
+        if len(responses) < self.required_acks:
             return 1
+        received_info = responses[0]
         return self.send_message_processing(received_info)
     
+    def send_messages_bulk(self, records, stubs: List[ChatServiceStub]):
+        """
+        Attempts to send many messages in one streaming call, or one per shard.
+
+        Args:
+            records (List[Tuple[str, str, str]]): (sender, receiver, message) records to send.
+            stubs (List[ChatServiceStub]): A list of gRPC stubs for the chat server.
+
+        Returns:
+            List[int]: 0 or 1 for each record, in order, if the send reached a server,
+                or 1 if every server failed. With a shard map, the records for a shard
+                whose servers all failed get 1.
+        """
+        if self.shard_map is not None:
+            # one stream per shard with the records for its receivers, in their original order
+            groups = {}
+            for i, record in enumerate(records):
+                groups.setdefault(self.shard_map.owner(record[1]), []).append(i)
+            statuses = [1] * len(records)
+            for shard, indices in groups.items():
+                group_statuses = self.send_group_bulk([records[i] for i in indices], self.shard_stubs[shard])
+                if group_statuses != 1:
+                    for i, status in zip(indices, group_statuses):
+                        statuses[i] = status
+            return statuses
+        return self.send_group_bulk(records, stubs)
+
+    def send_group_bulk(self, records, stubs: List[ChatServiceStub]):
+        """
+        Sends many messages to one group of servers in one streaming call.
+
+        Args:
+            records (List[Tuple[str, str, str]]): (sender, receiver, message) records to send.
+            stubs (List[ChatServiceStub]): A list of gRPC stubs for the chat server.
+
+        Returns:
+            List[int]: 0 or 1 for each record, in order, or 1 if every server failed.
+        """
+        requests = [
+            chat_pb2.SendRequest(sender=sender, receiver=receiver, body=msg)
+            for sender, receiver, msg in records
+        ]
+        # stream the whole batch to every server at once
+        responses = self.fan_out("SendMessages", requests, stubs, streaming=True)
+        if len(responses) < self.required_acks:
+            return 1
+        received_info = responses[0]
+        return self.send_messages_bulk_processing(received_info)
+
     def view_msgs(self, username, stubs: List[ChatServiceStub]):
         """
         Attempts to retrieve all unread messages for the specified user.
@@ -190,23 +609,126 @@ class Client:
         Returns:
             int: 0 if the operation was successful, 1 if there was a failure.
         """
-        # send server request to view messages from username and process response from there
-        fail_count = 0
-        try:
-            received_info = stubs[0].ViewMessageClient(chat_pb2.ClientMessage(info=username))
-        except:
-            fail_count += 1
-        try:
-            received_info = stubs[1].ViewMessageClient(chat_pb2.ClientMessage(info=username))
-        except:
-            fail_count += 1
-        try:
-            received_info = stubs[2].ViewMessageClient(chat_pb2.ClientMessage(info=username))
-        except:
-            fail_count += 1
-        if fail_count == 3:
+        stubs = self.route(username, stubs)
+        if self.write_once:
+            # acknowledging is a write, so drain the first server that accepts it
+            for stub in self.leader_first(stubs):
+                try:
+                    return self.drain_inbox(username, stub)
+                except grpc.RpcError:
+                    continue
+            return 1
+
+        # read the inbox on every server at once, print the merged messages, and only
+        # then acknowledge on each server exactly what was read from it, so nothing is
+        # dropped from a server unless it was shown
+        calls = [self.executor.submit(self.read_inbox, username, stub) for stub in stubs]
+        futures.wait(calls)
+        inboxes = [(stub, call.result()) for stub, call in zip(stubs, calls) if call.exception() is None]
+        if len(inboxes) < self.required_acks:
+            return 1
+        messages = self.merge_inboxes([inbox for _, inbox in inboxes])
+        if messages:
+            self.view_message_processing(chat_pb2.Inbox(operation=chat_pb2.MESSAGES_EXIST, messages=messages))
+        else:
+            self.view_message_processing(chat_pb2.Inbox(operation=chat_pb2.NO_MESSAGES))
+        acks = [
+            self.executor.submit(
+                stub.AckMessages, chat_pb2.AckRequest(user=username, up_to_id=inbox[-1].id), timeout=self.deadline
+            )
+            for stub, inbox in inboxes if inbox
+        ]
+        futures.wait(acks)
+        return 0 if messages else 1
+
+    def read_inbox(self, username, stub: ChatServiceStub):
+        """
+        Reads a user's whole inbox from one server in chunks of FETCH_LIMIT messages,
+        without acknowledging any of them.
+
+        Args:
+            username (str): The username of the user whose messages will be retrieved.
+            stub (ChatServiceStub): The gRPC stub for the server to read from.
+
+        Returns:
+            List[Message]: The server's messages for the user, in id order.
+
+        Raises:
+            grpc.RpcError: If the server failed partway through.
+        """
+        messages = []
+        after_id = 0
+        while True:
+            received_info = stub.FetchMessages(
+                chat_pb2.FetchRequest(user=username, after_id=after_id, limit=self.FETCH_LIMIT),
+                timeout=self.deadline,
+            )
+            if received_info.operation != chat_pb2.MESSAGES_EXIST:
+                return messages
+            messages.extend(received_info.messages)
+            after_id = received_info.messages[-1].id
+
+    def merge_inboxes(self, inboxes):
+        """
+        Merges the inboxes several servers hold for one user. Every send goes to every
+        server, so they mostly hold the same messages under different ids; a message
+        counts once per copy the fullest server holds, and whatever some server missed
+        is still shown as long as any server has it.
+
+        Args:
+            inboxes (List[List[Message]]): Each server's messages, in id order.
+
+        Returns:
+            List[Message]: The merged messages, the fullest inbox's order first.
+        """
+        inboxes = sorted(inboxes, key=len, reverse=True)
+        merged = []
+        counts = {}
+        for inbox in inboxes:
+            seen = {}
+            for message in inbox:
+                key = (message.sender, message.body)
+                seen[key] = seen.get(key, 0) + 1
+                # a copy of a message already taken from a fuller inbox
+                if seen[key] <= counts.get(key, 0):
+                    continue
+                counts[key] = seen[key]
+                merged.append(message)
+        return merged
+
+    def drain_inbox(self, username, stub: ChatServiceStub):
+        """
+        Reads a user's inbox from one server in chunks of FETCH_LIMIT messages,
+        acknowledging each chunk once it has been printed so the server can drop it.
+        A chunk that is never acknowledged is simply fetched again next time.
+
+        Args:
+            username (str): The username of the user whose messages will be retrieved.
+            stub (ChatServiceStub): The gRPC stub for the server to read from.
+
+        Returns:
+            int: 0 if there were messages, 1 otherwise.
+
+        Raises:
+            grpc.RpcError: If the server failed partway through.
+        """
+        after_id = 0
+        shown = 0
+        while True:
+            received_info = stub.FetchMessages(
+                chat_pb2.FetchRequest(user=username, after_id=after_id, limit=self.FETCH_LIMIT),
+                timeout=self.deadline,
+            )
+            if received_info.operation != chat_pb2.MESSAGES_EXIST:
+                break
+            self.view_message_processing(received_info, shown)
+            shown += len(received_info.messages)
+            after_id = received_info.messages[-1].id
+            stub.AckMessages(chat_pb2.AckRequest(user=username, up_to_id=after_id), timeout=self.deadline)
+        if shown == 0:
+            self.view_message_processing(received_info)
             return 1
-        return self.view_message_processing(received_info)
+        return 0
 
     def login_processing(self, username, received_info: ServerMessage):
         """
@@ -324,36 +846,123 @@ class Client:
         print("Message send failure, receiving account does not exist")
         return 1
 
-    def view_message_processing(self, received_info: ServerMessage):
+    def send_messages_bulk_processing(self, received_info: BulkSendReply):
+        """
+        Process the per-message statuses of a bulk send.
+
+        Args:
+        - received_info: an instance of BulkSendReply representing the response from the server
+
+        Returns:
+        - a list with 0 for each message that was sent and 1 for each that failed
+        """
+        return [0 if status == chat_pb2.SUCCESS else 1 for status in received_info.statuses]
+
+    def view_message_processing(self, received_info: Inbox, shown=0):
         """
         Process the received information of viewing undelivered messages.
 
         Args:
-        - received_info: an instance of ServerMessage representing the response from the server
+        - received_info: an instance of Inbox representing the response from the server
+        - shown: how many of the user's messages were already printed from earlier chunks
 
         Returns:
         - 0 if message viewing is successful, 1 otherwise
         """
-        # if the server request status is FAILURE, print out that there are no unread msgs and return 1
-        if received_info.operation == chat_pb2.NO_MESSAGES:
+        # if there are no unread msgs (or the account is gone), print that out and return 1
+        if received_info.operation != chat_pb2.MESSAGES_EXIST:
             print("\n" + self.SESSION_INFO["username"] + "'s account does not have any unread messages.")
             return 1
-        # otherwise print out the unread messages in a numbered list, split by the enter character
-        messages = received_info.info.split("\n")
-        print("\nList of " + self.SESSION_INFO["username"] + "'s messages:\n")
-        for j, message in enumerate(messages):
-            print(str(j + 1) + ". " + str(message))
+        # otherwise print out the unread messages in a numbered list, continuing the
+        # numbering of any earlier chunks
+        if shown == 0:
+            print("\nList of " + self.SESSION_INFO["username"] + "'s messages:\n")
+        for j, message in enumerate(received_info.messages):
+            print(str(shown + j + 1) + ". " + message.body)
         # once this is done successfully, return 0
         return 0
 
+    def listen_for_messages(self, username, stubs: List[ChatServiceStub]):
+        """
+        Starts a background thread that prints messages for the specified user as soon
+        as the server pushes them.
+
+        Args:
+            username (str): The username of the logged in user.
+            stubs (List[ChatServiceStub]): A list of gRPC stubs for the chat server.
+
+        Returns:
+            None
+        """
+        self.stop_listening()
+        self.RECEIVE_EVENT.set()
+        threading.Thread(target=self.receive_messages, args=(username, self.route(username, stubs)), daemon=True).start()
+
+    def stop_listening(self):
+        """
+        Stops the background listening thread, if there is one.
+
+        Returns:
+            None
+        """
+        # clear the event first so the thread does not resubscribe after the cancel
+        self.RECEIVE_EVENT.clear()
+        with self.CLIENT_LOCK:
+            if self.subscription is not None:
+                self.subscription.cancel()
+                self.subscription = None
+
+    def receive_messages(self, username, stubs: List[ChatServiceStub]):
+        """
+        Background thread loop: subscribes to the first reachable server and prints
+        each pushed message, moving on to the next server if the stream breaks.
+
+        Args:
+            username (str): The username of the logged in user.
+            stubs (List[ChatServiceStub]): A list of gRPC stubs for the chat server.
+
+        Returns:
+            None
+        """
+        while self.RECEIVE_EVENT.is_set():
+            for stub in self.router.available(stubs):
+                with self.CLIENT_LOCK:
+                    if not self.RECEIVE_EVENT.is_set():
+                        return
+                    call = stub.SubscribeMessages(chat_pb2.ClientMessage(info=username))
+                    self.subscription = call
+                try:
+                    for received_info in call:
+                        if self.receive_message_processing(received_info) == 1:
+                            return
+                except grpc.RpcError:
+                    continue
+            time.sleep(self.RESUBSCRIBE_SECONDS)
+
+    def receive_message_processing(self, received_info: ServerMessage):
+        """
+        Process a message pushed by the server on the subscription stream.
+
+        Args:
+        - received_info: an instance of ServerMessage representing the pushed message
+
+        Returns:
+        - 0 if a message was printed, 1 if the server refused the subscription
+        """
+        # the server refuses subscriptions for accounts that do not exist
+        if received_info.operation == chat_pb2.FAILURE:
+            return 1
+        print("\n" + received_info.info)
+        return 0
+
     def quit_messenger(self):
         """
         Quit the messenger.
 
         Returns: None
         """
-        # set background thread event to False to exit polling loop, then just return
-        self.RECEIVE_EVENT.clear()
+        # stop the background listening thread, then just return
+        self.stop_listening()
         return
 
 
@@ -364,20 +973,22 @@ class Client:
         Args:
         - stubs (List[ChatServiceStub]): A list of gRPC stubs for the chat server.
 
-        Returns: login status if accounts exist to log into, 1 otherwise
+        Returns: login status if accounts exist to log into, 1 if none match, -1 if
+        every server failed
         """
-        # get list of accounts to login to
-        received_list = self.list_accounts(stubs)
-        print(received_list)
-        if received_list != 1:
+        # ask for a wildcard so the server only sends back the accounts worth showing
+        pattern = input("\nSearch accounts with a text wildcard (press enter for all): ") or "*"
+        accounts = self.list_accounts_matching(pattern, stubs)
+        if accounts == 1:
+            return -1
+        if accounts:
             # if accounts exist on the server, allow users to choose one and login
-            accounts = received_list.info.split("\n")
             message = "\nChoose an account:\n\n"
             username = curses.wrapper(menu, accounts, message)
             return self.login(username, stubs)
         else:
-            # if no accounts exist yet on the server, print out a message and return 1 back to
+            # if no accounts match on the server, print out a message and return 1 back to
             # the previous menu
-            print("\nThere are currently no accounts on the server.\n")
+            print("\nThere are currently no matching accounts on the server.\n")
             input("Press enter to return to the main menu.\n\n")
             return 1
\ No newline at end of file
@@ -0,0 +1,266 @@
+import random
+import threading
+import time
+from concurrent import futures
+
+import chat_pb2
+import chat_pb2_grpc
+import grpc
+
+
+class Elector:
+    """
+    Elects a leader among a fixed set of servers, in the style of Raft. Time is divided
+    into numbered terms with at most one leader each. A follower that hears nothing from
+    a leader for a randomized election timeout becomes a candidate for the next term and
+    asks its peers for votes; a majority makes it leader. The leader's log shipping doubles
+    as its heartbeat. A server that sees a newer term steps down.
+
+    A leader also holds a lease: it keeps it only while a majority, itself included, has
+    answered a heartbeat sent within the last election timeout. No follower stands for
+    election sooner than that after a heartbeat, so while the lease holds no other leader
+    can exist. A leader cut off from a majority steps down once its lease runs out, and
+    refuses writes from then on.
+
+    The elector only decides roles; the server's ChatService does the work of each role,
+    shipping the log as primary or applying it as backup.
+    """
+
+    FOLLOWER = "follower"
+    CANDIDATE = "candidate"
+    LEADER = "leader"
+
+    def __init__(self, service, address, peers, election_timeout=1.0):
+        """
+        Initializes an elector for this server. Call start() to begin.
+
+        Args:
+        - service (ChatService): This server.
+        - address (str): host:port of this server, as its peers know it.
+        - peers (list): host:port addresses of the other servers.
+        - election_timeout (float): Seconds without a heartbeat before a follower stands
+          for election; each wait is randomized between this and twice this. A round of
+          voting is also abandoned after this long.
+
+        Returns:
+        None
+        """
+        self.service = service
+        self.address = address
+        self.peers = peers
+        self.election_timeout = election_timeout
+        self.lock = threading.Lock()
+        self.term, self.voted_for = service.load_vote()
+        self.state = self.FOLLOWER
+        self.leader = ""
+        # peer address -> when the latest heartbeat or vote request it answered was sent
+        self.heard = {}
+        self.reset_timer()
+        self.channels = [grpc.insecure_channel(peer) for peer in peers]
+        self.stubs = [chat_pb2_grpc.ReplicationServiceStub(channel) for channel in self.channels]
+        self.executor = futures.ThreadPoolExecutor(max_workers=max(1, len(peers)))
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def majority(self):
+        return (len(self.peers) + 1) // 2 + 1
+
+    def reset_timer(self):
+        # callers hold self.lock, or own the elector before start()
+        self.election_deadline = time.monotonic() + random.uniform(self.election_timeout, 2 * self.election_timeout)
+
+    def current(self):
+        """
+        Returns:
+        (int, str): The current term and the leader's address, empty if unknown.
+        """
+        with self.lock:
+            return self.term, self.leader
+
+    def heard_from(self, peer, sent_at):
+        """
+        Records that a peer answered a heartbeat, for the leader's lease.
+
+        Args:
+        - peer (str): host:port of the peer.
+        - sent_at (float): time.monotonic() when the answered request was sent.
+
+        Returns:
+        None
+        """
+        with self.lock:
+            self.heard[peer] = max(self.heard.get(peer, sent_at), sent_at)
+
+    def holds_lease(self):
+        # callers hold self.lock
+        if self.state != self.LEADER:
+            return False
+        now = time.monotonic()
+        answered = sum(1 for sent_at in self.heard.values() if now - sent_at < self.election_timeout)
+        return answered + 1 >= self.majority()
+
+    def has_lease(self):
+        """
+        Returns:
+        bool: True if this server leads and a majority answered it within the election timeout.
+        """
+        with self.lock:
+            return self.holds_lease()
+
+    def observe_term(self, term):
+        """
+        Steps down to follower if another server is on a newer term.
+
+        Args:
+        - term (int): A term seen in a request or reply.
+
+        Returns:
+        None
+        """
+        with self.lock:
+            self.advance_term(term)
+
+    def advance_term(self, term):
+        # callers hold self.lock
+        if term <= self.term:
+            return
+        self.term = term
+        self.voted_for = ""
+        self.leader = ""
+        self.service.save_vote(self.term, self.voted_for)
+        self.follow()
+
+    def follow(self):
+        # callers hold self.lock; a stepping-down leader stops taking writes right away,
+        # and the rest of the switch happens on the elector thread
+        if self.state == self.LEADER:
+            self.service.role = self.service.BACKUP
+        self.state = self.FOLLOWER
+
+    def handle_heartbeat(self, term, leader):
+        """
+        Records a heartbeat or log shipment from a leader.
+
+        Args:
+        - term (int): The sender's term.
+        - leader (str): The sender's address.
+
+        Returns:
+        (bool, int): Whether the sender is the current leader, and this server's term.
+        """
+        with self.lock:
+            if term < self.term:
+                return False, self.term
+            self.advance_term(term)
+            if self.state != self.FOLLOWER:
+                self.follow()
+            self.leader = leader
+            self.reset_timer()
+            return True, self.term
+
+    def handle_vote(self, request):
+        """
+        Decides whether to vote for a candidate. Each server votes at most once per term,
+        and only for a candidate whose log is at least as new as its own.
+
+        Args:
+        - request (VoteRequest): The candidate's request.
+
+        Returns:
+        A VoteReply.
+        """
+        with self.lock:
+            self.advance_term(request.term)
+            granted = (
+                request.term == self.term
+                and self.voted_for in ("", request.candidate)
+                and request.last_seq >= self.service.last_log_seq()
+            )
+            if granted:
+                self.voted_for = request.candidate
+                self.service.save_vote(self.term, self.voted_for)
+                self.reset_timer()
+            return chat_pb2.VoteReply(term=self.term, granted=granted)
+
+    def run_election(self):
+        """
+        Stands for election in a new term, asking every peer for its vote at once.
+
+        Returns:
+        bool: True if this server became leader.
+        """
+        with self.lock:
+            self.term += 1
+            self.voted_for = self.address
+            self.service.save_vote(self.term, self.voted_for)
+            self.state = self.CANDIDATE
+            self.leader = ""
+            self.heard = {}
+            self.reset_timer()
+            term = self.term
+        request = chat_pb2.VoteRequest(term=term, candidate=self.address, last_seq=self.service.last_log_seq())
+        sent_at = time.monotonic()
+        calls = {
+            self.executor.submit(stub.RequestVote, request, timeout=self.election_timeout): peer
+            for peer, stub in zip(self.peers, self.stubs)
+        }
+
+        votes = 1
+        for call in futures.as_completed(calls):
+            try:
+                reply = call.result()
+            except grpc.RpcError:
+                continue
+            with self.lock:
+                self.advance_term(reply.term)
+                if self.state != self.CANDIDATE or self.term != term:
+                    return False
+                # a voter restarted its election timer when it voted, so its vote starts the lease
+                if reply.granted:
+                    self.heard[calls[call]] = sent_at
+            votes += reply.granted
+            if votes >= self.majority():
+                break
+
+        with self.lock:
+            if votes < self.majority() or self.state != self.CANDIDATE or self.term != term:
+                return False
+            self.state = self.LEADER
+            self.leader = self.address
+            return True
+
+    def reconcile(self):
+        """Makes the server's role match the elector's state."""
+        with self.lock:
+            state, leader = self.state, self.leader
+        if state == self.LEADER:
+            self.service.lead(self.peers, heartbeat_seconds=self.election_timeout / 3)
+        elif leader:
+            self.service.follow(leader)
+        else:
+            # a leader that lost its lease stops shipping under its old term
+            self.service.stop_replication()
+
+    def run(self):
+        """Elector thread loop: stands for election when the leader goes quiet, and steps down when it loses its lease."""
+        while not self.stopped.wait(self.election_timeout / 10):
+            with self.lock:
+                if self.state == self.LEADER and not self.holds_lease():
+                    # cut off from a majority, which may already be electing someone else
+                    self.follow()
+                    self.leader = ""
+                    self.reset_timer()
+                expired = self.state != self.LEADER and time.monotonic() >= self.election_deadline
+            if expired:
+                self.run_election()
+            self.reconcile()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.executor.shutdown(wait=False)
+        for channel in self.channels:
+            channel.close()
@@ -0,0 +1,263 @@
+import collections
+import sqlite3
+import threading
+import time
+
+from user import User
+
+# rough memory cost of an empty mailbox, with its username and cache entries, and of
+# one message in it, for the cache's cap
+MAILBOX_BYTES = 256
+MESSAGE_BYTES = 200
+
+
+class MailboxCache:
+    """
+    Keeps the inboxes of active users in memory, as User mailboxes, in front of the
+    messages table. Sends, views, fetches and acknowledgements of a cached user are
+    served from memory and return at once, and a flusher thread writes them to SQLite
+    in the order they happened, in one transaction per flush window. A crash loses at
+    most the writes of the last window, and callers wait when max_pending writes are
+    already waiting. Mailboxes with nothing left to flush are evicted, least recently
+    used first, once the cache holds more than max_bytes.
+
+    Every method taking a username must be called with that user's lock stripe held,
+    so a mailbox is never loaded twice at once. Message ids are handed out here, above
+    any id the messages table has ever used.
+    """
+
+    def __init__(self, service, max_bytes=64 << 20, flush_ms=50.0, max_pending=10000):
+        """
+        Starts the flusher thread.
+
+        Args:
+        - service (ChatService): The service whose database the cache writes back to.
+        - max_bytes (int): Roughly how much memory the mailboxes may take.
+        - flush_ms (float): The longest a write stays in memory only.
+        - max_pending (int): How many writes may wait for a flush before callers wait too.
+
+        Returns:
+        None
+        """
+        self.service = service
+        self.max_bytes = max_bytes
+        self.window = flush_ms / 1000.0
+        self.max_pending = max_pending
+        # username -> User, least recently used first
+        self.mailboxes = collections.OrderedDict()
+        self.sizes = {}
+        self.size = 0
+        # writes each cached user has waiting for a flush; those mailboxes are never evicted
+        self.dirty = {}
+        # ("send", receiver, id, sender, body, created_at) and ("ack", receiver, up_to_id), in order
+        self.pending = []
+        self.lock = threading.Condition()
+        # writes recorded and written so far, for flush() to wait on
+        self.recorded = 0
+        self.written = 0
+        # set when someone is waiting for the flusher, so it skips the rest of the window
+        self.urgent = False
+        service.c.execute("SELECT seq FROM sqlite_sequence WHERE name = 'messages'")
+        row = service.c.fetchone()
+        self.next_id = row[0] if row is not None else 0
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def mailbox(self, username):
+        """
+        Returns a user's mailbox, loading the inbox from the database on a miss. The
+        caller holds the cache lock, which is let go while loading.
+        """
+        user = self.mailboxes.get(username)
+        if user is None:
+            self.lock.release()
+            try:
+                # only users with nothing waiting to be flushed are ever missing, so the table is current
+                self.service.c.execute(
+                    "SELECT id, sender, body, created_at FROM messages WHERE receiver = ? ORDER BY id",
+                    (username,),
+                )
+                rows = self.service.c.fetchall()
+            finally:
+                self.lock.acquire()
+            user = self.mailboxes[username] = User(username)
+            for row in rows:
+                user.queue_message(row)
+            self.sizes[username] = 0
+            self.resize(username, MAILBOX_BYTES + sum(message_bytes(row) for row in rows))
+        self.mailboxes.move_to_end(username)
+        return user
+
+    def resize(self, username, change):
+        self.sizes[username] += change
+        self.size += change
+
+    def trim(self):
+        """Evicts clean mailboxes, least recently used first, until the cache fits max_bytes."""
+        if self.size <= self.max_bytes:
+            return
+        for username in list(self.mailboxes):
+            if self.size <= self.max_bytes:
+                break
+            if username in self.dirty:
+                continue
+            del self.mailboxes[username]
+            self.size -= self.sizes.pop(username)
+
+    def record(self, operation):
+        """Queues a write for the flusher. The caller holds the cache lock."""
+        self.pending.append(operation)
+        self.dirty[operation[1]] = self.dirty.get(operation[1], 0) + 1
+        self.recorded += 1
+        self.lock.notify_all()
+        if len(self.pending) >= self.max_pending:
+            self.wait_written(self.recorded)
+        self.trim()
+
+    def wait_written(self, count):
+        """Hurries the flusher and waits until count writes are written. The caller holds the cache lock."""
+        while self.written < count and self.thread.is_alive():
+            self.urgent = True
+            self.lock.notify_all()
+            self.lock.wait(0.1)
+
+    def send(self, sender, receiver, msg):
+        """
+        Adds a message to the receiver's inbox.
+
+        Args:
+        - sender (str): The username of the sender.
+        - receiver (str): The username of the receiver.
+        - msg (str): The message body.
+
+        Returns:
+        The id of the new message.
+        """
+        with self.lock:
+            user = self.mailbox(receiver)
+            self.next_id += 1
+            row = (self.next_id, sender, msg, time.time())
+            user.queue_message(row)
+            self.resize(receiver, message_bytes(row))
+            self.record(("send", receiver) + row)
+            return row[0]
+
+    def fetch(self, username, after_id=0, limit=None):
+        """
+        Returns:
+        list: The user's (id, sender, body, created_at) messages after after_id, oldest first.
+        """
+        with self.lock:
+            messages = self.mailbox(username).messages_after(after_id, limit)
+            self.trim()
+            return messages
+
+    def ack(self, username, up_to_id):
+        """Removes a user's messages up to and including up_to_id."""
+        with self.lock:
+            removed = self.mailbox(username).remove_messages(up_to_id)
+            self.resize(username, -sum(message_bytes(row) for row in removed))
+            self.record(("ack", username, up_to_id))
+
+    def take(self, username):
+        """
+        Returns:
+        list: Every message of the user, oldest first, now removed from the inbox.
+        """
+        with self.lock:
+            rows = self.mailbox(username).get_current_messages()
+            if rows:
+                self.resize(username, -sum(message_bytes(row) for row in rows))
+                self.record(("ack", username, rows[-1][0]))
+            return rows
+
+    def discard(self, username):
+        """Drops a user's mailbox once the account is deleted. Its writes must be flushed already."""
+        with self.lock:
+            if username in self.mailboxes:
+                del self.mailboxes[username]
+                self.size -= self.sizes.pop(username)
+
+    def flush(self):
+        """
+        Waits until every write made so far is in the database.
+
+        Returns:
+        None
+        """
+        with self.lock:
+            self.wait_written(self.recorded)
+
+    def next_batch(self):
+        """
+        Waits for the first pending write, then for the flush window to close, unless
+        someone is waiting for the flush or the cache is stopping.
+
+        Returns:
+        A list of pending writes, empty once the cache has been stopped and written back.
+        """
+        with self.lock:
+            while self.running and not self.pending:
+                self.lock.wait()
+            deadline = time.monotonic() + self.window
+            while self.running and not self.urgent:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.lock.wait(remaining)
+            self.urgent = False
+            return list(self.pending)
+
+    def write(self, batch):
+        """Writes a batch of pending writes, and their log entries, in one transaction."""
+        cursor = self.service.c
+        for operation in batch:
+            if operation[0] == "send":
+                _, receiver, msg_id, sender, msg, created_at = operation
+                self.service.write_message(cursor, sender, receiver, msg, created_at, msg_id)
+            else:
+                _, receiver, up_to_id = operation
+                self.service.erase_messages(cursor, receiver, up_to_id)
+        self.service.conn.commit()
+
+    def run(self):
+        """Flusher thread loop: writes back whatever arrived in each window."""
+        while True:
+            batch = self.next_batch()
+            if not batch:
+                break
+            try:
+                self.write(batch)
+            except sqlite3.Error as error:
+                self.service.conn.rollback()
+                print("[FLUSH] Writing back " + str(len(batch)) + " writes failed, retrying: " + str(error))
+                time.sleep(self.window)
+                continue
+            self.service.committed()
+            with self.lock:
+                del self.pending[:len(batch)]
+                for operation in batch:
+                    self.dirty[operation[1]] -= 1
+                    if not self.dirty[operation[1]]:
+                        del self.dirty[operation[1]]
+                self.written += len(batch)
+                self.trim()
+                self.lock.notify_all()
+
+    def stop(self):
+        """
+        Writes back everything still pending and stops the flusher thread.
+
+        Returns:
+        None
+        """
+        with self.lock:
+            self.running = False
+            self.lock.notify_all()
+        self.thread.join()
+
+
+def message_bytes(row):
+    _, sender, body, _ = row
+    return MESSAGE_BYTES + len(sender) + len(body)
@@ -0,0 +1,483 @@
+import asyncio
+import bisect
+import contextvars
+import http.server
+import inspect
+import threading
+import time
+
+import grpc
+
+# upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# finer bounds for the timings inside a call, where lock waits and statements take microseconds
+TIMING_BUCKETS = (0.00001, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                  0.1, 0.25, 0.5, 1.0, 5.0)
+
+# full method name of the RPC the current thread or task is serving, so timings taken
+# deep inside a handler can say which RPC they belong to
+current_method = contextvars.ContextVar("current_method", default="")
+
+
+class MethodStats:
+    """One thread's counts for one RPC method. Only the owning thread writes to it."""
+
+    def __init__(self):
+        self.started = 0
+        # finished calls by status code name
+        self.codes = {}
+        # calls per latency bucket, the last one for calls slower than every bound
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self.request_bytes = 0
+        self.response_bytes = 0
+
+
+class Histogram:
+    """One thread's observations of one timing series. Only the owning thread writes to it."""
+
+    def __init__(self):
+        self.buckets = [0] * (len(TIMING_BUCKETS) + 1)
+        self.sum = 0.0
+
+
+class Metrics:
+    """
+    Counts every RPC a server handles: calls by status code, calls in flight, a latency
+    histogram, and request and response bytes, per method. Recording takes no lock:
+    each thread updates its own counters, and a scrape adds up every thread's. Calls in
+    flight are the calls started minus the calls finished, so no gauge goes up and down.
+    Other timing histograms, such as a Profiler's, are kept and served the same way.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+        # every thread's counters, as {method: MethodStats} dicts
+        self.shards = []
+        # every thread's timings, as {(name, labels): Histogram} dicts
+        self.timing_shards = []
+        self.shards_lock = threading.Lock()
+        # help text of every timing histogram, by name
+        self.descriptions = {}
+
+    def shard(self):
+        shard = getattr(self.local, "shard", None)
+        if shard is None:
+            shard = self.local.shard = {}
+            # taken once per thread, not per call
+            with self.shards_lock:
+                self.shards.append(shard)
+        return shard
+
+    def timings(self):
+        timings = getattr(self.local, "timings", None)
+        if timings is None:
+            timings = self.local.timings = {}
+            with self.shards_lock:
+                self.timing_shards.append(timings)
+        return timings
+
+    def describe(self, name, description):
+        """Registers a timing histogram, so it is served once it has observations."""
+        self.descriptions[name] = description
+
+    def observe(self, name, labels, seconds):
+        """
+        Adds one observation to a timing histogram.
+
+        Args:
+        - name (str): The histogram's name, registered with describe.
+        - labels (tuple): (label, value) pairs naming the series.
+        - seconds (float): The time observed.
+
+        Returns:
+        None
+        """
+        timings = self.timings()
+        histogram = timings.get((name, labels))
+        if histogram is None:
+            histogram = timings[(name, labels)] = Histogram()
+        histogram.buckets[bisect.bisect_left(TIMING_BUCKETS, seconds)] += 1
+        histogram.sum += seconds
+
+    def stats(self, method):
+        """
+        Returns:
+        MethodStats: The calling thread's counters for the method.
+        """
+        shard = self.shard()
+        stats = shard.get(method)
+        if stats is None:
+            stats = shard[method] = MethodStats()
+        return stats
+
+    def start(self, method):
+        """
+        Counts a call as started.
+
+        Args:
+        - method (str): The full method name, e.g. /ChatService/LoginClient.
+
+        Returns:
+        (MethodStats, float): The counters to finish the call on, and its start time.
+        """
+        stats = self.stats(method)
+        stats.started += 1
+        return stats, time.perf_counter()
+
+    def finish(self, stats, started_at, code):
+        """
+        Counts a call as finished.
+
+        Args:
+        - stats (MethodStats): The counters start() returned.
+        - started_at (float): The start time start() returned.
+        - code (str): The status code name, e.g. OK or NOT_FOUND.
+
+        Returns:
+        None
+        """
+        elapsed = time.perf_counter() - started_at
+        stats.codes[code] = stats.codes.get(code, 0) + 1
+        stats.buckets[bisect.bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+        stats.latency_sum += elapsed
+
+    def totals(self):
+        """
+        Adds up every thread's counters.
+
+        Returns:
+        dict: Maps each method to a MethodStats holding the totals.
+        """
+        with self.shards_lock:
+            shards = list(self.shards)
+        totals = {}
+        for shard in shards:
+            # copying a dict of str keys runs without releasing the GIL, so it is safe
+            # against the owning thread adding a method meanwhile
+            for method, stats in list(shard.items()):
+                total = totals.get(method)
+                if total is None:
+                    total = totals[method] = MethodStats()
+                total.started += stats.started
+                for code, count in list(stats.codes.items()):
+                    total.codes[code] = total.codes.get(code, 0) + count
+                for i, count in enumerate(stats.buckets):
+                    total.buckets[i] += count
+                total.latency_sum += stats.latency_sum
+                total.request_bytes += stats.request_bytes
+                total.response_bytes += stats.response_bytes
+        return totals
+
+    def timing_totals(self):
+        """
+        Adds up every thread's timings.
+
+        Returns:
+        dict: Maps each (name, labels) series to a Histogram holding the totals.
+        """
+        with self.shards_lock:
+            shards = list(self.timing_shards)
+        totals = {}
+        for shard in shards:
+            for key, histogram in list(shard.items()):
+                total = totals.get(key)
+                if total is None:
+                    total = totals[key] = Histogram()
+                for i, count in enumerate(histogram.buckets):
+                    total.buckets[i] += count
+                total.sum += histogram.sum
+        return totals
+
+    def exposition(self):
+        """
+        Renders the totals in the Prometheus text format.
+
+        Returns:
+        str: The metrics page.
+        """
+        totals = sorted(self.totals().items())
+        lines = [
+            "# HELP chat_rpc_requests_total RPCs finished, by method and status code.",
+            "# TYPE chat_rpc_requests_total counter",
+        ]
+        for method, stats in totals:
+            for code, count in sorted(stats.codes.items()):
+                lines.append("chat_rpc_requests_total{" + labels(method, code=code) + "} " + str(count))
+        lines += [
+            "# HELP chat_rpc_in_flight RPCs started and not finished yet.",
+            "# TYPE chat_rpc_in_flight gauge",
+        ]
+        for method, stats in totals:
+            lines.append("chat_rpc_in_flight{" + labels(method) + "} " + str(stats.started - sum(stats.codes.values())))
+        lines += [
+            "# HELP chat_rpc_latency_seconds Time from the start of an RPC to its last response.",
+            "# TYPE chat_rpc_latency_seconds histogram",
+        ]
+        for method, stats in totals:
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), stats.buckets):
+                cumulative += count
+                lines.append(
+                    "chat_rpc_latency_seconds_bucket{" + labels(method, le=str(bound)) + "} " + str(cumulative)
+                )
+            lines.append("chat_rpc_latency_seconds_sum{" + labels(method) + "} " + repr(stats.latency_sum))
+            lines.append("chat_rpc_latency_seconds_count{" + labels(method) + "} " + str(cumulative))
+        for name, attribute, description in (
+            ("chat_rpc_request_bytes_total", "request_bytes", "Serialized size of the requests received."),
+            ("chat_rpc_response_bytes_total", "response_bytes", "Serialized size of the responses sent."),
+        ):
+            lines += ["# HELP " + name + " " + description, "# TYPE " + name + " counter"]
+            for method, stats in totals:
+                lines.append(name + "{" + labels(method) + "} " + str(getattr(stats, attribute)))
+        timings = sorted(self.timing_totals().items())
+        for name, description in sorted(self.descriptions.items()):
+            lines += ["# HELP " + name + " " + description, "# TYPE " + name + " histogram"]
+            for (series, pairs), histogram in timings:
+                if series != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(TIMING_BUCKETS + ("+Inf",), histogram.buckets):
+                    cumulative += count
+                    lines.append(name + "_bucket{" + format_labels(pairs + (("le", str(bound)),)) + "} " + str(cumulative))
+                lines.append(name + "_sum{" + format_labels(pairs) + "} " + repr(histogram.sum))
+                lines.append(name + "_count{" + format_labels(pairs) + "} " + str(cumulative))
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(pairs):
+    """Formats (label, value) pairs as Prometheus labels, escaping the values."""
+    return ",".join(
+        key + '="' + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for key, value in pairs
+    )
+
+
+def labels(method, **extra):
+    """Formats a full method name, /Service/Method, and any extra labels as Prometheus labels."""
+    _, service, name = method.split("/")
+    return format_labels([("service", service), ("method", name)] + list(extra.items()))
+
+
+def status_name(context, error=None):
+    """
+    Returns the name of the status code a call ended with: the one the handler set or
+    aborted with, CANCELLED if the client went away mid-stream, UNKNOWN for any other
+    exception, and OK otherwise.
+    """
+    if isinstance(error, (GeneratorExit, asyncio.CancelledError)):
+        return "CANCELLED"
+    code = context.code() if hasattr(context, "code") else None
+    if isinstance(code, grpc.StatusCode):
+        return code.name
+    # a stream that noticed its client leave and returned
+    if hasattr(context, "is_active") and not context.is_active():
+        return "CANCELLED"
+    if hasattr(context, "cancelled") and context.cancelled():
+        return "CANCELLED"
+    return "OK" if error is None else "UNKNOWN"
+
+
+class CodeRecordingContext:
+    """
+    Stands in for a servicer context that cannot report the status code set on it, as
+    the one grpc.aio gives synchronous handlers, remembering the code itself.
+    """
+
+    def __init__(self, context):
+        self.context = context
+        self.status = None
+
+    def __getattr__(self, name):
+        return getattr(self.context, name)
+
+    def set_code(self, code):
+        self.status = code
+        self.context.set_code(code)
+
+    def abort(self, code, details):
+        self.status = code
+        return self.context.abort(code, details)
+
+    def code(self):
+        return self.status
+
+
+def counted(stats, messages):
+    """Passes a stream of messages through, adding their sizes to the request bytes."""
+    for message in messages:
+        stats.request_bytes += message.ByteSize()
+        yield message
+
+
+async def counted_async(stats, messages):
+    async for message in messages:
+        stats.request_bytes += message.ByteSize()
+        yield message
+
+
+def measured(metrics, method, behavior, request_streaming, response_streaming):
+    """
+    Wraps an RPC handler function so every call through it is counted.
+
+    Args:
+    - metrics (Metrics): Where to count.
+    - method (str): The full method name.
+    - behavior: The handler function, plain, coroutine, generator or async generator.
+    - request_streaming (bool): Whether the handler takes a stream of requests.
+    - response_streaming (bool): Whether the handler returns a stream of responses.
+
+    Returns:
+    A handler function of the same kind.
+    """
+    # every call sets current_method as it starts rather than resetting it when done: a
+    # grpc.aio call runs in its own task's context, and a thread of the synchronous
+    # server only ever serves one call at a time
+    def receive(stats, request):
+        if request_streaming:
+            if hasattr(request, "__aiter__"):
+                return counted_async(stats, request)
+            return counted(stats, request)
+        stats.request_bytes += request.ByteSize()
+        return request
+
+    if inspect.isasyncgenfunction(behavior):
+        async def handler(request, context):
+            stats, started_at = metrics.start(method)
+            current_method.set(method)
+            try:
+                async for response in behavior(receive(stats, request), context):
+                    stats.response_bytes += response.ByteSize()
+                    yield response
+            except BaseException as error:
+                metrics.finish(stats, started_at, status_name(context, error))
+                raise
+            metrics.finish(stats, started_at, status_name(context))
+
+    elif inspect.iscoroutinefunction(behavior):
+        async def handler(request, context):
+            stats, started_at = metrics.start(method)
+            current_method.set(method)
+            try:
+                response = await behavior(receive(stats, request), context)
+            except BaseException as error:
+                metrics.finish(stats, started_at, status_name(context, error))
+                raise
+            stats.response_bytes += response.ByteSize()
+            metrics.finish(stats, started_at, status_name(context))
+            return response
+
+    elif response_streaming:
+        def handler(request, context):
+            if not hasattr(context, "code"):
+                context = CodeRecordingContext(context)
+            stats, started_at = metrics.start(method)
+            current_method.set(method)
+            try:
+                for response in behavior(receive(stats, request), context):
+                    stats.response_bytes += response.ByteSize()
+                    yield response
+            except BaseException as error:
+                metrics.finish(stats, started_at, status_name(context, error))
+                raise
+            metrics.finish(stats, started_at, status_name(context))
+
+    else:
+        def handler(request, context):
+            if not hasattr(context, "code"):
+                context = CodeRecordingContext(context)
+            stats, started_at = metrics.start(method)
+            current_method.set(method)
+            try:
+                response = behavior(receive(stats, request), context)
+            except BaseException as error:
+                metrics.finish(stats, started_at, status_name(context, error))
+                raise
+            stats.response_bytes += response.ByteSize()
+            metrics.finish(stats, started_at, status_name(context))
+            return response
+
+    return handler
+
+
+def measured_handler(metrics, method, handler):
+    """
+    Returns a copy of an RPC method handler whose calls are counted, or the handler
+    itself if it is None (an unknown method).
+    """
+    if handler is None:
+        return None
+    if handler.request_streaming and handler.response_streaming:
+        wrap, behavior = grpc.stream_stream_rpc_method_handler, handler.stream_stream
+    elif handler.request_streaming:
+        wrap, behavior = grpc.stream_unary_rpc_method_handler, handler.stream_unary
+    elif handler.response_streaming:
+        wrap, behavior = grpc.unary_stream_rpc_method_handler, handler.unary_stream
+    else:
+        wrap, behavior = grpc.unary_unary_rpc_method_handler, handler.unary_unary
+    return wrap(
+        measured(metrics, method, behavior, handler.request_streaming, handler.response_streaming),
+        request_deserializer=handler.request_deserializer,
+        response_serializer=handler.response_serializer,
+    )
+
+
+class MetricsInterceptor(grpc.ServerInterceptor):
+    """Counts every RPC of a grpc server in a Metrics."""
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def intercept_service(self, continuation, handler_call_details):
+        return measured_handler(self.metrics, handler_call_details.method, continuation(handler_call_details))
+
+
+class AsyncMetricsInterceptor(grpc.aio.ServerInterceptor):
+    """Counts every RPC of a grpc.aio server in a Metrics."""
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    async def intercept_service(self, continuation, handler_call_details):
+        handler = await continuation(handler_call_details)
+        return measured_handler(self.metrics, handler_call_details.method, handler)
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """Serves the metrics page at /metrics."""
+
+    metrics = None
+
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = self.metrics.exposition().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # scrapes come every few seconds; keep them out of the server's console
+        pass
+
+
+def serve_metrics(metrics, port, host="localhost"):
+    """
+    Serves the metrics at http://host:port/metrics from a background thread.
+
+    Args:
+    - metrics (Metrics): The metrics to serve.
+    - port (int): The port to listen on, 0 for any free one.
+    - host (str): The interface to listen on.
+
+    Returns:
+    http.server.ThreadingHTTPServer: The running server; call shutdown() to stop it.
+    """
+    handler = type("BoundMetricsHandler", (MetricsHandler,), {"metrics": metrics})
+    server = http.server.ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
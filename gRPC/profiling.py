@@ -0,0 +1,177 @@
+import functools
+import re
+import sqlite3
+import time
+
+from metrics import current_method
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+WHITESPACE = re.compile(r"\s+")
+# the placeholder lists of IN clauses built for a varying number of values
+PLACEHOLDER_LIST = re.compile(r"\?(?:\s*,\s*\?)+")
+
+
+@functools.lru_cache(maxsize=1024)
+def normalize_sql(sql):
+    """
+    Reduces a statement to its shape, so every run of it is timed under one name:
+    literals become ?, runs of placeholders become "?, ..." and whitespace collapses.
+
+    Args:
+    - sql (str): The statement as executed.
+
+    Returns:
+    str: The normalized statement.
+    """
+    sql = STRING_LITERAL.sub("?", sql)
+    sql = NUMBER_LITERAL.sub("?", sql)
+    sql = PLACEHOLDER_LIST.sub("?, ...", sql)
+    return WHITESPACE.sub(" ", sql).strip()
+
+
+def handler_name():
+    """Returns the name of the RPC being served, or background for work outside any RPC."""
+    return current_method.get().rsplit("/", 1)[-1] or "background"
+
+
+class Profiler:
+    """
+    Times where a server's calls spend their time: waiting for and holding the account
+    and username locks, running each SQL statement and committing, which is where
+    SQLite fsyncs. Every timing goes into a histogram of a Metrics, served with its
+    RPC metrics, and any one slower than the threshold is also logged, with the RPC it
+    was part of. Nothing is timed unless a service is started with a Profiler.
+    """
+
+    def __init__(self, metrics, slow_ms=100.0, log=print):
+        """
+        Args:
+        - metrics (Metrics): Where to keep the histograms. Its interceptor must be
+          installed too, for the timings to know their RPC.
+        - slow_ms (float): Operations taking at least this many milliseconds are logged.
+        - log: Called with each slow-operation line.
+
+        Returns:
+        None
+        """
+        self.metrics = metrics
+        self.slow = slow_ms / 1000.0
+        self.log = log
+        metrics.describe("chat_lock_wait_seconds", "Time waiting to acquire a lock, by lock and RPC method.")
+        metrics.describe("chat_lock_hold_seconds", "Time a lock was held, by lock and RPC method.")
+        metrics.describe("chat_sql_seconds", "Time running a SQL statement up to its first row, by statement.")
+        metrics.describe("chat_commit_seconds", "Time committing a transaction, fsync included, by RPC method.")
+        # bound to this profiler, like MetricsHandler to its metrics
+        self.cursor_class = type("BoundProfiledCursor", (ProfiledCursor,), {"profiler": self})
+        self.connection_class = type(
+            "BoundProfiledConnection", (ProfiledConnection,), {"profiler": self, "cursor_class": self.cursor_class}
+        )
+
+    def record(self, name, labels, seconds, operation):
+        """
+        Observes one timing and logs it if it is slow.
+
+        Args:
+        - name (str): The histogram to add it to.
+        - labels (tuple): (label, value) pairs naming the series.
+        - seconds (float): The time taken.
+        - operation (str): What took that long, for the log.
+
+        Returns:
+        None
+        """
+        self.metrics.observe(name, labels, seconds)
+        if seconds >= self.slow:
+            self.log("[SLOW] " + format(seconds * 1000, ".1f") + " ms " + operation + " in " + handler_name())
+
+    def lock(self, lock, name):
+        """
+        Returns:
+        TimedLock: A view of the lock timing every with statement taking it.
+        """
+        return TimedLock(self, lock, name)
+
+    def statement(self, sql, seconds):
+        statement = normalize_sql(sql)
+        self.record("chat_sql_seconds", (("statement", statement),), seconds, statement)
+
+    def commit(self, seconds):
+        self.record("chat_commit_seconds", (("method", handler_name()),), seconds, "commit")
+
+
+class TimedLock:
+    """
+    Takes a lock in a with statement like the lock itself, timing the wait to acquire
+    it and how long it is held. Both are recorded after it is released, so recording
+    never lengthens the hold.
+    """
+
+    def __init__(self, profiler, lock, name):
+        self.profiler = profiler
+        self.lock = lock
+        self.name = name
+        # only the holder touches these
+        self.waited = 0.0
+        self.acquired_at = 0.0
+
+    def __enter__(self):
+        started_at = time.perf_counter()
+        self.lock.acquire()
+        self.acquired_at = time.perf_counter()
+        self.waited = self.acquired_at - started_at
+        return self
+
+    def __exit__(self, *exc_info):
+        waited, held = self.waited, time.perf_counter() - self.acquired_at
+        self.lock.release()
+        labels = (("lock", self.name), ("method", handler_name()))
+        self.profiler.record("chat_lock_wait_seconds", labels, waited, "waiting for the " + self.name + " lock")
+        self.profiler.record("chat_lock_hold_seconds", labels, held, "holding the " + self.name + " lock")
+        return False
+
+
+class ProfiledCursor(sqlite3.Cursor):
+    """A cursor timing every statement it runs. Profiler binds it to itself."""
+
+    profiler = None
+
+    def execute(self, sql, parameters=()):
+        started_at = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.profiler.statement(sql, time.perf_counter() - started_at)
+
+    def executemany(self, sql, seq_of_parameters):
+        started_at = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self.profiler.statement(sql, time.perf_counter() - started_at)
+
+
+class ProfiledConnection(sqlite3.Connection):
+    """
+    A connection timing its commits and handing out ProfiledCursors. It is a real
+    sqlite3.Connection, so it also works with the backup API. Profiler binds it to itself.
+    """
+
+    profiler = None
+    cursor_class = None
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or self.cursor_class)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        started_at = time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            self.profiler.commit(time.perf_counter() - started_at)
@@ -0,0 +1,350 @@
+import os
+import threading
+import time
+
+import chat_pb2
+import chat_pb2_grpc
+import grpc
+
+
+class LogShipper:
+    """
+    Streams the primary's replication log to one backup. Entries are sent in order in
+    batches; the backup replies with the last sequence number it applied, and the
+    shipper always resumes from there, so a backup that restarts or misses a batch is
+    caught up from its own position.
+    """
+
+    def __init__(self, service, address, batch_size=256, timeout=5.0, heartbeat_seconds=1.0):
+        """
+        Initializes a shipper for the backup at the given address. Call start() to begin.
+
+        Args:
+        - service (ChatService): The primary whose log is shipped.
+        - address (str): host:port of the backup.
+        - batch_size (int): The most entries sent in one AppendEntries call.
+        - timeout (float): Deadline in seconds for each AppendEntries call.
+        - heartbeat_seconds (float): How often an idle shipper still contacts the backup,
+          so its view of the primary's position stays current.
+
+        Returns:
+        None
+        """
+        self.service = service
+        self.address = address
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.heartbeat_seconds = heartbeat_seconds
+        self.acked_seq = 0
+        # the first call carries no entries and only learns where the backup is
+        self.synced = False
+        self.wakeup = threading.Event()
+        self.running = True
+        self.channel = grpc.insecure_channel(address)
+        self.stub = chat_pb2_grpc.ReplicationServiceStub(self.channel)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def ship(self):
+        """
+        Sends the next batch of entries the backup has not acknowledged.
+
+        Returns:
+        True if a full batch was sent and more entries may be waiting, otherwise False.
+        """
+        entries = self.service.log_entries(self.acked_seq, self.batch_size) if self.synced else []
+        elector = self.service.elector
+        term, leader = elector.current() if elector is not None else (0, "")
+        sent_at = time.monotonic()
+        reply = self.stub.AppendEntries(
+            chat_pb2.AppendRequest(leader_seq=self.service.last_log_seq(), entries=entries, term=term, leader=leader),
+            timeout=self.timeout,
+        )
+        if elector is not None and reply.term > term:
+            # another server has been elected since; stop shipping and step down
+            elector.observe_term(reply.term)
+            return False
+        if elector is not None:
+            elector.heard_from(self.address, sent_at)
+        # the backup's own position wins, whether it is ahead after a restart or behind after a gap
+        self.acked_seq = reply.applied_seq
+        if not self.synced:
+            self.synced = True
+            return True
+        return reply.success and len(entries) == self.batch_size
+
+    def run(self):
+        """Shipper thread loop: ships until caught up, then waits for new commits or a heartbeat."""
+        while self.running:
+            # cleared before reading the log, so a commit that lands meanwhile is not missed
+            self.wakeup.clear()
+            try:
+                more = self.ship()
+            except grpc.RpcError:
+                # the backup is down; keep retrying at the heartbeat rate
+                more = False
+            if not more:
+                self.wakeup.wait(self.heartbeat_seconds)
+        self.channel.close()
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+        self.thread.join()
+
+
+class Replicator:
+    """
+    Ships a primary's writes to its backups asynchronously. Client writes return once
+    they are committed on the primary; each backup is brought up to date by its own
+    LogShipper thread, so a slow or unreachable backup never holds up the others.
+    """
+
+    def __init__(self, service, backups, **shipper_options):
+        """
+        Starts one shipper per backup.
+
+        Args:
+        - service (ChatService): The primary whose log is shipped.
+        - backups (list): host:port addresses of the backups.
+        - shipper_options: Passed on to every LogShipper.
+
+        Returns:
+        None
+        """
+        self.shippers = [LogShipper(service, address, **shipper_options) for address in backups]
+        for shipper in self.shippers:
+            shipper.start()
+
+    def notify(self):
+        """Wakes every shipper after a commit."""
+        for shipper in self.shippers:
+            shipper.wakeup.set()
+
+    def progress(self):
+        """
+        Returns:
+        A list of (backup address, last sequence number it acknowledged) tuples.
+        """
+        return [(shipper.address, shipper.acked_seq) for shipper in self.shippers]
+
+    def stop(self):
+        for shipper in self.shippers:
+            shipper.stop()
+
+
+class Resyncer:
+    """
+    Brings a backup back in line with the primary. At startup, and then periodically,
+    it pulls the log entries it missed in bounded batches. When it is too far behind,
+    or its history does not match the primary's, it first loads the primary's latest
+    snapshot and then pulls only the log after it. Each pass then runs
+    anti-entropy: it compares per-user inbox digests with the primary page by page and
+    replaces any user that differs. The backup keeps serving reads throughout.
+    """
+
+    def __init__(self, service, primary, interval_seconds=30.0, batch_size=256, snapshot_lag=10000,
+                 timeout=5.0):
+        """
+        Initializes a resyncer against the given primary. Call start() to begin.
+
+        Args:
+        - service (ChatService): The backup to keep in sync.
+        - primary (str): host:port of the primary.
+        - interval_seconds (float): How long to wait between passes.
+        - batch_size (int): The most entries or users to transfer per batch.
+        - snapshot_lag (int): How many entries behind the backup may be before it
+          fetches a snapshot instead of replaying the log.
+        - timeout (float): Deadline in seconds for each unary call.
+
+        Returns:
+        None
+        """
+        self.service = service
+        self.primary = primary
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self.snapshot_lag = snapshot_lag
+        self.timeout = timeout
+        # how long the first catch-up after startup took, once it has finished
+        self.bootstrap_seconds = None
+        self.stopped = threading.Event()
+        self.channel = grpc.insecure_channel(primary)
+        self.stub = chat_pb2_grpc.ReplicationServiceStub(self.channel)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def catch_up(self):
+        """
+        Applies whatever the backup missed, from the log if possible.
+
+        Returns:
+        int: The sequence number the backup is at afterwards.
+        """
+        status = self.stub.ReplicationStatus(chat_pb2.ClientMessage(), timeout=self.timeout)
+        applied_seq = self.service.applied_seq
+        # a backup ahead of the primary has history the primary never wrote
+        if applied_seq > status.applied_seq or status.applied_seq - applied_seq > self.snapshot_lag:
+            self.install_snapshot()
+        try:
+            self.pull_log()
+        except grpc.RpcError as error:
+            # the entries right after ours were compacted into a snapshot
+            if error.code() != grpc.StatusCode.OUT_OF_RANGE:
+                raise
+            self.install_snapshot()
+            self.pull_log()
+        return self.service.applied_seq
+
+    def pull_log(self):
+        request = chat_pb2.LogRequest(after_seq=self.service.applied_seq, limit=self.batch_size)
+        for batch in self.stub.FetchLog(request):
+            self.service.apply_entries(batch)
+
+    def install_snapshot(self):
+        """
+        Downloads the primary's latest snapshot next to the database and loads it.
+
+        Returns:
+        int: The sequence number the backup is at afterwards.
+        """
+        incoming = self.service.snapshot_path + ".incoming"
+        try:
+            with open(incoming, "wb") as snapshot:
+                for chunk in self.stub.FetchSnapshot(chat_pb2.ClientMessage()):
+                    snapshot.write(chunk.data)
+            return self.service.load_snapshot(incoming)
+        finally:
+            if os.path.exists(incoming):
+                os.remove(incoming)
+
+    def anti_entropy(self):
+        """
+        Compares every user's inbox digest with the primary's and repairs the users that differ.
+
+        Returns:
+        int: The number of users repaired.
+        """
+        repaired = 0
+        cursor = ""
+        while True:
+            page = self.stub.UserDigests(
+                chat_pb2.ListAccountsRequest(cursor=cursor, page_size=self.batch_size), timeout=self.timeout
+            )
+            remote = {digest.user: digest.digest for digest in page.digests}
+            # the last page covers every remaining user, including ones only this backup has
+            upto = page.next_cursor if len(page.digests) == self.batch_size else None
+            local = dict(self.service.user_digests(cursor, upto))
+            for username in sorted(set(remote) | set(local)):
+                if remote.get(username) == local.get(username):
+                    continue
+                state = self.stub.FetchUser(chat_pb2.ClientMessage(info=username), timeout=self.timeout)
+                if self.service.install_user(username, state):
+                    repaired += 1
+            if upto is None:
+                return repaired
+            cursor = upto
+
+    def run(self):
+        """Resync thread loop: catches up and runs anti-entropy, then waits for the next pass."""
+        start = time.monotonic()
+        while not self.stopped.is_set():
+            try:
+                self.catch_up()
+                if self.bootstrap_seconds is None:
+                    self.bootstrap_seconds = time.monotonic() - start
+                    print("[RESYNC] Caught up to entry " + str(self.service.applied_seq)
+                          + " in %.2f seconds" % self.bootstrap_seconds)
+                self.anti_entropy()
+            except grpc.RpcError:
+                # the primary is unreachable; try again next pass
+                pass
+            except ValueError:
+                # stop() closed the channel between two calls
+                if not self.stopped.is_set():
+                    raise
+            self.stopped.wait(self.interval_seconds)
+        self.channel.close()
+
+    def stop(self):
+        self.stopped.set()
+        # cancels a FetchLog or FetchSnapshot stream still waiting on the primary
+        self.channel.close()
+        self.thread.join()
+
+
+class Snapshotter:
+    """
+    Periodically snapshots a server's database and compacts its log, so a new or
+    far-behind replica can start from a recent snapshot instead of the whole history.
+    """
+
+    def __init__(self, service, interval_seconds):
+        self.service = service
+        self.interval_seconds = interval_seconds
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        """Snapshot thread loop: snapshots whenever the log has grown since the last one."""
+        while not self.stopped.wait(self.interval_seconds):
+            if self.service.last_log_seq() != self.service.snapshot_seq:
+                self.service.take_snapshot()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+class ReplicationServicer(chat_pb2_grpc.ReplicationServiceServicer):
+    """Internal RPCs between replicas, backed by the server's ChatService."""
+
+    def __init__(self, service):
+        self.service = service
+
+    def AppendEntries(self, request, context):
+        elector = self.service.elector
+        if elector is not None:
+            # log shipments double as the leader's heartbeats
+            accepted, term = elector.handle_heartbeat(request.term, request.leader)
+            if not accepted:
+                return chat_pb2.AppendReply(success=False, applied_seq=self.service.applied_seq, term=term)
+        elif self.service.role != self.service.BACKUP:
+            context.abort(grpc.StatusCode.FAILED_PRECONDITION, "only backups apply log entries")
+        reply = self.service.apply_entries(request)
+        reply.term = request.term
+        return reply
+
+    def ReplicationStatus(self, request, context):
+        return self.service.replication_status()
+
+    def FetchLog(self, request, context):
+        try:
+            yield from self.service.log_batches(request.after_seq, request.limit or 256)
+        except ValueError as error:
+            context.abort(grpc.StatusCode.OUT_OF_RANGE, str(error))
+
+    def FetchSnapshot(self, request, context):
+        return self.service.snapshot_chunks()
+
+    def UserDigests(self, request, context):
+        digests = self.service.user_digests(request.cursor, limit=request.page_size or 256)
+        return chat_pb2.DigestPage(
+            digests=[chat_pb2.UserDigest(user=username, digest=digest) for username, digest in digests],
+            next_cursor=digests[-1][0] if digests else request.cursor,
+        )
+
+    def FetchUser(self, request, context):
+        return self.service.user_state(request.info)
+
+    def RequestVote(self, request, context):
+        if self.service.elector is None:
+            context.abort(grpc.StatusCode.FAILED_PRECONDITION, "this server does not take part in elections")
+        return self.service.elector.handle_vote(request)
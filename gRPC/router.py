@@ -0,0 +1,215 @@
+import threading
+import time
+
+import chat_pb2
+import grpc
+
+# errors that say the server could not be reached, as opposed to the server answering with an error
+UNHEALTHY_CODES = (grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.DEADLINE_EXCEEDED)
+
+
+class ReplicaHealth:
+    """Health of one server as seen by the client: its latency and circuit breaker."""
+
+    def __init__(self):
+        # exponentially weighted moving average of successful call latency, None until measured
+        self.latency = None
+        self.failures = 0
+        # while set, the breaker is open and the server is skipped until a probe succeeds
+        self.opened_at = None
+
+
+class ReplicaRouter:
+    """
+    Tracks the health of each server a client talks to and decides which to try first.
+    Each call's outcome feeds a latency average and a circuit breaker per server. After
+    failure_threshold calls in a row fail to reach a server, its breaker opens and it is
+    skipped, so failing over costs nothing instead of a timeout. A background thread
+    probes servers with open breakers and closes them again once they answer.
+    """
+
+    def __init__(self, probe_timeout=1.0, probe_seconds=1.0, failure_threshold=2, smoothing=0.3):
+        """
+        Initializes a router with every server assumed healthy.
+
+        Args:
+        - probe_timeout (float): Deadline in seconds for each background probe.
+        - probe_seconds (float): How often servers with open breakers are probed.
+        - failure_threshold (int): Consecutive failures that open a server's breaker.
+        - smoothing (float): Weight of the newest sample in the latency average.
+
+        Returns:
+        None
+        """
+        self.probe_timeout = probe_timeout
+        self.probe_seconds = probe_seconds
+        self.failure_threshold = failure_threshold
+        self.smoothing = smoothing
+        self.health = {}
+        self.lock = threading.Lock()
+        self.prober = None
+        self.stopped = threading.Event()
+
+    def replica(self, stub):
+        # callers hold self.lock
+        health = self.health.get(stub)
+        if health is None:
+            health = self.health[stub] = ReplicaHealth()
+        return health
+
+    def is_open(self, stub):
+        with self.lock:
+            return self.replica(stub).opened_at is not None
+
+    def available(self, stubs):
+        """
+        Returns the servers whose breakers are closed, in the given order. If every
+        breaker is open, every server is returned, so a call still has somewhere to go.
+
+        Args:
+        - stubs (list): The servers to choose from.
+
+        Returns:
+        list: The servers to try, in order.
+        """
+        healthy = [stub for stub in stubs if not self.is_open(stub)]
+        return healthy or list(stubs)
+
+    def fastest(self, stubs):
+        """
+        Returns the available servers, fastest first. Servers not measured yet come first
+        so every server gets measured.
+
+        Args:
+        - stubs (list): The servers to choose from.
+
+        Returns:
+        list: The servers to try, in order.
+        """
+        with self.lock:
+            latencies = {stub: self.replica(stub).latency for stub in stubs}
+        return sorted(
+            self.available(stubs),
+            key=lambda stub: -1.0 if latencies[stub] is None else latencies[stub],
+        )
+
+    def record_success(self, stub, latency):
+        with self.lock:
+            health = self.replica(stub)
+            if health.latency is None:
+                health.latency = latency
+            else:
+                health.latency += self.smoothing * (latency - health.latency)
+        self.close(stub)
+
+    def record_failure(self, stub, error):
+        """
+        Counts a failed call against a server, opening its breaker if it could not be reached
+        failure_threshold times in a row. An error the server itself returned counts as
+        the server being up.
+
+        Args:
+        - stub: The server the call went to.
+        - error (Exception): What the call raised.
+
+        Returns:
+        None
+        """
+        if isinstance(error, grpc.RpcError) and error.code() not in UNHEALTHY_CODES:
+            with self.lock:
+                self.replica(stub).failures = 0
+            return
+        with self.lock:
+            health = self.replica(stub)
+            health.failures += 1
+            if health.failures >= self.failure_threshold and health.opened_at is None:
+                health.opened_at = time.monotonic()
+                if self.prober is None and not self.stopped.is_set():
+                    self.prober = threading.Thread(target=self.probe_loop, daemon=True)
+                    self.prober.start()
+
+    def call(self, stub, function, *args, **kwargs):
+        """
+        Makes one call to a server and records how it went.
+
+        Args:
+        - stub: The server being called.
+        - function: The stub method to call.
+        - args, kwargs: Passed on to the call.
+
+        Returns:
+        Whatever the call returned.
+
+        Raises:
+        Whatever the call raised.
+        """
+        start = time.monotonic()
+        try:
+            result = function(*args, **kwargs)
+        except Exception as error:
+            self.record_failure(stub, error)
+            raise
+        self.record_success(stub, time.monotonic() - start)
+        return result
+
+    def track(self, stub, future):
+        """
+        Records the outcome of an asynchronous call once it finishes.
+
+        Args:
+        - stub: The server being called.
+        - future: The gRPC or concurrent.futures future of the call.
+
+        Returns:
+        The same future.
+        """
+        start = time.monotonic()
+
+        def on_done(call):
+            error = call.exception()
+            if error is None:
+                self.record_success(stub, time.monotonic() - start)
+            else:
+                self.record_failure(stub, error)
+
+        future.add_done_callback(on_done)
+        return future
+
+    def probe(self, stub):
+        """
+        Checks whether a server answers, using the cheapest read there is: a login
+        lookup for the empty username, which only touches the server's in-memory index.
+
+        Returns:
+        bool: True if the server answered.
+        """
+        try:
+            self.call(stub, stub.LoginClient, chat_pb2.ClientMessage(info=""), timeout=self.probe_timeout)
+        except grpc.RpcError as error:
+            if error.code() in UNHEALTHY_CODES:
+                return False
+            # the server answered, just not with a result
+            self.close(stub)
+        return True
+
+    def close(self, stub):
+        with self.lock:
+            health = self.replica(stub)
+            health.failures = 0
+            health.opened_at = None
+
+    def probe_loop(self):
+        """Prober thread loop: probes every server with an open breaker until it recovers."""
+        while not self.stopped.wait(self.probe_seconds):
+            with self.lock:
+                down = [stub for stub, health in self.health.items() if health.opened_at is not None]
+            for stub in down:
+                self.probe(stub)
+
+    def stop(self):
+        """Stops the prober thread, if it was started, and waits for it to exit."""
+        with self.lock:
+            self.stopped.set()
+            prober = self.prober
+        if prober is not None:
+            prober.join()
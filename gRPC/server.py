@@ -1,7 +1,18 @@
+import contextlib
+import hashlib
+import os
+import queue
 import threading
+import time
 import chat_pb2
 import chat_pb2_grpc
+import grpc
+from election import Elector
+from replication import Replicator, Resyncer, Snapshotter
 from user import User
+from storage import ConnectionPool, GroupCommitter
+from workers import WorkerBus
+from mailboxes import MailboxCache
 import sqlite3
 import numpy as np
 
@@ -9,149 +20,1532 @@ import numpy as np
 class ChatService(chat_pb2_grpc.ChatServiceServicer):
     SEPARATE_CHARACTER = "\n"
 
+    # serializes account creation and deletion across all users
     USER_LOCK = threading.Lock()
 
-    LISTEN_FLAG = True
+    # per-user locks, striped by username hash so handlers for different users run in parallel
+    LOCK_STRIPES = 64
+    USER_LOCKS = [threading.Lock() for _ in range(LOCK_STRIPES)]
 
-    def start_db(self, db):
-        self.conn = sqlite3.connect(db, check_same_thread=False)
-        self.c = self.conn.cursor()
+    # most SendMessages records written per transaction, which bounds memory per stream
+    BULK_SEND_BATCH = 500
 
+    # page sizes used by ListAccounts and FetchMessages when the client asks for none,
+    # and the most it may ask for
+    DEFAULT_PAGE_SIZE = 100
+    MAX_PAGE_SIZE = 1000
 
-    def is_valid_user(self, username: str):
+    # how often an idle subscription wakes up to check whether its client is still there
+    SUBSCRIBE_POLL_SECONDS = 1.0
+
+    # replication roles; a backup, and a primary without its lease, refuse client writes
+    PRIMARY = "primary"
+    BACKUP = "backup"
+    STANDALONE = "standalone"
+    # trailing metadata key carrying a replica's data version on reads
+    VERSION_KEY = "x-data-version"
+    # trailing metadata key naming the leader when a backup refuses a write
+    LEADER_KEY = "x-leader"
+    # the status details of a refused write
+    NOT_PRIMARY = "writes must go to the primary"
+
+    def start_db(self, db, group_commit_ms=None, group_commit_batch=256, role=STANDALONE, profiler=None):
+        # every worker thread gets its own WAL-mode connection from the pool
+        self.pool = ConnectionPool(db, factory=profiler.connection_class if profiler else sqlite3.Connection)
+        if profiler is not None:
+            # timed views of the shared locks, shadowing the class attributes for this instance
+            self.USER_LOCK = profiler.lock(ChatService.USER_LOCK, "accounts")
+            self.USER_LOCKS = [profiler.lock(lock, "user") for lock in ChatService.USER_LOCKS]
+        self.migrate_db()
+        # a replicated server records every write in replication_log, and its seq is also the
+        # replica's data version; a standalone one only counts its writes in data_version
+        self.role = role
+        self.replicated = role != self.STANDALONE
+        self.replicator = None
+        self.resyncer = None
+        self.elector = None
+        # host:port clients and peers reach this server at, once known
+        self.address = ""
+        self.apply_lock = threading.Lock()
+        # the latest snapshot of this database, see take_snapshot
+        self.snapshot_path = db + ".snapshot"
+        self.snapshot_lock = threading.Lock()
+        self.snapshot_seq = None
+        self.snapshotter = None
+        # links the worker processes of a server started with --workers, see start_bus
+        self.bus = None
+        # write-back cache of active users' inboxes, see start_mailboxes
+        self.mailboxes = None
+        self.c.execute("SELECT COALESCE(MAX(seq), 0) FROM replication_log")
+        self.applied_seq = self.c.fetchone()[0]
+        self.leader_seq = self.applied_seq
+        # optionally share one transaction and fsync between sends that arrive together
+        self.group_committer = None
+        if group_commit_ms is not None:
+            self.group_committer = GroupCommitter(self.pool, group_commit_ms, group_commit_batch)
+        # online users' open SubscribeMessages streams, each fed through its own queue
+        self.subscribers = {}
+        self.subscribers_lock = threading.Lock()
+        # in-memory username index, kept in step with the users table by create and delete
+        self.load_usernames()
+
+    @property
+    def conn(self):
+        return self.pool.connection()
+
+    @property
+    def c(self):
+        return self.pool.cursor()
+
+    def start_replication(self, backups, **shipper_options):
+        """
+        Starts shipping this primary's writes to its backups in the background.
+
+        Args:
+        - backups (list): host:port addresses of the backups.
+        - shipper_options: Passed on to every LogShipper, e.g. batch_size or timeout.
+
+        Returns:
+        None
+        """
+        self.replicator = Replicator(self, backups, **shipper_options)
+
+    def start_resync(self, primary, **resync_options):
+        """
+        Starts catching this backup up with the primary in the background, then keeps
+        checking it for divergence.
+
+        Args:
+        - primary (str): host:port of the primary.
+        - resync_options: Passed on to the Resyncer, e.g. interval_seconds.
+
+        Returns:
+        None
+        """
+        self.resyncer = Resyncer(self, primary, **resync_options)
+        self.resyncer.start()
+
+    def start_election(self, address, peers, election_timeout=1.0):
+        """
+        Starts electing a leader among this server and its peers. The server starts as a
+        backup and becomes the primary only if it is elected.
+
+        Args:
+        - address (str): host:port of this server, as its peers know it.
+        - peers (list): host:port addresses of the other servers.
+        - election_timeout (float): Seconds without a heartbeat before standing for election.
+
+        Returns:
+        None
+        """
+        self.address = address
+        self.role = self.BACKUP
+        self.replicated = True
+        self.elector = Elector(self, address, peers, election_timeout)
+        self.elector.start()
+
+    def lead(self, backups, **shipper_options):
+        """
+        Takes over as primary after winning an election, if not already leading.
+
+        Args:
+        - backups (list): host:port addresses of the other servers.
+        - shipper_options: Passed on to every LogShipper.
+
+        Returns:
+        None
+        """
+        if self.role == self.PRIMARY and self.replicator is not None:
+            return
+        if self.resyncer is not None:
+            self.resyncer.stop()
+            self.resyncer = None
+        # a replicator left over from an earlier term ships under a stale term
+        if self.replicator is not None:
+            self.replicator.stop()
+        self.role = self.PRIMARY
+        self.start_replication(backups, **shipper_options)
+
+    def follow(self, primary):
+        """
+        Becomes a backup of the given primary, if not already following it.
+
+        Args:
+        - primary (str): host:port of the primary.
+
+        Returns:
+        None
+        """
+        self.stop_replication()
+        if self.resyncer is not None and self.resyncer.primary == primary:
+            return
+        if self.resyncer is not None:
+            self.resyncer.stop()
+        self.start_resync(primary)
+
+    def stop_replication(self):
+        """
+        Stops taking writes and shipping the log, after stepping down as primary.
+
+        Returns:
+        None
+        """
+        self.role = self.BACKUP
+        if self.replicator is not None:
+            self.replicator.stop()
+            self.replicator = None
+
+    def leader_address(self):
+        """
+        Returns:
+        str: host:port of the current primary as far as this server knows, or "" if unknown.
+        """
+        if self.elector is not None:
+            return self.elector.current()[1]
+        if self.role == self.PRIMARY:
+            return self.address
+        if self.resyncer is not None:
+            return self.resyncer.primary
+        return ""
+
+    def load_vote(self):
+        """
+        Returns:
+        (int, str): The latest election term this server has seen and whom it voted for in it.
+        """
+        self.c.execute("SELECT term, voted_for FROM election_state WHERE id = 0")
+        row = self.c.fetchone()
+        return row if row is not None else (0, "")
+
+    def save_vote(self, term, voted_for):
+        """
+        Durably records the current term and vote, so a restarted server never votes twice in a term.
+
+        Args:
+        - term (int): The current election term.
+        - voted_for (str): Address of the candidate voted for in it, or "".
+
+        Returns:
+        None
+        """
+        self.c.execute(
+            "INSERT OR REPLACE INTO election_state (id, term, voted_for) VALUES (0, ?, ?)", (term, voted_for)
+        )
+        self.conn.commit()
+
+    def start_bus(self, directory, index, count):
+        """
+        Connects this worker process to the other workers serving the same database,
+        so accounts and messages committed by one reach the others' in-memory state.
+
+        Args:
+        - directory (str): Directory holding the workers' sockets.
+        - index (int): This worker's number, from 0.
+        - count (int): Number of workers.
+
+        Returns:
+        None
+        """
+        self.bus = WorkerBus(self, directory, index, count)
+
+    def start_mailboxes(self, max_bytes, flush_ms=50.0):
+        """
+        Serves active users' inboxes from memory, writing changes back to the database
+        in the background. Only for a server that is neither replicated nor one of
+        several workers, which need every write in the database as it happens.
+
+        Args:
+        - max_bytes (int): Roughly how much memory the cached inboxes may take.
+        - flush_ms (float): The longest a write stays in memory only.
+
+        Returns:
+        None
+        """
+        self.mailboxes = MailboxCache(self, max_bytes, flush_ms)
+
+    def start_snapshots(self, interval_seconds):
+        """
+        Starts taking a snapshot, and compacting the log, every interval_seconds.
+
+        Args:
+        - interval_seconds (float): How long to wait between snapshots.
+
+        Returns:
+        None
+        """
+        self.snapshotter = Snapshotter(self, interval_seconds)
+        self.snapshotter.start()
+
+    def close_db(self):
+        if self.bus is not None:
+            self.bus.stop()
+        if self.mailboxes is not None:
+            self.mailboxes.stop()
+        if self.elector is not None:
+            self.elector.stop()
+        if self.snapshotter is not None:
+            self.snapshotter.stop()
+        if self.resyncer is not None:
+            self.resyncer.stop()
+        if self.replicator is not None:
+            self.replicator.stop()
+        if self.group_committer is not None:
+            self.group_committer.stop()
+        self.pool.close()
+
+    def migrate_db(self):
+        """
+        Creates the users and messages tables if they are missing, and moves any
+        messages still packed into the legacy users.incoming_messages column into
+        the messages table.
+
+        Returns:
+        None
+        """
+        self.c.execute(
+            """
+            CREATE TABLE IF NOT EXISTS users
+            ([user_id] INTEGER PRIMARY KEY, [user_name] TEXT, [incoming_messages] TEXT)
+            """
+        )
+        # one row per undelivered message, so a send is a single insert instead of
+        # rewriting the receiver's whole inbox
         self.c.execute(
             """
-            SELECT
-            user_name
-            FROM users
+            CREATE TABLE IF NOT EXISTS messages
+            ([id] INTEGER PRIMARY KEY AUTOINCREMENT, [sender] TEXT, [receiver] TEXT,
+            [body] TEXT, [created_at] REAL)
             """
         )
-        users = np.array(self.c.fetchall()).flatten()
-        return username in users
+        self.c.execute(
+            "CREATE INDEX IF NOT EXISTS messages_receiver ON messages (receiver, id)"
+        )
+        # drop duplicate accounts left by older servers so user_name can be unique
+        self.c.execute(
+            """
+            DELETE FROM users WHERE user_id NOT IN
+            (SELECT MIN(user_id) FROM users GROUP BY user_name)
+            """
+        )
+        self.c.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS users_user_name ON users (user_name)"
+        )
+        # every write of a replicated server, in commit order, for shipping to backups
+        self.c.execute(
+            """
+            CREATE TABLE IF NOT EXISTS replication_log
+            ([seq] INTEGER PRIMARY KEY AUTOINCREMENT, [operation] TEXT, [user] TEXT,
+            [sender] TEXT, [body] TEXT, [message_id] INTEGER, [created_at] REAL)
+            """
+        )
+
+        # how many writes a standalone server has made, its data version for quorum reads;
+        # it carries on from the log of a server that used to replicate
+        self.c.execute(
+            """
+            CREATE TABLE IF NOT EXISTS data_version
+            ([id] INTEGER PRIMARY KEY CHECK (id = 0), [version] INTEGER)
+            """
+        )
+        self.c.execute(
+            "INSERT OR IGNORE INTO data_version (id, version) SELECT 0, COALESCE(MAX(seq), 0) FROM replication_log"
+        )
+
+        # the latest election term this server has seen and whom it voted for in it
+        self.c.execute(
+            """
+            CREATE TABLE IF NOT EXISTS election_state
+            ([id] INTEGER PRIMARY KEY CHECK (id = 0), [term] INTEGER, [voted_for] TEXT)
+            """
+        )
+
+        # split any legacy newline-joined inboxes into rows, oldest first
+        self.c.execute(
+            "SELECT user_name, incoming_messages FROM users WHERE incoming_messages != ''"
+        )
+        now = time.time()
+        for user_name, incoming_messages in self.c.fetchall():
+            for msg in incoming_messages.strip().split("\n"):
+                self.c.execute(
+                    "INSERT INTO messages (sender, receiver, body, created_at) VALUES (?, ?, ?, ?)",
+                    ("", user_name, msg, now),
+                )
+        self.c.execute(
+            "UPDATE users SET incoming_messages = '' WHERE incoming_messages != ''"
+        )
+        self.conn.commit()
+
+    def is_valid_user(self, username: str, confirm=False):
+        """
+        Checks the in-memory username index. Worker processes started with --workers
+        may miss each other's announcements, so they look up in the users table any
+        name missing from it, and, for a write, any name at all.
+
+        Args:
+        - username (str): The username to check.
+        - confirm (bool): Whether a worker must check the table even for a name in its
+          index, because the caller is about to write for that user.
+
+        Returns:
+        True if the account exists.
+        """
+        if self.bus is None:
+            return username in self.usernames
+        if username in self.usernames and not confirm:
+            return True
+        # another worker may have created or deleted the account without our hearing of it
+        self.c.execute("SELECT 1 FROM users WHERE user_name = ?", (username,))
+        if self.c.fetchone() is None:
+            self.usernames.discard(username)
+            return False
+        self.usernames.add(username)
+        return True
+
+    def load_usernames(self):
+        """Rebuilds the in-memory username index from the users table."""
+        self.c.execute("SELECT user_name FROM users")
+        self.usernames = set(user_name for (user_name,) in self.c.fetchall())
+
+    def accounts_changed(self, accounts):
+        """
+        Announces account changes to the other worker processes, if there are any.
+
+        Args:
+        - accounts (dict): Maps each changed username to True if it now exists.
+
+        Returns:
+        None
+        """
+        if self.bus is not None:
+            self.bus.publish_accounts(accounts)
+
+    def user_lock(self, username: str):
+        """
+        Returns the lock stripe guarding the given username.
+
+        Args:
+        - username (str): The username to look up.
+
+        Returns:
+        The threading.Lock shared by every username hashing to the same stripe.
+        """
+        return self.USER_LOCKS[hash(username) % self.LOCK_STRIPES]
+
+    def user_locks(self, usernames):
+        """
+        Returns the distinct lock stripes guarding several usernames, in stripe order so
+        that holders of more than one stripe always acquire them in the same order.
+
+        Args:
+        - usernames: An iterable of usernames.
+
+        Returns:
+        A list of threading.Lock objects.
+        """
+        stripes = sorted(set(hash(username) % self.LOCK_STRIPES for username in usernames))
+        return [self.USER_LOCKS[stripe] for stripe in stripes]
 
     def LoginClient(self, request, context):
+        self.send_version(context)
         return self.login_processing(request)
 
     def CreateAccountClient(self, request, context):
+        self.check_writable(context)
         return self.create_account_processing(request)
 
     def DeleteAccountClient(self, request, context):
+        self.check_writable(context)
         return self.delete_account_processing(request)
 
     def ListAccountClient(self, request, context):
+        self.send_version(context)
         return self.list_account_processing()
 
     def SendMessageClient(self, request, context):
+        self.check_writable(context)
         return self.send_msg_processing(request)
 
     def ViewMessageClient(self, request, context):
+        self.check_writable(context)
         return self.view_msg_processing(request)
 
     def LogoutClient(self, request, context):
         return self.logout_processing(request)
 
     def CheckIncomingMessagesClient(self, request, context):
-        if self.LISTEN_FLAG:
-            return self.check_msg_processing(request)
+        self.check_writable(context)
+        return self.check_msg_processing(request)
+
+    def SubscribeMessages(self, request, context):
+        self.check_writable(context)
+        return self.subscribe_processing(request, context)
+
+    def SendMessages(self, request_iterator, context):
+        self.check_writable(context)
+        return self.send_messages_processing(request_iterator)
+
+    def SendMessage(self, request, context):
+        self.check_writable(context)
+        return self.send_request_processing(request)
+
+    def ViewInbox(self, request, context):
+        self.check_writable(context)
+        return self.view_inbox_processing(request)
+
+    def ListAccounts(self, request, context):
+        self.send_version(context)
+        return self.list_accounts_processing(request)
+
+    def FetchMessages(self, request, context):
+        self.send_version(context)
+        return self.fetch_msg_processing(request)
+
+    def AckMessages(self, request, context):
+        self.check_writable(context)
+        return self.ack_msg_processing(request)
+
+    def WhoIsLeader(self, request, context):
+        term = self.elector.current()[0] if self.elector is not None else 0
+        return chat_pb2.LeaderReply(leader=self.leader_address(), term=term, address=self.address)
+
+    def refuses_writes(self):
+        """
+        Returns:
+        bool: True on a backup, which only changes through the primary's log, and on an
+        elected primary that has lost its lease, which another server may already have
+        replaced.
+        """
+        return self.role == self.BACKUP or (self.elector is not None and not self.elector.has_lease())
+
+    def check_writable(self, context):
+        """
+        Rejects a client write when refuses_writes says so. Clients see
+        FAILED_PRECONDITION, with the primary's address in the x-leader trailing metadata
+        when it is known, and move on to the next server.
+
+        Args:
+        - context: The gRPC servicer context of the call.
+
+        Returns:
+        None
+        """
+        if self.refuses_writes():
+            context.set_trailing_metadata(self.leader_metadata())
+            context.abort(grpc.StatusCode.FAILED_PRECONDITION, self.NOT_PRIMARY)
+
+    def leader_metadata(self):
+        """
+        Returns:
+        tuple: The trailing metadata naming the primary on a refused write.
+        """
+        return ((self.LEADER_KEY, self.leader_address()),)
+
+    def log_write(self, cursor, operation, user, sender="", body="", message_id=0, created_at=0.0, seq=None):
+        """
+        Records a write in replication_log inside the caller's transaction. The log is
+        what a primary ships to its backups, and its newest sequence number is the data
+        version clients compare when reading from several replicas. A standalone server
+        has nothing to ship, so it only advances its data_version counter instead of
+        growing a log no one reads.
+
+        Args:
+        - cursor: The cursor whose transaction holds the write.
+        - operation (str): CREATE_ACCOUNT, DELETE_ACCOUNT, SEND_MESSAGE or ACK_MESSAGES.
+        - user (str): The account created or deleted, or the receiver of the messages.
+        - sender (str): The sender of a sent message.
+        - body (str): The body of a sent message.
+        - message_id (int): The id of a sent message, or the last id acknowledged.
+        - created_at (float): When a sent message was stored.
+        - seq (int): The sequence number to store the entry under when replaying the
+          primary's log; None lets the primary number it.
+
+        Returns:
+        None
+        """
+        if not self.replicated:
+            cursor.execute("UPDATE data_version SET version = version + 1")
+            return
+        cursor.execute(
+            """
+            INSERT INTO replication_log (seq, operation, user, sender, body, message_id, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (seq, operation, user, sender, body, message_id, created_at),
+        )
+
+    def write_account(self, cursor, username, seq=None):
+        # a replayed entry may already be reflected here after a resync, so replays are idempotent
+        cursor.execute(
+            ("INSERT" if seq is None else "INSERT OR IGNORE")
+            + " INTO users (user_name, incoming_messages) VALUES (?, ?)",
+            (username, ""),
+        )
+        self.log_write(cursor, "CREATE_ACCOUNT", username, seq=seq)
+
+    def erase_account(self, cursor, username, seq=None):
+        # Use parameterized query instead of string concatenation
+        cursor.execute("DELETE FROM users WHERE user_name = ?", (username,))
+        cursor.execute("DELETE FROM messages WHERE receiver = ?", (username,))
+        self.log_write(cursor, "DELETE_ACCOUNT", username, seq=seq)
+
+    def write_message(self, cursor, sender, receiver, msg, created_at, msg_id=None, seq=None):
+        """
+        Inserts one message row, and its log entry on a replicated server.
+
+        Args:
+        - cursor: The cursor whose transaction holds the write.
+        - sender (str): The username of the sender.
+        - receiver (str): The username of the receiver.
+        - msg (str): The message body.
+        - created_at (float): When the message was stored.
+        - msg_id (int): The id to store the message under when replaying the primary's
+          log, so ids match on every replica; None picks the next id.
+        - seq (int): The log sequence number when replaying the primary's log.
+
+        Returns:
+        The id of the new message row.
+        """
+        cursor.execute(
+            ("INSERT" if seq is None else "INSERT OR REPLACE")
+            + " INTO messages (id, sender, receiver, body, created_at) VALUES (?, ?, ?, ?, ?)",
+            (msg_id, sender, receiver, msg, created_at),
+        )
+        msg_id = cursor.lastrowid
+        self.log_write(cursor, "SEND_MESSAGE", receiver, sender, msg, msg_id, created_at, seq)
+        return msg_id
+
+    def erase_messages(self, cursor, receiver, up_to_id, seq=None):
+        cursor.execute(
+            "DELETE FROM messages WHERE receiver = ? AND id <= ?", (receiver, up_to_id)
+        )
+        self.log_write(cursor, "ACK_MESSAGES", receiver, message_id=up_to_id, seq=seq)
+
+    def committed(self):
+        """Tells the replicator, if any, that new log entries may be ready to ship."""
+        if self.replicator is not None:
+            self.replicator.notify()
+
+    def insert_message(self, sender, receiver, msg):
+        """
+        Durably stores one message in the receiver's inbox in its own transaction. With
+        the mailbox cache on, it is stored in memory and written back within the flush
+        window instead.
+
+        Args:
+        - sender (str): The username of the sender.
+        - receiver (str): The username of the receiver.
+        - msg (str): The message body.
+
+        Returns:
+        The id of the new message row.
+        """
+        if self.mailboxes is not None:
+            return self.mailboxes.send(sender, receiver, msg)
+        msg_id = self.write_message(self.c, sender, receiver, msg, time.time())
+        self.conn.commit()
+        self.committed()
+        return msg_id
+
+    def queue_send(self, sender, receiver, msg):
+        """
+        Queues one message with the group committer, which pushes it to the receiver's
+        subscriptions once it is committed. Writes commit in the order they are queued,
+        so queuing under the receiver's stripe keeps its messages in id order.
+
+        Args:
+        - sender (str): The username of the sender.
+        - receiver (str): The username of the receiver.
+        - msg (str): The message body.
+
+        Returns:
+        A handle for group_committer.wait, which raises KeyError if the receiver was
+        deleted before the write ran.
+        """
+        created_at = time.time()
+
+        def write(cursor):
+            # the stripe is let go before this runs, so a deletion in between is caught here
+            cursor.execute("SELECT 1 FROM users WHERE user_name = ?", (receiver,))
+            if cursor.fetchone() is None:
+                raise KeyError(receiver)
+            return self.write_message(cursor, sender, receiver, msg, created_at)
+
+        return self.group_committer.submit(write, lambda msg_id: self.notify_subscribers(receiver, msg_id, msg))
 
     def login_processing(self, request):
-        with self.USER_LOCK:
-            if self.is_valid_user(request.info):
-                return chat_pb2.ServerMessage(operation=chat_pb2.SUCCESS, info="")
+        # membership checks on the username index are atomic, so logins take no lock
+        if self.is_valid_user(request.info):
+            return chat_pb2.ServerMessage(operation=chat_pb2.SUCCESS, info="")
 
         return chat_pb2.ServerMessage(
             operation=chat_pb2.ACCOUNT_DOES_NOT_EXIST, info=""
         )
 
     def create_account_processing(self, request):
-        with self.USER_LOCK:
-            if self.is_valid_user(request.info):
+        with self.USER_LOCK, self.user_lock(request.info):
+            if self.is_valid_user(request.info, confirm=True):
                 return chat_pb2.ServerMessage(
                     operation=chat_pb2.ACCOUNT_ALREADY_EXISTS, info=""
                 )
-            self.c.execute(
-                """
-          INSERT INTO users (user_name, incoming_messages)
-
-                VALUES
-                (?, ?)
-          """,
-                (request.info, ""),
-            )
-            self.conn.commit()
+            try:
+                self.write_account(self.c, request.info)
+                self.conn.commit()
+            except sqlite3.IntegrityError:
+                # the unique index caught an account the in-memory index did not know about
+                self.conn.rollback()
+                self.usernames.add(request.info)
+                return chat_pb2.ServerMessage(
+                    operation=chat_pb2.ACCOUNT_ALREADY_EXISTS, info=""
+                )
+            self.usernames.add(request.info)
+        self.committed()
+        self.accounts_changed({request.info: True})
 
         return chat_pb2.ServerMessage(operation=chat_pb2.SUCCESS, info="")
 
     def delete_account_processing(self, request):
-        with self.USER_LOCK:
-            if self.is_valid_user(request.info):
-                # Use parameterized query instead of string concatenation
-                self.c.execute("DELETE FROM users WHERE user_name = ?", (request.info,))
+        with self.USER_LOCK, self.user_lock(request.info):
+            if self.is_valid_user(request.info, confirm=True):
+                if self.mailboxes is not None:
+                    # messages still in memory must not reach the table after the account is gone
+                    self.mailboxes.flush()
+                self.erase_account(self.c, request.info)
                 self.conn.commit()
+                self.usernames.discard(request.info)
+                if self.mailboxes is not None:
+                    self.mailboxes.discard(request.info)
+                self.committed()
+                self.accounts_changed({request.info: False})
                 return chat_pb2.ServerMessage(operation=chat_pb2.SUCCESS, info="")
         return chat_pb2.ServerMessage(
             operation=chat_pb2.ACCOUNT_DOES_NOT_EXIST, info=""
         )
 
     def list_account_processing(self):
-        with self.USER_LOCK:
-            self.c.execute("SELECT user_name FROM users")
-            accounts = np.array(self.c.fetchall()).flatten()
-            accounts_string = "\n".join(accounts).strip()
-            return chat_pb2.ServerMessage(
-                operation=chat_pb2.SUCCESS, info=accounts_string
-            )
+        self.c.execute("SELECT user_name FROM users")
+        accounts = np.array(self.c.fetchall()).flatten()
+        accounts_string = "\n".join(accounts).strip()
+        return chat_pb2.ServerMessage(
+            operation=chat_pb2.SUCCESS, info=accounts_string
+        )
+
+    def list_accounts_processing(self, request):
+        """
+        Streams the accounts matching a wildcard in username order, one page at a time.
+        The wildcard is evaluated by SQLite with GLOB, and its literal prefix becomes a
+        range condition so only the matching part of the user_name index is scanned.
+
+        Args:
+        - request (ListAccountsRequest): The wildcard, page size and resume cursor.
+
+        Yields:
+        An AccountPage per page of matching usernames.
+        """
+        pattern = request.pattern or "*"
+        page_size = self.clamp_page_size(request.page_size)
+        # GLOB shares fnmatch's syntax except that it negates sets with ^ instead of !
+        glob = pattern.replace("[!", "[^")
+
+        conditions = ["user_name > ?", "user_name GLOB ?"]
+        params = [request.cursor, glob]
+        prefix = self.literal_prefix(pattern)
+        if prefix:
+            conditions.append("user_name >= ?")
+            params.append(prefix)
+            if ord(prefix[-1]) < 0x10FFFF:
+                conditions.append("user_name < ?")
+                params.append(prefix[:-1] + chr(ord(prefix[-1]) + 1))
+        sql = (
+            "SELECT user_name FROM users WHERE " + " AND ".join(conditions)
+            + " ORDER BY user_name LIMIT ?"
+        )
+
+        while True:
+            self.c.execute(sql, params + [page_size])
+            usernames = [user_name for (user_name,) in self.c.fetchall()]
+            if not usernames:
+                return
+            yield chat_pb2.AccountPage(usernames=usernames, next_cursor=usernames[-1])
+            if len(usernames) < page_size:
+                return
+            params[0] = usernames[-1]
+
+    def clamp_page_size(self, page_size):
+        """Returns the requested page size, or the default if none was asked for, capped at MAX_PAGE_SIZE."""
+        if page_size <= 0:
+            return self.DEFAULT_PAGE_SIZE
+        return min(page_size, self.MAX_PAGE_SIZE)
+
+    def literal_prefix(self, pattern):
+        """
+        Returns the part of a wildcard before its first special character.
+
+        Args:
+        - pattern (str): An fnmatch-style wildcard.
+
+        Returns:
+        The literal prefix every matching username must start with.
+        """
+        for i, character in enumerate(pattern):
+            if character in "*?[":
+                return pattern[:i]
+        return pattern
 
     def send_msg_processing(self, request):
-        sender, receiver, msg = request.info.split("\n")
-        with self.USER_LOCK:
-            if self.is_valid_user(receiver):
-                self.LISTEN_FLAG = False
-                self.c.execute(
-                    "SELECT incoming_messages FROM users WHERE user_name =?",
-                    (receiver,),
-                )
-                messages = np.array(self.c.fetchall()).flatten()[0].strip()
-                if len(messages) > 0:
-                    messages += "\n" + msg
+        # the body is everything after the second separator, so it may itself span lines
+        fields = request.info.split(self.SEPARATE_CHARACTER, 2)
+        if len(fields) != 3:
+            return chat_pb2.ServerMessage(operation=chat_pb2.FAILURE, info="")
+        sender, receiver, msg = fields
+        return chat_pb2.ServerMessage(operation=self.send_processing(sender, receiver, msg), info="")
+
+    def send_request_processing(self, request):
+        return chat_pb2.ServerMessage(
+            operation=self.send_processing(request.sender, request.receiver, request.body), info=""
+        )
+
+    def send_processing(self, sender, receiver, msg):
+        """
+        Stores one message for the receiver and pushes it to any open subscription.
+
+        Args:
+        - sender (str): The username of the sender.
+        - receiver (str): The username of the receiver.
+        - msg (str): The message body.
+
+        Returns:
+        SUCCESS if the message was stored, FAILURE if the receiver does not exist.
+        """
+        # only the receiver's stripe is held, so sends to different users do not block each other
+        with self.user_lock(receiver):
+            if not self.is_valid_user(receiver, confirm=True):
+                return chat_pb2.FAILURE
+            if self.group_committer is None or self.mailboxes is not None:
+                msg_id = self.insert_message(sender, receiver, msg)
+                self.notify_subscribers(receiver, msg_id, msg)
+                return chat_pb2.SUCCESS
+            pending = self.queue_send(sender, receiver, msg)
+        # the commit is waited for outside the stripe, so more sends to the receiver can join its batch
+        try:
+            self.group_committer.wait(pending)
+        except KeyError:
+            return chat_pb2.FAILURE
+        self.committed()
+        return chat_pb2.SUCCESS
+
+    def send_messages_processing(self, request_iterator):
+        """
+        Stores a stream of messages in batches of BULK_SEND_BATCH. Each batch validates
+        its distinct receivers once and is written in a single transaction.
+
+        Args:
+        - request_iterator: An iterator of SendRequest messages.
+
+        Returns:
+        A BulkSendReply with one status per request, in order.
+        """
+        statuses = []
+        batch = []
+        for request in request_iterator:
+            batch.append(request)
+            if len(batch) == self.BULK_SEND_BATCH:
+                statuses.extend(self.send_batch(batch))
+                batch = []
+        if batch:
+            statuses.extend(self.send_batch(batch))
+        return chat_pb2.BulkSendReply(statuses=statuses)
+
+    def send_batch(self, batch):
+        """
+        Writes one batch of SendRequest messages in a single transaction.
+
+        Args:
+        - batch (list): The SendRequest messages to store.
+
+        Returns:
+        A list with SUCCESS or FAILURE for each request, in order.
+        """
+        receivers = set(request.receiver for request in batch)
+        with contextlib.ExitStack() as stack:
+            for lock in self.user_locks(receivers):
+                stack.enter_context(lock)
+            valid_receivers = set(receiver for receiver in receivers if self.is_valid_user(receiver, confirm=True))
+
+            statuses = []
+            delivered = []
+            now = time.time()
+            for request in batch:
+                if request.receiver not in valid_receivers:
+                    statuses.append(chat_pb2.FAILURE)
+                    continue
+                if self.mailboxes is not None:
+                    msg_id = self.mailboxes.send(request.sender, request.receiver, request.body)
                 else:
-                    messages = msg
+                    msg_id = self.write_message(self.c, request.sender, request.receiver, request.body, now)
+                delivered.append((request.receiver, msg_id, request.body))
+                statuses.append(chat_pb2.SUCCESS)
+            if self.mailboxes is None:
+                self.conn.commit()
+                self.committed()
 
-                # Use parameterized query instead of string concatenation
-                self.c.execute(
-                    "UPDATE users SET incoming_messages = ? WHERE user_name = ?",
-                    (messages, receiver),
-                )
+            for receiver, msg_id, msg in delivered:
+                self.notify_subscribers(receiver, msg_id, msg)
+        return statuses
+
+    def view_msg_processing(self, request):
+        rows = self.take_inbox(request.info)
+        if rows is None:
+            return chat_pb2.ServerMessage(operation=chat_pb2.FAILURE, info="")
+        if len(rows) == 0:
+            return chat_pb2.ServerMessage(operation=chat_pb2.NO_MESSAGES, info="")
+        message_str = self.SEPARATE_CHARACTER.join(body for _, _, body, _ in rows)
+        return chat_pb2.ServerMessage(operation=chat_pb2.MESSAGES_EXIST, info=message_str)
+
+    def view_inbox_processing(self, request):
+        rows = self.take_inbox(request.info)
+        if rows is None:
+            return chat_pb2.Inbox(operation=chat_pb2.FAILURE)
+        if len(rows) == 0:
+            return chat_pb2.Inbox(operation=chat_pb2.NO_MESSAGES)
+        return chat_pb2.Inbox(
+            operation=chat_pb2.MESSAGES_EXIST,
+            messages=[
+                chat_pb2.Message(id=msg_id, sender=sender, body=body, timestamp=created_at)
+                for msg_id, sender, body, created_at in rows
+            ],
+        )
+
+    def fetch_msg_processing(self, request):
+        """
+        Returns a bounded chunk of a user's stored messages without removing them, so a
+        fetch whose response is lost can simply be retried.
+
+        Args:
+        - request (FetchRequest): The user, the id to read after and the chunk size.
+
+        Returns:
+        An Inbox with up to limit messages in id order.
+        """
+        if self.mailboxes is not None:
+            with self.user_lock(request.user):
+                if not self.is_valid_user(request.user):
+                    return chat_pb2.Inbox(operation=chat_pb2.FAILURE)
+                rows = self.mailboxes.fetch(request.user, request.after_id, self.clamp_page_size(request.limit))
+        elif not self.is_valid_user(request.user):
+            return chat_pb2.Inbox(operation=chat_pb2.FAILURE)
+        else:
+            self.c.execute(
+                """
+                SELECT id, sender, body, created_at FROM messages
+                WHERE receiver = ? AND id > ? ORDER BY id LIMIT ?
+                """,
+                (request.user, request.after_id, self.clamp_page_size(request.limit)),
+            )
+            rows = self.c.fetchall()
+        if len(rows) == 0:
+            return chat_pb2.Inbox(operation=chat_pb2.NO_MESSAGES)
+        return chat_pb2.Inbox(
+            operation=chat_pb2.MESSAGES_EXIST,
+            messages=[
+                chat_pb2.Message(id=msg_id, sender=sender, body=body, timestamp=created_at)
+                for msg_id, sender, body, created_at in rows
+            ],
+        )
+
+    def ack_msg_processing(self, request):
+        """
+        Removes every message of a user up to and including the acknowledged id.
+
+        Args:
+        - request (AckRequest): The user and the last id they have received.
+
+        Returns:
+        A ServerMessage with SUCCESS, or FAILURE if the user does not exist.
+        """
+        with self.user_lock(request.user):
+            if not self.is_valid_user(request.user, confirm=True):
+                return chat_pb2.ServerMessage(operation=chat_pb2.FAILURE, info="")
+            self.acknowledge(request.user, request.up_to_id)
+        return chat_pb2.ServerMessage(operation=chat_pb2.SUCCESS, info="")
+
+    def acknowledge(self, username, up_to_id):
+        """
+        Removes a user's messages up to and including up_to_id, from the mailbox cache
+        when it is on. The caller holds the user's lock stripe.
+
+        Args:
+        - username (str): The user whose messages were received.
+        - up_to_id (int): The id of the last message received.
+
+        Returns:
+        None
+        """
+        if self.mailboxes is not None:
+            self.mailboxes.ack(username, up_to_id)
+            return
+        self.erase_messages(self.c, username, up_to_id)
+        self.conn.commit()
+        self.committed()
+
+    def backlog(self, username):
+        """
+        Reads a user's stored messages without removing them, for a new subscription.
+
+        Args:
+        - username (str): The subscribing user.
+
+        Returns:
+        A list of (id, body) rows in id order.
+        """
+        if self.mailboxes is not None:
+            with self.user_lock(username):
+                return [(msg_id, body) for msg_id, _, body, _ in self.mailboxes.fetch(username)]
+        self.c.execute("SELECT id, body FROM messages WHERE receiver = ? ORDER BY id", (username,))
+        return self.c.fetchall()
+
+    def take_inbox(self, username):
+        """
+        Reads a user's stored messages in order and removes the ones that were read.
+
+        Args:
+        - username (str): The user whose inbox is read.
+
+        Returns:
+        A list of (id, sender, body, created_at) rows, or None if the user does not exist.
+        """
+        with self.user_lock(username):
+            if not self.is_valid_user(username, confirm=True):
+                return None
+            if self.mailboxes is not None:
+                return self.mailboxes.take(username)
+            self.c.execute(
+                "SELECT id, sender, body, created_at FROM messages WHERE receiver = ? ORDER BY id",
+                (username,),
+            )
+            rows = self.c.fetchall()
+            if rows:
+                # only clear what was read, so anything inserted meanwhile survives
+                self.erase_messages(self.c, username, rows[-1][0])
                 self.conn.commit()
-                self.LISTEN_FLAG = True
-                return chat_pb2.ServerMessage(operation=chat_pb2.SUCCESS, info="")
+                self.committed()
+            return rows
+
+    def notify_subscribers(self, receiver, msg_id, msg):
+        """
+        Hands a newly committed message to every open subscription of the receiver, in
+        this process and in the other worker processes.
+
+        Args:
+        - receiver (str): The username the message was sent to.
+        - msg_id (int): The id of the committed message row.
+        - msg (str): The message body.
+
+        Returns:
+        None
+        """
+        self.deliver(receiver, msg_id, msg)
+        if self.bus is not None:
+            self.bus.publish_message(receiver, msg_id, msg)
+
+    def deliver(self, receiver, msg_id, msg):
+        """
+        Hands a committed message to every open subscription of the receiver in this process.
+
+        Args:
+        - receiver (str): The username the message was sent to.
+        - msg_id (int): The id of the committed message row.
+        - msg (str): The message body.
+
+        Returns:
+        None
+        """
+        with self.subscribers_lock:
+            subscriptions = list(self.subscribers.get(receiver, ()))
+        for subscription in subscriptions:
+            subscription.put((msg_id, msg))
+
+    def subscribe_processing(self, request, context):
+        """
+        Streams a user's stored messages, then pushes each new message as soon as it is
+        committed. Every message is removed from the inbox once it has been handed to
+        the stream, so a message sent while the user is offline is still delivered on
+        the next subscribe or view.
+
+        Args:
+        - request (ClientMessage): The subscribing username in info.
+        - context: The gRPC servicer context of the stream.
+
+        Yields:
+        A ServerMessage per delivered message.
+        """
+        username = request.info
+        if not self.is_valid_user(username):
+            yield chat_pb2.ServerMessage(operation=chat_pb2.FAILURE, info="")
+            return
+
+        # register before reading the backlog so nothing committed in between is missed
+        subscription = queue.Queue()
+        with self.subscribers_lock:
+            self.subscribers.setdefault(username, []).append(subscription)
+        # wake the stream as soon as the client goes away
+        context.add_callback(lambda: subscription.put(None))
+        try:
+            backlog = self.backlog(username)
+            last_id = 0
+            for msg_id, msg in backlog:
+                yield chat_pb2.ServerMessage(operation=chat_pb2.MESSAGES_EXIST, info=msg)
+                last_id = msg_id
+            if backlog:
+                with self.user_lock(username):
+                    self.acknowledge(username, last_id)
+
+            while context.is_active():
+                try:
+                    item = subscription.get(timeout=self.SUBSCRIBE_POLL_SECONDS)
+                except queue.Empty:
+                    continue
+                if item is None:
+                    break
+                msg_id, msg = item
+                # already sent as part of the backlog
+                if msg_id <= last_id:
+                    continue
+                yield chat_pb2.ServerMessage(operation=chat_pb2.MESSAGES_EXIST, info=msg)
+                # earlier messages were all streamed already, so acknowledge up to this one
+                with self.user_lock(username):
+                    self.acknowledge(username, msg_id)
+        finally:
+            with self.subscribers_lock:
+                self.subscribers[username].remove(subscription)
+                if not self.subscribers[username]:
+                    del self.subscribers[username]
+
+    def apply_entries(self, request):
+        """
+        Replays a batch of the primary's log entries on a backup, in order and in one
+        transaction. Entries already applied are skipped, and the batch stops at the
+        first gap so the primary can resend from where this backup actually is.
+
+        Args:
+        - request (AppendRequest): The entries and the primary's latest sequence number.
+
+        Returns:
+        An AppendReply with the last sequence number applied here.
+        """
+        with self.apply_lock:
+            self.leader_seq = max(self.leader_seq, request.leader_seq)
+            applied_seq = self.applied_seq
+            # the last account change per user, for the username index
+            accounts = {}
+            try:
+                for entry in request.entries:
+                    if entry.seq <= applied_seq:
+                        continue
+                    if entry.seq != applied_seq + 1:
+                        break
+                    if entry.operation == "CREATE_ACCOUNT":
+                        self.write_account(self.c, entry.user, entry.seq)
+                        accounts[entry.user] = True
+                    elif entry.operation == "DELETE_ACCOUNT":
+                        self.erase_account(self.c, entry.user, entry.seq)
+                        accounts[entry.user] = False
+                    elif entry.operation == "SEND_MESSAGE":
+                        self.write_message(
+                            self.c, entry.sender, entry.user, entry.body, entry.timestamp, entry.message_id, entry.seq
+                        )
+                    elif entry.operation == "ACK_MESSAGES":
+                        self.erase_messages(self.c, entry.user, entry.message_id, entry.seq)
+                    applied_seq = entry.seq
+                self.conn.commit()
+            except sqlite3.Error:
+                self.conn.rollback()
+                raise
+
+            # update the username index only once the batch is durable
+            self.update_usernames(accounts)
+            self.applied_seq = applied_seq
+            return chat_pb2.AppendReply(
+                success=applied_seq >= request.entries[-1].seq if request.entries else True,
+                applied_seq=applied_seq,
+            )
+
+    def update_usernames(self, accounts):
+        """
+        Applies account changes to the in-memory username index.
+
+        Args:
+        - accounts (dict): Maps each changed username to True if it now exists.
+
+        Returns:
+        None
+        """
+        for username, exists in accounts.items():
+            if exists:
+                self.usernames.add(username)
             else:
-                return chat_pb2.ServerMessage(operation=chat_pb2.FAILURE, info="")
+                self.usernames.discard(username)
 
-    def view_msg_processing(self, request):
-        with self.USER_LOCK:
-            if self.is_valid_user(request.info):
-                self.c.execute(
-                    "SELECT incoming_messages FROM users WHERE user_name=?",
-                    (request.info,),
+    def restore_entries(self, cursor, entries):
+        """
+        Writes CREATE_ACCOUNT and SEND_MESSAGE entries from a snapshot or a user's state
+        straight into the tables, keeping the primary's message ids. Nothing is logged;
+        the caller records which sequence number the restored state is as of.
+
+        Args:
+        - cursor: The cursor whose transaction holds the restore.
+        - entries (list): LogEntry messages describing the state to restore.
+
+        Returns:
+        dict: Maps each restored username to True, for update_usernames.
+        """
+        accounts = {}
+        for entry in entries:
+            if entry.operation == "CREATE_ACCOUNT":
+                cursor.execute(
+                    "INSERT OR IGNORE INTO users (user_name, incoming_messages) VALUES (?, ?)", (entry.user, "")
                 )
-                message_str = np.array(self.c.fetchall()).flatten()[0]
-                if len(message_str) == 0:
-                    return chat_pb2.ServerMessage(
-                        operation=chat_pb2.NO_MESSAGES, info=""
-                    )
-
-                execute_str = (
-                    'UPDATE users SET incoming_messages = "" WHERE user_name = \''
-                    + request.info
-                    + "'"
+                accounts[entry.user] = True
+            elif entry.operation == "SEND_MESSAGE":
+                cursor.execute(
+                    "INSERT OR REPLACE INTO messages (id, sender, receiver, body, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (entry.message_id, entry.sender, entry.user, entry.body, entry.timestamp),
                 )
-                self.c.execute(execute_str)
+        return accounts
+
+    def state_entries(self, usernames, messages):
+        """
+        Describes accounts and messages as CREATE_ACCOUNT and SEND_MESSAGE entries.
+
+        Args:
+        - usernames (list): Usernames of the accounts.
+        - messages (list): (id, sender, receiver, body, created_at) rows.
+
+        Returns:
+        A list of LogEntry messages.
+        """
+        entries = [chat_pb2.LogEntry(operation="CREATE_ACCOUNT", user=username) for username in usernames]
+        entries.extend(
+            chat_pb2.LogEntry(
+                operation="SEND_MESSAGE", user=receiver, sender=sender, body=body,
+                message_id=msg_id, timestamp=created_at,
+            )
+            for msg_id, sender, receiver, body, created_at in messages
+        )
+        return entries
+
+    def log_batches(self, after_seq, limit):
+        """
+        Streams log entries after a sequence number in bounded batches, for a backup
+        catching up after a restart.
+
+        Args:
+        - after_seq (int): Only entries with a larger sequence number are returned.
+        - limit (int): The most entries per batch.
+
+        Yields:
+        An AppendRequest per batch, carrying this server's latest sequence number.
+
+        Raises:
+        ValueError: If the entries just after after_seq are no longer in the log.
+        """
+        self.c.execute("SELECT MIN(seq) FROM replication_log")
+        first_seq = self.c.fetchone()[0]
+        if first_seq is not None and after_seq < first_seq - 1:
+            raise ValueError("log entries after " + str(after_seq) + " are no longer kept")
+        while True:
+            entries = self.log_entries(after_seq, limit)
+            if not entries:
+                return
+            yield chat_pb2.AppendRequest(leader_seq=self.last_log_seq(), entries=entries)
+            after_seq = entries[-1].seq
+            if len(entries) < limit:
+                return
+
+    def take_snapshot(self):
+        """
+        Copies the database to snapshot_path with SQLite's online backup API, then drops
+        the log entries the snapshot makes unnecessary. The copy is a consistent point in
+        time, and the newest log entry it holds tags it with the sequence number it is as
+        of. Only that entry is kept in the copy. This server's own log keeps it too, and
+        everything a backup has not acknowledged yet, so a shipper can always resume from
+        where its backup is; a replica that needs anything older loads the snapshot instead.
+
+        Returns:
+        int: The sequence number the snapshot is as of.
+        """
+        with self.snapshot_lock:
+            partial = self.snapshot_path + ".partial"
+            if os.path.exists(partial):
+                os.remove(partial)
+            source = self.pool.connect()
+            copy = sqlite3.connect(partial)
+            try:
+                source.backup(copy)
+                seq = copy.execute(
+                    "SELECT COALESCE(MAX(seq), 0) FROM replication_log" if self.replicated
+                    else "SELECT version FROM data_version"
+                ).fetchone()[0]
+                copy.execute("DELETE FROM replication_log WHERE seq < ?", (seq,))
+                # the term and vote belong to this server, not to whoever loads the snapshot
+                copy.execute("DELETE FROM election_state")
+                copy.commit()
+                # a self-contained file that is as small as it can be
+                copy.execute("PRAGMA journal_mode=DELETE")
+                copy.execute("VACUUM")
+            finally:
+                copy.close()
+                source.close()
+            os.replace(partial, self.snapshot_path)
+
+            keep_from = seq
+            if self.replicator is not None:
+                for _, acked_seq in self.replicator.progress():
+                    keep_from = min(keep_from, acked_seq + 1)
+            self.c.execute("DELETE FROM replication_log WHERE seq < ?", (keep_from,))
+            self.conn.commit()
+            self.snapshot_seq = seq
+            return seq
+
+    def snapshot_chunks(self, chunk_size=1 << 16):
+        """
+        Streams the latest snapshot file, taking one first if there is none.
+
+        Args:
+        - chunk_size (int): The most bytes per chunk.
+
+        Yields:
+        SnapshotChunk messages tagged with the snapshot's sequence number.
+        """
+        if self.snapshot_seq is None:
+            self.take_snapshot()
+        with self.snapshot_lock:
+            # an open file keeps reading the same snapshot even if a newer one replaces it
+            snapshot = open(self.snapshot_path, "rb")
+            seq = self.snapshot_seq
+        with snapshot:
+            while True:
+                data = snapshot.read(chunk_size)
+                if not data:
+                    return
+                yield chat_pb2.SnapshotChunk(seq=seq, data=data)
+
+    def load_snapshot(self, path):
+        """
+        Replaces this backup's database with a snapshot file, using the online backup
+        API so every open connection sees the new contents. The election term and vote
+        stay this server's own, so it never votes twice in a term, and the data_version
+        counter is derived from the loaded log.
+
+        Args:
+        - path (str): The snapshot file to load.
+
+        Returns:
+        int: The sequence number the backup is now at.
+        """
+        with self.apply_lock:
+            vote = self.load_vote()
+            snapshot = sqlite3.connect(path)
+            try:
+                snapshot.backup(self.conn)
+            finally:
+                snapshot.close()
+            if self.elector is not None:
+                # the elector's term may have moved on while the snapshot loaded
+                with self.elector.lock:
+                    self.save_vote(self.elector.term, self.elector.voted_for)
+            else:
+                self.save_vote(*vote)
+            self.c.execute(
+                "INSERT OR REPLACE INTO data_version (id, version) SELECT 0, COALESCE(MAX(seq), 0) FROM replication_log"
+            )
+            self.conn.commit()
+            self.c.execute("SELECT user_name FROM users")
+            self.usernames = set(user_name for (user_name,) in self.c.fetchall())
+            self.applied_seq = self.last_log_seq()
+            self.leader_seq = max(self.leader_seq, self.applied_seq)
+            return self.applied_seq
+
+    def user_digests(self, after_user, upto_user=None, limit=None):
+        """
+        Hashes each account's inbox, for comparing replicas user by user.
+
+        Args:
+        - after_user (str): Only users sorting after this one are included.
+        - upto_user (str): If given, only users up to and including this one are included.
+        - limit (int): If given, the most users to include.
+
+        Returns:
+        A list of (username, digest) tuples in username order.
+        """
+        query = "SELECT user_name FROM users WHERE user_name > ?"
+        params = [after_user]
+        if upto_user is not None:
+            query += " AND user_name <= ?"
+            params.append(upto_user)
+        query += " ORDER BY user_name"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        self.c.execute(query, params)
+        usernames = [row[0] for row in self.c.fetchall()]
+        if not usernames:
+            return []
+
+        digests = {username: hashlib.sha256() for username in usernames}
+        self.c.execute(
+            "SELECT receiver, id, sender, body, created_at FROM messages"
+            " WHERE receiver >= ? AND receiver <= ? ORDER BY receiver, id",
+            (usernames[0], usernames[-1]),
+        )
+        for receiver, msg_id, sender, body, created_at in self.c:
+            if receiver in digests:
+                digests[receiver].update(repr((msg_id, sender, body, created_at)).encode())
+        return [(username, digests[username].hexdigest()) for username in usernames]
+
+    def user_state(self, username):
+        """
+        Reads one user's account and messages for anti-entropy repair.
+
+        Args:
+        - username (str): The user to read.
+
+        Returns:
+        An AppendRequest whose leader_seq is the sequence number the state is as of,
+        with no entries if the account does not exist.
+        """
+        # one read transaction, so the version and both row sets agree
+        self.c.execute("BEGIN")
+        try:
+            seq = self.version()
+            self.c.execute("SELECT user_name FROM users WHERE user_name = ?", (username,))
+            usernames = [row[0] for row in self.c.fetchall()]
+            self.c.execute(
+                "SELECT id, sender, receiver, body, created_at FROM messages WHERE receiver = ? ORDER BY id",
+                (username,),
+            )
+            messages = self.c.fetchall()
+        finally:
+            self.conn.rollback()
+        return chat_pb2.AppendRequest(leader_seq=seq, entries=self.state_entries(usernames, messages))
+
+    def install_user(self, username, state):
+        """
+        Replaces one user's account and messages on this backup with the primary's.
+        The repair is skipped if the primary's state is older than what this backup
+        has already applied, since that would undo entries the primary will not resend.
+
+        Args:
+        - username (str): The user to repair.
+        - state (AppendRequest): The primary's state for the user, from user_state.
+
+        Returns:
+        bool: True if the user was repaired.
+        """
+        with self.apply_lock:
+            if state.leader_seq < self.applied_seq:
+                return False
+            try:
+                self.c.execute("DELETE FROM users WHERE user_name = ?", (username,))
+                self.c.execute("DELETE FROM messages WHERE receiver = ?", (username,))
+                accounts = self.restore_entries(self.c, state.entries)
                 self.conn.commit()
-                return chat_pb2.ServerMessage(
-                    operation=chat_pb2.MESSAGES_EXIST, info=message_str
-                )
-            return chat_pb2.ServerMessage(operation=chat_pb2.FAILURE, info="")
+            except sqlite3.Error:
+                self.conn.rollback()
+                raise
+            self.update_usernames({username: accounts.get(username, False)})
+            return True
+
+    def log_entries(self, after_seq, limit):
+        """
+        Reads log entries after a sequence number, in order.
+
+        Args:
+        - after_seq (int): Only entries with a larger sequence number are returned.
+        - limit (int): The most entries to return.
+
+        Returns:
+        A list of LogEntry messages.
+        """
+        self.c.execute(
+            """
+            SELECT seq, operation, user, sender, body, message_id, created_at
+            FROM replication_log WHERE seq > ? ORDER BY seq LIMIT ?
+            """,
+            (after_seq, limit),
+        )
+        return [
+            chat_pb2.LogEntry(
+                seq=seq, operation=operation, user=user, sender=sender, body=body,
+                message_id=message_id, timestamp=created_at,
+            )
+            for seq, operation, user, sender, body, message_id, created_at in self.c.fetchall()
+        ]
+
+    def last_log_seq(self):
+        """
+        Returns the sequence number of the newest log entry, or 0 if there is none. On a
+        standalone server, which keeps no log, it is the number of writes made instead.
+        """
+        if not self.replicated:
+            self.c.execute("SELECT version FROM data_version")
+        else:
+            self.c.execute("SELECT COALESCE(MAX(seq), 0) FROM replication_log")
+        return self.c.fetchone()[0]
+
+    def version(self):
+        """
+        Returns:
+        The sequence number of the last write reflected in this replica's data.
+        """
+        if self.role == self.BACKUP:
+            return self.applied_seq
+        return self.last_log_seq()
+
+    def send_version(self, context):
+        """
+        Attaches this replica's data version to a read's trailing metadata, so a client
+        reading from several replicas can keep the newest answer. The version is taken
+        before the read, so the data returned is at least that new.
+
+        Args:
+        - context: The gRPC servicer context of the read.
+
+        Returns:
+        None
+        """
+        context.set_trailing_metadata(self.version_metadata())
+
+    def version_metadata(self):
+        """
+        Returns:
+        tuple: The trailing metadata carrying this replica's data version on a read.
+        """
+        return ((self.VERSION_KEY, str(self.version())),)
+
+    def replication_status(self):
+        """
+        Reports this server's role and how far behind the primary it, or its backups, are.
+
+        Returns:
+        A ReplicationStatusReply.
+        """
+        if self.role != self.BACKUP:
+            head = self.last_log_seq()
+            replicas = []
+            if self.replicator is not None:
+                replicas = [
+                    chat_pb2.ReplicaProgress(address=address, acked_seq=acked_seq, lag=head - acked_seq)
+                    for address, acked_seq in self.replicator.progress()
+                ]
+            return chat_pb2.ReplicationStatusReply(
+                role=self.role, applied_seq=head, leader_seq=head, lag=0, replicas=replicas
+            )
+        return chat_pb2.ReplicationStatusReply(
+            role=self.role,
+            applied_seq=self.applied_seq,
+            leader_seq=self.leader_seq,
+            lag=max(0, self.leader_seq - self.applied_seq),
+        )
 
     def logout_processing(self, request):
         pass
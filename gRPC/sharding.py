@@ -0,0 +1,316 @@
+import argparse
+import bisect
+import hashlib
+import json
+import sys
+
+import chat_pb2
+import grpc
+from chat_pb2_grpc import ChatServiceStub
+
+
+def ring_hash(key):
+    """Maps a string to a point on the ring, the same in every process."""
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    Consistent hashing of usernames onto shards. Every shard is placed on a ring at
+    vnodes pseudo-random points, and a username belongs to the shard at the first point
+    after its own hash. Adding a shard takes over only the arcs in front of its new
+    points, so about 1/N of the users move and all of them move to the new shard.
+    """
+
+    def __init__(self, shards, vnodes=64):
+        """
+        Places the given shards on the ring.
+
+        Args:
+        - shards (list): Shard names.
+        - vnodes (int): Points per shard; more points spread users more evenly.
+
+        Returns:
+        None
+        """
+        points = sorted((ring_hash(shard + "#" + str(i)), shard) for shard in shards for i in range(vnodes))
+        self.points = [point for point, _ in points]
+        self.shards = [shard for _, shard in points]
+
+    def owner(self, key):
+        """
+        Returns:
+        str: The name of the shard the key belongs to.
+        """
+        i = bisect.bisect(self.points, ring_hash(key))
+        return self.shards[i % len(self.shards)]
+
+
+class ShardMap:
+    """
+    Which servers hold which users. Each shard is a group of servers holding its own
+    users and replicating them the way a single group does.
+    """
+
+    def __init__(self, shards, vnodes=64):
+        """
+        Args:
+        - shards (dict): Maps each shard name to the host:port addresses of its servers,
+          the primary first.
+        - vnodes (int): Points per shard on the hash ring.
+
+        Returns:
+        None
+        """
+        if not shards:
+            raise ValueError("a shard map needs at least one shard")
+        self.shards = shards
+        self.vnodes = vnodes
+        self.ring = HashRing(sorted(shards), vnodes)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads a shard map from a JSON file of the form
+        {"vnodes": 64, "shards": {"a": ["localhost:3001", ...], "b": [...]}}.
+
+        Args:
+        - path (str): Path of the file.
+
+        Returns:
+        ShardMap: The map described by the file.
+        """
+        with open(path) as config:
+            settings = json.load(config)
+        return cls(settings["shards"], settings.get("vnodes", 64))
+
+    def names(self):
+        return sorted(self.shards)
+
+    def owner(self, username):
+        return self.ring.owner(username)
+
+    def hosts(self, shard):
+        return self.shards[shard]
+
+
+def moved_users(usernames, old_map, new_map):
+    """
+    Returns:
+    list: (username, old shard, new shard) for each username whose owner differs.
+    """
+    moves = []
+    for username in usernames:
+        old_shard, new_shard = old_map.owner(username), new_map.owner(username)
+        if old_shard != new_shard:
+            moves.append((username, old_shard, new_shard))
+    return moves
+
+
+class Migrator:
+    """
+    Moves users between shards while clients keep using them, after a shard map
+    changes. It runs in two steps:
+
+    1. prepare creates every moving account on its new shard, so clients switched to
+       the new map can log in and send to it right away.
+    2. Once every client uses the new map, migrate moves each moving user's inbox in
+       chunks, removing each chunk from the old shard once the new one holds it, then
+       deletes the account from the old shard.
+
+    A message is always held by at least one shard, so none is lost. Until its inbox
+    has moved, a user only sees part of it.
+    """
+
+    def __init__(self, old_map, new_map, client):
+        """
+        Args:
+        - old_map (ShardMap): The map clients used until now.
+        - new_map (ShardMap): The map clients use from now on.
+        - client (Client): Makes the calls, writing to each shard the way the servers
+          expect, e.g. with write_once for replicated servers.
+
+        Returns:
+        None
+        """
+        self.old_map = old_map
+        self.new_map = new_map
+        self.client = client
+        self.channels = {}
+
+    def stubs(self, hosts):
+        stubs = []
+        for host in hosts:
+            if host not in self.channels:
+                self.channels[host] = grpc.insecure_channel(host)
+            stubs.append(ChatServiceStub(self.channels[host]))
+        return stubs
+
+    def old_stubs(self, shard):
+        return self.stubs(self.old_map.hosts(shard))
+
+    def new_stubs(self, shard):
+        return self.stubs(self.new_map.hosts(shard))
+
+    def moves(self):
+        """
+        Lists every account on the old shards and works out which ones move.
+
+        Returns:
+        list: (username, old shard, new shard) for each moving user.
+        """
+        moves = []
+        for shard in self.old_map.names():
+            accounts = self.client.list_accounts_matching("*", self.old_stubs(shard))
+            if accounts == 1:
+                raise RuntimeError("could not list the accounts on shard " + shard)
+            # only users this shard actually owns, in case an earlier run was interrupted
+            owned = [username for username in accounts if self.old_map.owner(username) == shard]
+            moves.extend(moved_users(owned, self.old_map, self.new_map))
+        return moves
+
+    def write(self, method_name, request, stubs, streaming=False):
+        responses = self.client.fan_out(method_name, request, stubs, streaming)
+        if len(responses) < self.client.required_acks:
+            raise RuntimeError(method_name + " was not acknowledged by enough servers")
+        return responses[0]
+
+    def prepare(self):
+        """
+        Creates every moving account on its new shard.
+
+        Returns:
+        int: The number of moving accounts.
+        """
+        moves = self.moves()
+        for username, _, new_shard in moves:
+            # an account that already exists there was created by an earlier run
+            self.write("CreateAccountClient", chat_pb2.ClientMessage(info=username), self.new_stubs(new_shard))
+        return len(moves)
+
+    def move_inbox(self, username, old_shard, new_shard):
+        """
+        Copies a user's inbox to the new shard, removing it from the old shard once the
+        new one has stored it. Message ids are only shared between the servers of a
+        shard that replicate, which is what write_once clients are for; otherwise every
+        server is read and acknowledged by its own ids.
+
+        Returns:
+        int: The number of messages moved.
+        """
+        if self.client.write_once:
+            return self.move_replicated_inbox(username, old_shard, new_shard)
+        return self.move_fanned_out_inbox(username, old_shard, new_shard)
+
+    def copy_messages(self, username, messages, new_shard):
+        """Sends messages to the user on the new shard, FETCH_LIMIT at a time."""
+        for start in range(0, len(messages), self.client.FETCH_LIMIT):
+            requests = [
+                chat_pb2.SendRequest(sender=message.sender, receiver=username, body=message.body)
+                for message in messages[start:start + self.client.FETCH_LIMIT]
+            ]
+            reply = self.write("SendMessages", requests, self.new_stubs(new_shard), streaming=True)
+            if any(status != chat_pb2.SUCCESS for status in reply.statuses):
+                raise RuntimeError(username + " does not exist on shard " + new_shard + "; run prepare first")
+
+    def move_fanned_out_inbox(self, username, old_shard, new_shard):
+        """
+        Moves an inbox off servers that each hold their own copy, under their own ids:
+        every server's inbox is read, the copies are merged the way view_msgs merges
+        them, and each server is acknowledged up to the last id read from it. No server
+        is acknowledged before the merged inbox is stored on the new shard.
+
+        Returns:
+        int: The number of messages moved.
+        """
+        old_stubs = self.old_stubs(old_shard)
+        calls = [self.client.executor.submit(self.client.read_inbox, username, stub) for stub in old_stubs]
+        try:
+            inboxes = [call.result() for call in calls]
+        except grpc.RpcError:
+            # a server left out would lose its copies once the account is deleted
+            raise RuntimeError("could not read the inbox of " + username + " on every server of shard " + old_shard)
+        messages = self.client.merge_inboxes(inboxes)
+        self.copy_messages(username, messages, new_shard)
+        for stub, inbox in zip(old_stubs, inboxes):
+            if inbox:
+                stub.AckMessages(chat_pb2.AckRequest(user=username, up_to_id=inbox[-1].id), timeout=self.client.deadline)
+        return len(messages)
+
+    def move_replicated_inbox(self, username, old_shard, new_shard):
+        """
+        Copies a user's inbox off a replicated shard in chunks, removing each chunk from
+        the old shard once the new one has stored it.
+
+        Returns:
+        int: The number of messages moved.
+        """
+        old_stubs = self.old_stubs(old_shard)
+        moved = 0
+        # a replica that has not applied the last acknowledgement yet must not hand back
+        # messages already copied
+        after_id = 0
+        while True:
+            inbox = self.client.read_quorum(
+                self.client.unary_read(
+                    "FetchMessages",
+                    chat_pb2.FetchRequest(user=username, after_id=after_id, limit=self.client.FETCH_LIMIT),
+                ),
+                old_stubs,
+            )
+            if inbox.operation != chat_pb2.MESSAGES_EXIST:
+                return moved
+            self.copy_messages(username, inbox.messages, new_shard)
+            after_id = inbox.messages[-1].id
+            self.write("AckMessages", chat_pb2.AckRequest(user=username, up_to_id=after_id), old_stubs)
+            moved += len(inbox.messages)
+
+    def migrate(self):
+        """
+        Moves every moving user's inbox to its new shard and deletes the user from the old one.
+
+        Returns:
+        (int, int): The numbers of users and messages moved.
+        """
+        moves = self.moves()
+        messages = 0
+        for username, old_shard, new_shard in moves:
+            messages += self.move_inbox(username, old_shard, new_shard)
+            # every client uses the new map by now, so nothing more arrives on the old shard
+            self.write("DeleteAccountClient", chat_pb2.ClientMessage(info=username), self.old_stubs(old_shard))
+        return len(moves), messages
+
+    def close(self):
+        for channel in self.channels.values():
+            channel.close()
+
+
+if __name__ == "__main__":
+    from client import Client
+
+    parser = argparse.ArgumentParser(prog="sharding.py")
+    parser.add_argument("step", choices=("plan", "prepare", "migrate"),
+                        help="plan lists the users that move; prepare creates them on their new shards; "
+                             "migrate moves their inboxes once every client uses the new map")
+    parser.add_argument("old_map", help="shard map clients used until now")
+    parser.add_argument("new_map", help="shard map clients use from now on")
+    parser.add_argument("--write-once", action="store_true",
+                        help="send each write only to each shard's primary, for servers started with --replicate")
+    args = parser.parse_args(sys.argv[1:])
+
+    client = Client(write_once=args.write_once)
+    migrator = Migrator(ShardMap.load(args.old_map), ShardMap.load(args.new_map), client)
+    try:
+        if args.step == "plan":
+            moves = migrator.moves()
+            for username, old_shard, new_shard in moves:
+                print(username + ": " + old_shard + " -> " + new_shard)
+            print(str(len(moves)) + " users move")
+        elif args.step == "prepare":
+            print(str(migrator.prepare()) + " accounts created on their new shards")
+        else:
+            users, messages = migrator.migrate()
+            print(str(users) + " users and " + str(messages) + " messages moved")
+    finally:
+        migrator.close()
+        client.close()
@@ -1,12 +1,18 @@
+import argparse
+import asyncio
 import curses
-import fnmatch
 import os
-import sqlite3
 import sys
 from typing import List
 from chat_pb2_grpc import ChatServiceStub
 from client import Client
 from server import ChatService
+from replication import ReplicationServicer
+from aio_server import AsyncChatService
+from workers import free_host, run_workers
+from sharding import ShardMap
+from metrics import AsyncMetricsInterceptor, Metrics, MetricsInterceptor, serve_metrics
+from profiling import Profiler
 from menu import menu
 import grpc
 import chat_pb2_grpc
@@ -35,13 +41,18 @@ def load_user_menu(this_client: Client, stubs: List[ChatServiceStub]):
 
   if user_choice == "Send messages":
 
-    # if the user opts to send a message, get the list of accounts to send a message to
-    decoded_data = this_client.list_accounts(stubs)
-    try:
-      accounts = decoded_data.info.split("\n")
-    except:
+    # if the user opts to send a message, get the accounts matching a wildcard to send a message to
+    wildcard = wrap_input(this_client, "\nSearch accounts with a text wildcard (press enter for all): ")
+    if wildcard is None:
+      return
+    accounts = this_client.list_accounts_matching(wildcard or "*", stubs)
+    if accounts == 1:
       print("Disconnected from all servers")
       return
+    if not accounts:
+      wrap_input(this_client, "\nNo accounts match. Press enter to return to the main menu.\n\n")
+      load_user_menu(this_client, stubs)
+      return
     message = "\nWho would you like to send messages to?\n\n"
 
     # create a menu with possible message receivers
@@ -78,6 +89,7 @@ def load_user_menu(this_client: Client, stubs: List[ChatServiceStub]):
 
 # if user opts to logout, process logout and go to start menu
   elif user_choice == "Logout":
+    this_client.stop_listening()
     this_client.SESSION_INFO["username"] = ""
     start(this_client, stubs)
 
@@ -90,6 +102,7 @@ def load_user_menu(this_client: Client, stubs: List[ChatServiceStub]):
 
     # if the decision is confirmed, process delete request and go to start menu
     if choice == "Delete forever":
+      this_client.stop_listening()
       this_client.delete_account(this_client.SESSION_INFO["username"], stubs)
       return start(this_client, stubs)
     else:
@@ -144,16 +157,19 @@ def start(this_client: Client, stubs: List[ChatServiceStub]):
         # if length of username works, validate that it isn't already used. Otherwise, stay in loop
         status = this_client.create_account(account_name, stubs)
     
-    # if valid username, direct the now logged in user to user menu
+    # if valid username, start receiving pushed messages and direct the now logged in user to user menu
+    this_client.listen_for_messages(account_name, stubs)
     load_user_menu(this_client, stubs)
 
   # if the user opts to login, get their login input and validate that the username exists.
   # if login successful direct to user menu, otherwise go back to start menu
   elif name == "Login":
     try:
-        if this_client.get_login_input(stubs) == 0:
+        login_status = this_client.get_login_input(stubs)
+        if login_status == 0:
+            this_client.listen_for_messages(this_client.SESSION_INFO["username"], stubs)
             load_user_menu(this_client, stubs)
-        elif this_client.get_login_input(stubs) == -1:
+        elif login_status == -1:
             print("Disconnected from all servers")
             return
         else:
@@ -163,28 +179,23 @@ def start(this_client: Client, stubs: List[ChatServiceStub]):
 
 # if the user opts to list existing accounts, get the list of accounts from the server
   elif name == "List accounts":
-    decoded_data = this_client.list_accounts(stubs)
-    if decoded_data != 1:
-      # if the list is valid, split it by the enter character that initially divided it
-      accounts = decoded_data.info.split("\n")
-      # request a text wildcard to search the list of accounts
-      print("\nPlease input a text wildcard. * matches everything, ? matches any single character, [seq] matches any character in seq, and [!seq] matches any character not in seq.\n")
-      wildcard = wrap_input(this_client, "Text wildcard: ")
-      if not wildcard:
-          return
-      
-      # if the wildcard is valid, filter the list of accounts based on this and return them
-      print("\nList of accounts currently on the server matching " + wildcard + ":\n")
-      for account in accounts:
-        if fnmatch.fnmatch(account, wildcard):
+    # request a text wildcard first so the server only sends back matching accounts
+    print("\nPlease input a text wildcard. * matches everything, ? matches any single character, [seq] matches any character in seq, and [!seq] matches any character not in seq.\n")
+    wildcard = wrap_input(this_client, "Text wildcard: ")
+    if not wildcard:
+        return
+
+    # print the matching accounts page by page as the server streams them
+    print("\nList of accounts currently on the server matching " + wildcard + ":\n")
+    try:
+      for page in this_client.account_pages(wildcard, stubs):
+        for account in page:
           print(str(account))
-      wrap_input(this_client, "\nPress enter to return to the main menu.\n\n")
-    
-    # if no accounts exist on the server, print the error and allow the user to go back to the start menu
-    else:
-      print("\nThere are currently no accounts on the server.\n")
-      wrap_input(this_client, "Press enter to return to the main menu.\n\n")
-    
+    except grpc.RpcError:
+      print("Disconnected from all servers")
+      return
+    wrap_input(this_client, "\nPress enter to return to the main menu.\n\n")
+
     return start(this_client, stubs)
 
 def wrap_menu(this_client, menu, actions, message):
@@ -227,6 +238,254 @@ def wrap_input(this_client, string):
     except KeyboardInterrupt:
         return this_client.quit_messenger()
 
+def parse_client_args(argv):
+    """
+    Parses the optional flags accepted after `start.py client`.
+
+    Args:
+        argv: The command line arguments following "client".
+
+    Returns:
+        An argparse.Namespace with the client settings.
+    """
+    parser = argparse.ArgumentParser(prog="start.py client")
+    parser.add_argument("--deadline", type=float, default=5.0,
+                        help="seconds each call to a server may take before it is abandoned")
+    parser.add_argument("--required-acks", type=int, default=1,
+                        help="servers that must acknowledge a write before it returns")
+    parser.add_argument("--required-reads", type=int, default=1,
+                        help="servers that must answer a read; the newest answer wins")
+    parser.add_argument("--write-once", action="store_true",
+                        help="send each write only to the primary, for servers started with --replicate")
+    parser.add_argument("--shard-map", default=None,
+                        help="JSON file naming the servers of every shard; each user is served by its own shard")
+    return parser.parse_args(argv)
+
+def parse_server_args(argv):
+    """
+    Parses the optional flags accepted after `start.py server`.
+
+    Args:
+        argv: The command line arguments following "server".
+
+    Returns:
+        An argparse.Namespace with the server settings.
+    """
+    parser = argparse.ArgumentParser(prog="start.py server")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="serve on grpc.aio, so open subscriptions and slow clients do not tie up threads")
+    parser.add_argument("--group-commit-ms", type=float, default=None,
+                        help="share one commit between sends arriving within this many milliseconds; "
+                             "0 batches whatever arrived while the previous commit ran")
+    parser.add_argument("--group-commit-batch", type=int, default=256,
+                        help="most sends to put in one group commit")
+    parser.add_argument("--mailbox-cache-mb", type=float, default=None,
+                        help="serve active users' inboxes from up to this many MiB of memory, writing "
+                             "changes back to the database in the background")
+    parser.add_argument("--flush-ms", type=float, default=50.0,
+                        help="with --mailbox-cache-mb, the longest a write stays in memory only; "
+                             "a crash loses at most this much")
+    parser.add_argument("--replicate", action="store_true",
+                        help="the server on the first port becomes the primary and ships every "
+                             "write to the others, which become read-only backups")
+    parser.add_argument("--elect", action="store_true",
+                        help="like --replicate, but the servers elect the primary among themselves "
+                             "and elect a new one if it fails")
+    parser.add_argument("--election-timeout", type=float, default=1.0,
+                        help="seconds without hearing from the primary before a backup stands for election")
+    parser.add_argument("--snapshot-interval", type=float, default=None,
+                        help="seconds between snapshots, after which older log entries are dropped; "
+                             "defaults to 300 with --replicate or --elect and to off otherwise, 0 turns snapshots off")
+    parser.add_argument("--anti-entropy-seconds", type=float, default=30.0,
+                        help="how often a backup checks every inbox against the primary's")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="server processes sharing the port and the database, to use more than one core")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="serve per-RPC metrics in the Prometheus text format at http://localhost:PORT/metrics")
+    parser.add_argument("--profile", action="store_true",
+                        help="time lock waits and holds, SQL statements and commits, served with the "
+                             "--metrics-port metrics, and log the slow ones")
+    parser.add_argument("--slow-ms", type=float, default=100.0,
+                        help="with --profile, log every lock wait or hold, statement or commit taking "
+                             "this many milliseconds or more")
+    parser.add_argument("--shard", default=None,
+                        help="serve this shard of --shard-map, on the addresses the map gives it")
+    parser.add_argument("--shard-map", default="shards.json",
+                        help="JSON file naming the servers of every shard")
+    args = parser.parse_args(argv)
+    if args.workers > 1 and (args.replicate or args.elect):
+        parser.error("--workers cannot be combined with --replicate or --elect")
+    if args.mailbox_cache_mb is not None and (args.workers > 1 or args.replicate or args.elect):
+        parser.error("--mailbox-cache-mb cannot be combined with --workers, --replicate or --elect")
+    if args.snapshot_interval is None:
+        # only replicated servers have backups that need a snapshot to start from
+        args.snapshot_interval = 300.0 if args.replicate or args.elect else 0.0
+    return args
+
+def server_group(args):
+  """
+  Returns the servers of this server's group, the primary first, and the database each
+  one uses: the three default ports, or the servers --shard-map gives --shard.
+
+  Args:
+      args: The parsed server flags.
+
+  Returns:
+      List[Tuple[str, str]]: (address, database file) for each server of the group.
+  """
+  if args.shard is None:
+    return [(SERVER_HOST, "user_database"), (SERVER_HOST_BACKUP_1, "user_database_2"),
+            (SERVER_HOST_BACKUP_2, "user_database_3")]
+  hosts = ShardMap.load(args.shard_map).hosts(args.shard)
+  db = "user_database_shard_" + args.shard
+  return [(host, db if i == 0 else db + "_" + str(i + 1)) for i, host in enumerate(hosts)]
+
+def server_options(args):
+  # worker processes all listen on the same port, and the kernel spreads connections among them
+  return (('grpc.so_reuseport', 1 if args.workers > 1 else 0),)
+
+def start_metrics(args, worker=0):
+  """
+  Starts the metrics endpoint if --metrics-port was given. Each worker process counts
+  its own calls, so worker N serves them on the port after worker N-1's. --profile
+  counts calls too, for its timings to know their RPC, even with no endpoint.
+
+  Args:
+      args: The parsed server flags.
+      worker: This process's number among the workers, from 0.
+
+  Returns:
+      Metrics: The metrics to count calls in, or None if they are off.
+  """
+  if args.metrics_port is None and not args.profile:
+    return None
+  metrics = Metrics()
+  if args.metrics_port is not None:
+    serve_metrics(metrics, args.metrics_port + worker)
+  return metrics
+
+def start_profiler(args, metrics):
+  """Returns the Profiler --profile asks for, or None."""
+  if not args.profile:
+    return None
+  return Profiler(metrics, args.slow_ms)
+
+def setup_server(server, args, host=None, worker=0, profiler=None):
+  """
+  Binds the server to the given address, or else the first free address of its group,
+  starts the matching database and the background work the flags ask for, and
+  registers the replication service.
+
+  Args:
+      server: A grpc or grpc.aio server, not yet bound.
+      args: The parsed server flags.
+      host: The address to bind, already chosen when running several workers.
+      worker: This process's number among the workers, from 0.
+      profiler: The Profiler to time the service's locks and database with, if any.
+
+  Returns:
+      ChatService: The service owning the database, for the caller to serve.
+  """
+  group = server_group(args)
+  hosts = [address for address, _ in group]
+  if host is not None:
+    HOST = host
+    server.add_insecure_port(host)
+  else:
+    # the first address of the group no other server is using yet
+    for i, HOST in enumerate(hosts):
+      try:
+        server.add_insecure_port(HOST)
+        break
+      except RuntimeError:
+        if i == len(hosts) - 1:
+          raise
+  db = dict(group)[HOST]
+  service = ChatService()
+  role = ChatService.STANDALONE
+  if args.replicate and not args.elect:
+    role = ChatService.PRIMARY if HOST == hosts[0] else ChatService.BACKUP
+  # start_db creates the schema and migrates old inbox blobs into the messages table
+  service.start_db(db, args.group_commit_ms, args.group_commit_batch, role, profiler)
+  chat_pb2_grpc.add_ReplicationServiceServicer_to_server(ReplicationServicer(service), server)
+  service.address = HOST
+  if args.elect:
+    peers = [peer for peer in hosts if peer != HOST]
+    service.start_election(HOST, peers, args.election_timeout)
+  if args.workers > 1:
+    service.start_bus(db + ".workers", worker, args.workers)
+  if args.mailbox_cache_mb is not None:
+    service.start_mailboxes(int(args.mailbox_cache_mb * (1 << 20)), args.flush_ms)
+  # snapshots compact the shared log, so one worker takes them for all
+  if args.snapshot_interval > 0 and worker == 0:
+    service.start_snapshots(args.snapshot_interval)
+  if role == ChatService.PRIMARY:
+    # backups that are not up yet are caught up from the log once they start
+    service.start_replication(hosts[1:])
+  elif role == ChatService.BACKUP:
+    # pull anything missed while this server was down, without waiting to serve reads
+    service.start_resync(hosts[0], interval_seconds=args.anti_entropy_seconds)
+  if worker == 0:
+    os.system('clear')
+    if args.workers > 1:
+      print("[STARTING] Server is starting at IPv4 Address " + HOST + " with " + str(args.workers) + " workers ...")
+    else:
+      print("[STARTING] Server is starting at IPv4 Address " + HOST + " ...")
+  return service
+
+def serve(args, host=None, worker=0):
+  """
+  Serves ChatService on a pool of 10 threads until the server is terminated.
+
+  Args:
+      args: The parsed server flags.
+      host: The address to bind, see setup_server.
+      worker: This process's number among the workers, from 0.
+
+  Returns:
+      None
+  """
+  metrics = start_metrics(args, worker)
+  server = grpc.server(futures.ThreadPoolExecutor(max_workers=10), options=server_options(args),
+                       interceptors=[MetricsInterceptor(metrics)] if metrics else [])
+  service = setup_server(server, args, host, worker, start_profiler(args, metrics))
+  chat_pb2_grpc.add_ChatServiceServicer_to_server(service, server)
+  server.start()
+  server.wait_for_termination()
+
+async def serve_async(args, host=None, worker=0):
+  """
+  Serves ChatService on a grpc.aio server until it is terminated. The server is
+  created here so it belongs to the running event loop.
+
+  Args:
+      args: The parsed server flags.
+      host: The address to bind, see setup_server.
+      worker: This process's number among the workers, from 0.
+
+  Returns:
+      None
+  """
+  # the replication service stays synchronous and runs on its own small thread pool
+  metrics = start_metrics(args, worker)
+  server = grpc.aio.server(migration_thread_pool=futures.ThreadPoolExecutor(max_workers=4),
+                           options=server_options(args),
+                           interceptors=[AsyncMetricsInterceptor(metrics)] if metrics else [])
+  async_service = AsyncChatService(setup_server(server, args, host, worker, start_profiler(args, metrics)))
+  chat_pb2_grpc.add_ChatServiceServicer_to_server(async_service, server)
+  await server.start()
+  try:
+    await server.wait_for_termination()
+  finally:
+    async_service.close()
+
+def serve_worker(args, host, worker):
+  """Runs one worker process of a server started with --workers."""
+  if args.use_async:
+    asyncio.run(serve_async(args, host, worker))
+  else:
+    serve(args, host, worker)
+
 
 if __name__ == "__main__":
 
@@ -240,6 +499,7 @@ if __name__ == "__main__":
 # if the client is specified as what the user wants to start, connect grpc to server host, create
 # client, start background listener thread, and direct to start menu 
   elif sys.argv[1] == "client":
+    args = parse_client_args(sys.argv[2:])
     os.system('clear') # clear terminal on start for client
     with grpc.insecure_channel(SERVER_HOST) as channel:
       with grpc.insecure_channel(SERVER_HOST_BACKUP_1) as channel1:
@@ -247,41 +507,26 @@ if __name__ == "__main__":
           stub = chat_pb2_grpc.ChatServiceStub(channel)
           stub1 = chat_pb2_grpc.ChatServiceStub(channel1)
           stub2 = chat_pb2_grpc.ChatServiceStub(channel2)
-          client = Client()
-
-          start(client, [stub, stub1, stub2])
+          shard_map = ShardMap.load(args.shard_map) if args.shard_map else None
+          client = Client(args.deadline, args.required_acks, args.write_once, args.required_reads, shard_map)
+          try:
+            start(client, [stub, stub1, stub2])
+          finally:
+            client.close()
 
 
 # if the server is specified as what the user wants to start, connect grpc server, create server
 # object, and start it
   elif sys.argv[1] == "server":
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10), options=(('grpc.so_reuseport', 0),))
-    HOST = SERVER_HOST
-    db = "user_database"
-    try:
-      server.add_insecure_port(SERVER_HOST)
-    except RuntimeError:
-      try:
-        HOST = SERVER_HOST_BACKUP_1
-        db = "user_database_2"
-        server.add_insecure_port(SERVER_HOST_BACKUP_1)
-      except RuntimeError:
-        HOST = SERVER_HOST_BACKUP_2
-        db = "user_database_3"
-        server.add_insecure_port(SERVER_HOST_BACKUP_2)
-    service = ChatService()
-    service.start_db(db)
-    chat_pb2_grpc.add_ChatServiceServicer_to_server(service, server)
-    os.system('clear')
-    print("[STARTING] Server is starting at IPv4 Address " + HOST + " ...")
-    conn = sqlite3.connect(db, check_same_thread=False) 
-    c = conn.cursor()
-    c.execute('''
-          CREATE TABLE IF NOT EXISTS users
-          ([user_id] INTEGER PRIMARY KEY, [user_name] TEXT, [incoming_messages] TEXT)
-          ''')
-    server.start()
-    server.wait_for_termination()
+    args = parse_server_args(sys.argv[2:])
+    if args.workers > 1:
+      # the port is chosen before forking, since every worker binds the same one
+      host = free_host([address for address, _ in server_group(args)])
+      run_workers(serve_worker, args.workers, args, host)
+    elif args.use_async:
+      asyncio.run(serve_async(args))
+    else:
+      serve(args)
 
   else:
     print("please specify running client or server")
\ No newline at end of file
@@ -0,0 +1,247 @@
+import sqlite3
+import threading
+import time
+
+
+class ConnectionPool:
+    """
+    Hands out one SQLite connection per thread so gRPC worker threads can use the
+    database at the same time. Every connection runs in WAL mode, which lets readers
+    proceed while a writer is committing.
+    """
+
+    def __init__(self, db, synchronous="FULL", cache_size=-16000, busy_timeout=30.0, factory=sqlite3.Connection):
+        """
+        Initializes a pool for the given database file. Connections are opened lazily.
+
+        Args:
+        - db (str): Path of the SQLite database file.
+        - synchronous (str): Value for PRAGMA synchronous. FULL keeps every commit
+          durable on its own, the same guarantee as the default rollback journal.
+        - cache_size (int): Value for PRAGMA cache_size; negative values are in KiB.
+        - busy_timeout (float): Seconds a writer waits for another writer's lock.
+        - factory: The sqlite3.Connection subclass to open, e.g. a Profiler's connection_class.
+
+        Returns:
+        None
+        """
+        self.db = db
+        self.synchronous = synchronous
+        self.cache_size = cache_size
+        self.busy_timeout = busy_timeout
+        self.factory = factory
+        self.local = threading.local()
+        # every connection handed out, so close() can reach the ones owned by other threads
+        self.connections = []
+        self.connections_lock = threading.Lock()
+
+    def connect(self):
+        """
+        Opens a new connection with the pool's pragmas applied.
+
+        Returns:
+        A sqlite3.Connection.
+        """
+        # check_same_thread is off only so close() can run from another thread;
+        # each connection is otherwise used by the thread that opened it
+        conn = sqlite3.connect(self.db, timeout=self.busy_timeout, check_same_thread=False, factory=self.factory)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=" + self.synchronous)
+        conn.execute("PRAGMA cache_size=" + str(int(self.cache_size)))
+        return conn
+
+    def connection(self):
+        """
+        Returns the calling thread's connection, opening it on first use.
+
+        Returns:
+        A sqlite3.Connection owned by the calling thread.
+        """
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.connect()
+            self.local.conn = conn
+            self.local.cursor = conn.cursor()
+            with self.connections_lock:
+                self.connections.append(conn)
+        return conn
+
+    def cursor(self):
+        """
+        Returns the calling thread's cursor, opening its connection on first use.
+
+        Returns:
+        A sqlite3.Cursor owned by the calling thread.
+        """
+        self.connection()
+        return self.local.cursor
+
+    def close(self):
+        """
+        Closes every connection the pool has handed out.
+
+        Returns:
+        None
+        """
+        with self.connections_lock:
+            for conn in self.connections:
+                conn.close()
+            self.connections = []
+        self.local = threading.local()
+
+
+class GroupCommitter:
+    """
+    Batches writes from many threads into shared transactions. A single writer thread
+    collects writes that arrive within a short window, runs them in one transaction
+    and commits once, so a burst of writes pays for one fsync instead of one each.
+    Callers block until the transaction holding their write is committed, so every
+    write is exactly as durable on return as it would be with its own commit.
+    """
+
+    def __init__(self, pool, window_ms=2.0, max_batch=256):
+        """
+        Starts the writer thread.
+
+        Args:
+        - pool (ConnectionPool): The pool used to open the writer's own connection.
+        - window_ms (float): How long to keep collecting after the first write of a batch.
+        - max_batch (int): The most writes to put in one transaction.
+
+        Returns:
+        None
+        """
+        self.pool = pool
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self.pending = []
+        self.pending_lock = threading.Condition()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def execute(self, write):
+        """
+        Queues a write and waits until the transaction containing it commits.
+
+        Args:
+        - write: A function taking a cursor that runs the write's statements. It runs
+          inside its own savepoint, so a failing write is undone without aborting the
+          rest of its batch.
+
+        Returns:
+        Whatever the write function returned.
+
+        Raises:
+        Exception: Whatever the write raised, or sqlite3.Error if its transaction's commit failed.
+        """
+        return self.wait(self.submit(write))
+
+    def submit(self, write, on_commit=None):
+        """
+        Queues a write without waiting for it. Writes run in the order they were queued.
+
+        Args:
+        - write: A function taking a cursor, as for execute.
+        - on_commit: Called by the writer thread with the write's result once it is
+          committed, in commit order, before its caller is woken.
+
+        Returns:
+        A handle to pass to wait.
+        """
+        pending = {"write": write, "on_commit": on_commit, "done": threading.Event(), "result": None, "error": None}
+        with self.pending_lock:
+            if not self.running:
+                raise sqlite3.ProgrammingError("group committer is stopped")
+            self.pending.append(pending)
+            self.pending_lock.notify()
+        return pending
+
+    def wait(self, pending):
+        """
+        Waits until the transaction containing a queued write commits.
+
+        Args:
+        - pending: The handle submit returned.
+
+        Returns:
+        Whatever the write function returned.
+
+        Raises:
+        Exception: Whatever the write raised, or sqlite3.Error if its transaction's commit failed.
+        """
+        pending["done"].wait()
+        if pending["error"] is not None:
+            raise pending["error"]
+        return pending["result"]
+
+    def next_batch(self):
+        """
+        Waits for the first pending write, then keeps collecting until the window
+        closes or the batch is full.
+
+        Returns:
+        A list of pending writes, empty once the committer has been stopped.
+        """
+        with self.pending_lock:
+            while self.running and not self.pending:
+                self.pending_lock.wait()
+            deadline = time.monotonic() + self.window
+            while self.running and len(self.pending) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.pending_lock.wait(remaining)
+            batch = self.pending[:self.max_batch]
+            self.pending = self.pending[self.max_batch:]
+            return batch
+
+    def run(self):
+        """Writer thread loop: runs each batch in one transaction and wakes its callers."""
+        conn = self.pool.connect()
+        cursor = conn.cursor()
+        while True:
+            batch = self.next_batch()
+            if not batch:
+                break
+            try:
+                cursor.execute("BEGIN")
+                for pending in batch:
+                    cursor.execute("SAVEPOINT write")
+                    try:
+                        pending["result"] = pending["write"](cursor)
+                    except Exception as error:
+                        # any failure, not only SQLite's, is the caller's to see
+                        cursor.execute("ROLLBACK TO write")
+                        pending["error"] = error
+                    cursor.execute("RELEASE write")
+                conn.commit()
+            except Exception as error:
+                conn.rollback()
+                for pending in batch:
+                    pending["error"] = error
+            else:
+                for pending in batch:
+                    if pending["error"] is None and pending["on_commit"] is not None:
+                        try:
+                            pending["on_commit"](pending["result"])
+                        except Exception as error:
+                            # the write is committed, so its caller still succeeds
+                            print("[COMMIT] After-commit hook failed: " + str(error))
+            finally:
+                # callers are woken whatever happened, so none of them waits forever
+                for pending in batch:
+                    pending["done"].set()
+        conn.close()
+
+    def stop(self):
+        """
+        Commits anything still pending and stops the writer thread.
+
+        Returns:
+        None
+        """
+        with self.pending_lock:
+            self.running = False
+            self.pending_lock.notify()
+        self.thread.join()
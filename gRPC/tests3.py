@@ -1,10 +1,29 @@
+import asyncio
+import contextlib
+import io
+import os
+import queue
+import sqlite3
+import tempfile
+import time
 import unittest
+import urllib.request
 import threading
+from concurrent import futures
 from client import Client
+from election import Elector
 from chat_pb2_grpc import ChatServiceStub
 import chat_pb2
+import chat_pb2_grpc
 import grpc
+import mailboxes
+from aio_server import AsyncChatService
+from metrics import Metrics, MetricsInterceptor, serve_metrics
+from profiling import Profiler, normalize_sql
+from replication import ReplicationServicer, Resyncer
+from sharding import Migrator, ShardMap, moved_users
 from server import ChatService
+from user import User
 
 class TestChatApp(unittest.TestCase):
     @classmethod
@@ -18,6 +37,7 @@ class TestChatApp(unittest.TestCase):
 
     def setUp(self):
         self.chat_client = Client()
+        self.addCleanup(self.chat_client.close)
         self.channel = grpc.insecure_channel('localhost:50051')
         self.stub = ChatServiceStub(self.channel)
 
@@ -56,5 +76,1185 @@ class TestChatApp(unittest.TestCase):
         view_result = self.chat_client.view_msgs(receiver, [self.stub])
         self.assertEqual(view_result, 1)
 
+
+class TestChatServer(unittest.TestCase):
+    """Runs a ChatService in-process on an ephemeral port backed by a temp database."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db = os.path.join(self.tmpdir.name, "user_database")
+        self.service = ChatService()
+        self.service.start_db(self.db)
+        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+        chat_pb2_grpc.add_ChatServiceServicer_to_server(self.service, self.server)
+        port = self.server.add_insecure_port("localhost:0")
+        self.server.start()
+        self.channel = grpc.insecure_channel("localhost:" + str(port))
+        self.stub = ChatServiceStub(self.channel)
+        self.chat_client = Client()
+        self.addCleanup(self.chat_client.close)
+
+    def tearDown(self):
+        self.channel.close()
+        self.server.stop(None)
+        self.service.close_db()
+        self.tmpdir.cleanup()
+
+    def test_send_and_view_messages(self):
+        self.assertEqual(self.chat_client.create_account("alice", [self.stub]), 0)
+        self.assertEqual(self.chat_client.create_account("bob", [self.stub]), 0)
+        for i in range(3):
+            self.assertEqual(self.chat_client.send_message("alice", "bob", "hi " + str(i), [self.stub]), 0)
+
+        received_info = self.stub.ViewMessageClient(chat_pb2.ClientMessage(info="bob"))
+        self.assertEqual(received_info.operation, chat_pb2.MESSAGES_EXIST)
+        self.assertEqual(received_info.info, "hi 0\nhi 1\nhi 2")
+
+        # viewing clears the inbox
+        received_info = self.stub.ViewMessageClient(chat_pb2.ClientMessage(info="bob"))
+        self.assertEqual(received_info.operation, chat_pb2.NO_MESSAGES)
+
+    def test_send_to_missing_user(self):
+        received_info = self.stub.SendMessageClient(chat_pb2.ClientMessage(info="alice\nnobody\nhi"))
+        self.assertEqual(received_info.operation, chat_pb2.FAILURE)
+
+    def test_username_index_tracks_create_and_delete(self):
+        self.assertEqual(self.chat_client.create_account("alice", [self.stub]), 0)
+        self.assertEqual(self.chat_client.create_account("alice", [self.stub]), 1)
+        self.assertEqual(self.chat_client.login("alice", [self.stub]), 0)
+        self.assertEqual(self.chat_client.delete_account("alice", [self.stub]), 0)
+        self.assertEqual(self.chat_client.login("alice", [self.stub]), 1)
+        self.assertNotIn("alice", self.service.usernames)
+
+    def test_duplicate_insert_is_rejected_by_database(self):
+        self.assertEqual(self.chat_client.create_account("alice", [self.stub]), 0)
+        # simulate a stale in-memory index; the unique index must still refuse the insert
+        self.service.usernames.discard("alice")
+        received_info = self.stub.CreateAccountClient(chat_pb2.ClientMessage(info="alice"))
+        self.assertEqual(received_info.operation, chat_pb2.ACCOUNT_ALREADY_EXISTS)
+        self.assertIn("alice", self.service.usernames)
+
+    def test_concurrent_sends_to_many_recipients(self):
+        for i in range(20):
+            self.service.create_account_processing(chat_pb2.ClientMessage(info="user" + str(i)))
+        requests = [
+            chat_pb2.ClientMessage(info="user0\nuser" + str(i % 20) + "\nmsg " + str(i)) for i in range(200)
+        ]
+        with futures.ThreadPoolExecutor(max_workers=10) as pool:
+            results = list(pool.map(self.service.send_msg_processing, requests))
+        self.assertTrue(all(result.operation == chat_pb2.SUCCESS for result in results))
+        for i in range(20):
+            received_info = self.service.view_msg_processing(chat_pb2.ClientMessage(info="user" + str(i)))
+            self.assertEqual(len(received_info.info.split("\n")), 10)
+
+    def test_reads_proceed_while_writer_holds_lock(self):
+        self.service.create_account_processing(chat_pb2.ClientMessage(info="alice"))
+        writer = sqlite3.connect(self.db)
+        writer.execute("BEGIN IMMEDIATE")
+        writer.execute("INSERT INTO users (user_name, incoming_messages) VALUES ('bob', '')")
+        try:
+            # WAL mode lets this read run against the last committed state instead of waiting
+            received_info = self.stub.ListAccountClient(chat_pb2.ClientMessage(info=""), timeout=5)
+            self.assertEqual(received_info.info, "alice")
+        finally:
+            writer.rollback()
+            writer.close()
+
+    def test_subscribe_flushes_backlog_then_pushes(self):
+        self.chat_client.create_account("alice", [self.stub])
+        self.chat_client.create_account("bob", [self.stub])
+        self.chat_client.send_message("alice", "bob", "while offline", [self.stub])
+
+        call = self.stub.SubscribeMessages(chat_pb2.ClientMessage(info="bob"), timeout=10)
+        self.assertEqual(next(call).info, "while offline")
+        self.chat_client.send_message("alice", "bob", "while online", [self.stub])
+        self.assertEqual(next(call).info, "while online")
+        call.cancel()
+
+        # the flushed backlog is removed from the stored inbox; the last pushed message
+        # may still be there if the stream was cancelled before the server resumed
+        received_info = self.stub.ViewMessageClient(chat_pb2.ClientMessage(info="bob"))
+        self.assertNotIn("while offline", received_info.info)
+
+    def test_bulk_send_reports_status_per_message(self):
+        self.chat_client.create_account("alice", [self.stub])
+        self.chat_client.create_account("bob", [self.stub])
+        records = [("alice", "bob", "msg " + str(i)) for i in range(1200)]
+        records.insert(3, ("alice", "nobody", "lost"))
+        statuses = self.chat_client.send_messages_bulk(records, [self.stub])
+        self.assertEqual(len(statuses), 1201)
+        self.assertEqual(statuses[3], 1)
+        self.assertEqual(sum(statuses), 1)
+
+        received_info = self.stub.ViewMessageClient(chat_pb2.ClientMessage(info="bob"))
+        self.assertEqual(received_info.info.split("\n"), ["msg " + str(i) for i in range(1200)])
+
+    def test_typed_send_and_inbox_keep_multiline_bodies(self):
+        self.chat_client.create_account("alice", [self.stub])
+        self.chat_client.create_account("bob", [self.stub])
+        received_info = self.stub.SendMessage(chat_pb2.SendRequest(sender="alice", receiver="bob", body="line 1\nline 2"))
+        self.assertEqual(received_info.operation, chat_pb2.SUCCESS)
+        # the legacy RPC keeps everything after the receiver as the body instead of crashing
+        received_info = self.stub.SendMessageClient(chat_pb2.ClientMessage(info="alice\nbob\nline 3\nline 4"))
+        self.assertEqual(received_info.operation, chat_pb2.SUCCESS)
+
+        inbox = self.stub.ViewInbox(chat_pb2.ClientMessage(info="bob"))
+        self.assertEqual(inbox.operation, chat_pb2.MESSAGES_EXIST)
+        self.assertEqual([message.body for message in inbox.messages], ["line 1\nline 2", "line 3\nline 4"])
+        self.assertEqual(inbox.messages[0].sender, "alice")
+        self.assertLess(inbox.messages[0].id, inbox.messages[1].id)
+        self.assertGreater(inbox.messages[0].timestamp, 0)
+        self.assertEqual(self.stub.ViewInbox(chat_pb2.ClientMessage(info="bob")).operation, chat_pb2.NO_MESSAGES)
+
+    def test_list_accounts_filters_and_pages_on_server(self):
+        for username in ["amy", "anna", "ann", "bob", "anne", "[x]", "carl"]:
+            self.service.create_account_processing(chat_pb2.ClientMessage(info=username))
+        pages = list(self.stub.ListAccounts(chat_pb2.ListAccountsRequest(pattern="an*", page_size=2)))
+        self.assertEqual([list(page.usernames) for page in pages], [["ann", "anna"], ["anne"]])
+        self.assertEqual(pages[0].next_cursor, "anna")
+
+        resumed = self.stub.ListAccounts(chat_pb2.ListAccountsRequest(pattern="an*", page_size=2, cursor="anna"))
+        self.assertEqual([list(page.usernames) for page in resumed], [["anne"]])
+        self.assertEqual(self.chat_client.list_accounts_matching("[!a]*", [self.stub]), ["[x]", "bob", "carl"])
+        self.assertEqual(self.chat_client.list_accounts_matching("a??", [self.stub]), ["amy", "ann"])
+        self.assertEqual(self.chat_client.list_accounts_matching("zed*", [self.stub]), [])
+
+    def test_fetch_is_retry_safe_until_acknowledged(self):
+        self.chat_client.create_account("alice", [self.stub])
+        self.chat_client.create_account("bob", [self.stub])
+        self.chat_client.send_messages_bulk([("alice", "bob", "msg " + str(i)) for i in range(5)], [self.stub])
+
+        first = self.stub.FetchMessages(chat_pb2.FetchRequest(user="bob", limit=2))
+        retried = self.stub.FetchMessages(chat_pb2.FetchRequest(user="bob", limit=2))
+        self.assertEqual([message.body for message in first.messages], ["msg 0", "msg 1"])
+        self.assertEqual(first, retried)
+
+        after_id = first.messages[-1].id
+        self.assertEqual(self.stub.AckMessages(chat_pb2.AckRequest(user="bob", up_to_id=after_id)).operation, chat_pb2.SUCCESS)
+        rest = self.stub.FetchMessages(chat_pb2.FetchRequest(user="bob", limit=10))
+        self.assertEqual([message.body for message in rest.messages], ["msg 2", "msg 3", "msg 4"])
+
+        # view_msgs drains the rest in chunks
+        self.chat_client.FETCH_LIMIT = 2
+        self.assertEqual(self.chat_client.view_msgs("bob", [self.stub]), 0)
+        self.assertEqual(self.stub.FetchMessages(chat_pb2.FetchRequest(user="bob")).operation, chat_pb2.NO_MESSAGES)
+        self.assertEqual(self.chat_client.view_msgs("bob", [self.stub]), 1)
+
+    def test_view_msgs_merges_replicas_that_differ(self):
+        other = ChatService()
+        other.start_db(os.path.join(self.tmpdir.name, "user_database_2"))
+        other_server = grpc.server(futures.ThreadPoolExecutor(max_workers=4))
+        chat_pb2_grpc.add_ChatServiceServicer_to_server(other, other_server)
+        other_port = other_server.add_insecure_port("localhost:0")
+        other_server.start()
+        other_channel = grpc.insecure_channel("localhost:" + str(other_port))
+        try:
+            stubs = [self.stub, ChatServiceStub(other_channel)]
+            # wait for both servers, so each has the account before the sends below
+            self.chat_client.required_acks = 2
+            self.assertEqual(self.chat_client.create_account("bob", stubs), 0)
+            self.assertEqual(self.chat_client.send_message("alice", "bob", "both", stubs), 0)
+            # this replica missed one send and the other missed another
+            other.send_processing("alice", "bob", "second only")
+            self.service.send_processing("alice", "bob", "first only")
+
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                self.assertEqual(self.chat_client.view_msgs("bob", stubs), 0)
+            printed = output.getvalue()
+            for body in ("both", "second only", "first only"):
+                self.assertEqual(printed.count(". " + body + "\n"), 1)
+            # every message acknowledged somewhere was printed, and nothing is left behind
+            for stub in stubs:
+                self.assertEqual(stub.FetchMessages(chat_pb2.FetchRequest(user="bob")).operation, chat_pb2.NO_MESSAGES)
+        finally:
+            other_channel.close()
+            other_server.stop(None)
+            other.close_db()
+
+    def test_subscribe_unknown_user(self):
+        call = self.stub.SubscribeMessages(chat_pb2.ClientMessage(info="nobody"), timeout=10)
+        self.assertEqual([received_info.operation for received_info in call], [chat_pb2.FAILURE])
+
+    def test_fan_out_does_not_wait_for_hung_replica(self):
+        release = threading.Event()
+
+        class HungService(chat_pb2_grpc.ChatServiceServicer):
+            def CreateAccountClient(self, request, context):
+                release.wait(10)
+                return chat_pb2.ServerMessage(operation=chat_pb2.SUCCESS, info="")
+
+        hung_server = grpc.server(futures.ThreadPoolExecutor(max_workers=2))
+        chat_pb2_grpc.add_ChatServiceServicer_to_server(HungService(), hung_server)
+        hung_port = hung_server.add_insecure_port("localhost:0")
+        hung_server.start()
+        hung_channel = grpc.insecure_channel("localhost:" + str(hung_port))
+        try:
+            stubs = [ChatServiceStub(hung_channel), self.stub]
+            client = Client(deadline=5)
+            self.addCleanup(client.close)
+            start = time.monotonic()
+            self.assertEqual(client.create_account("alice", stubs), 0)
+            self.assertLess(time.monotonic() - start, 2)
+
+            # requiring both acknowledgements fails once the hung replica hits the deadline
+            client = Client(deadline=1, required_acks=2)
+            self.addCleanup(client.close)
+            start = time.monotonic()
+            self.assertEqual(client.create_account("bob", stubs), 1)
+            self.assertLess(time.monotonic() - start, 3)
+        finally:
+            release.set()
+            hung_channel.close()
+            hung_server.stop(None)
+
+    def test_router_skips_down_replica_until_it_recovers(self):
+        down_server = grpc.server(futures.ThreadPoolExecutor(max_workers=2))
+        down_port = down_server.add_insecure_port("localhost:0")
+        # nothing listens on the port until the replica is revived
+        down_server.start()
+        down_server.stop(None).wait()
+        down_channel = grpc.insecure_channel("localhost:" + str(down_port))
+        revived_server = None
+        try:
+            self.assertEqual(self.chat_client.create_account("alice", [self.stub]), 0)
+            down_stub = ChatServiceStub(down_channel)
+            stubs = [down_stub, self.stub]
+            client = Client(deadline=1)
+            self.addCleanup(client.close)
+            client.router.probe_seconds = 0.05
+            for _ in range(2):
+                self.assertEqual(client.login("alice", stubs), 0)
+            # reads now go straight to the live replica
+            self.assertTrue(client.router.is_open(down_stub))
+            self.assertEqual(client.router.fastest(stubs), [self.stub])
+
+            # a background probe closes the breaker once the replica is back
+            revived_server = grpc.server(futures.ThreadPoolExecutor(max_workers=2))
+            chat_pb2_grpc.add_ChatServiceServicer_to_server(self.service, revived_server)
+            revived_server.add_insecure_port("localhost:" + str(down_port))
+            revived_server.start()
+            deadline = time.monotonic() + 5
+            while client.router.is_open(down_stub) and time.monotonic() < deadline:
+                time.sleep(0.05)
+            self.assertFalse(client.router.is_open(down_stub))
+
+            # closing the client stops its prober
+            client.close()
+            self.assertFalse(client.router.prober.is_alive())
+        finally:
+            down_channel.close()
+            if revived_server is not None:
+                revived_server.stop(None)
+
+    def test_quorum_read_prefers_newest_replica(self):
+        stale = ChatService()
+        stale.start_db(os.path.join(self.tmpdir.name, "user_database_2"))
+        stale_server = grpc.server(futures.ThreadPoolExecutor(max_workers=2))
+        chat_pb2_grpc.add_ChatServiceServicer_to_server(stale, stale_server)
+        stale_port = stale_server.add_insecure_port("localhost:0")
+        stale_server.start()
+        stale_channel = grpc.insecure_channel("localhost:" + str(stale_port))
+        try:
+            # only this server has seen the account, so its data version is newer
+            self.assertEqual(self.chat_client.create_account("alice", [self.stub]), 0)
+            stubs = [ChatServiceStub(stale_channel), self.stub]
+            client = Client(required_reads=2)
+            self.addCleanup(client.close)
+            self.assertEqual(client.login("alice", stubs), 0)
+            self.assertEqual(client.list_accounts_matching("*", stubs), ["alice"])
+
+            # a read quorum cannot be met once a replica is down
+            stale_server.stop(None).wait()
+            client = Client(deadline=1, required_reads=2)
+            self.addCleanup(client.close)
+            self.assertEqual(client.login("alice", stubs), 1)
+        finally:
+            stale_channel.close()
+            stale_server.stop(None)
+            stale.close_db()
+
+
+class TestGroupCommit(unittest.TestCase):
+    def test_batched_sends_are_committed_before_returning(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db = os.path.join(tmpdir, "user_database")
+            service = ChatService()
+            service.start_db(db, group_commit_ms=5)
+            for i in range(10):
+                service.create_account_processing(chat_pb2.ClientMessage(info="user" + str(i)))
+            requests = [chat_pb2.ClientMessage(info="user0\nuser" + str(i % 10) + "\nhi") for i in range(100)]
+            with futures.ThreadPoolExecutor(max_workers=10) as pool:
+                results = list(pool.map(service.send_msg_processing, requests))
+            self.assertTrue(all(result.operation == chat_pb2.SUCCESS for result in results))
+
+            # every acknowledged send must be visible to a brand new connection
+            conn = sqlite3.connect(db)
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0], 100)
+            conn.close()
+            service.close_db()
+
+    def test_sends_to_one_receiver_share_commits(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            service = ChatService()
+            service.start_db(os.path.join(tmpdir, "user_database"), group_commit_ms=100)
+            service.create_account_processing(chat_pb2.ClientMessage(info="bob"))
+            requests = [chat_pb2.SendRequest(sender="alice", receiver="bob", body=str(i)) for i in range(10)]
+            start = time.monotonic()
+            with futures.ThreadPoolExecutor(max_workers=10) as pool:
+                results = list(pool.map(service.send_request_processing, requests))
+            # holding bob's stripe through each commit would take a whole window per send
+            self.assertLess(time.monotonic() - start, 0.5)
+            self.assertTrue(all(result.operation == chat_pb2.SUCCESS for result in results))
+            service.c.execute("SELECT COUNT(*) FROM messages WHERE receiver = 'bob'")
+            self.assertEqual(service.c.fetchone()[0], 10)
+            service.close_db()
+
+    def test_failing_write_does_not_stall_its_batch(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            service = ChatService()
+            service.start_db(os.path.join(tmpdir, "user_database"), group_commit_ms=50)
+            committer = service.group_committer
+
+            def insert(cursor):
+                cursor.execute("INSERT INTO users (user_name, incoming_messages) VALUES ('alice', '')")
+
+            def fail(cursor):
+                cursor.execute("INSERT INTO users (user_name, incoming_messages) VALUES ('bob', '')")
+                raise KeyError("bob")
+
+            with futures.ThreadPoolExecutor(max_workers=2) as pool:
+                inserted = pool.submit(committer.execute, insert)
+                failed = pool.submit(committer.execute, fail)
+                self.assertIsNone(inserted.result(timeout=5))
+                with self.assertRaises(KeyError):
+                    failed.result(timeout=5)
+            service.c.execute("SELECT user_name FROM users")
+            self.assertEqual(service.c.fetchall(), [("alice",)])
+            service.close_db()
+
+    def test_async_sends_share_commits(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            service = ChatService()
+            service.start_db(os.path.join(tmpdir, "user_database"), group_commit_ms=100)
+            usernames = ["user" + str(i) for i in range(10)]
+            for username in usernames:
+                service.create_account_processing(chat_pb2.ClientMessage(info=username))
+            async_service = AsyncChatService(service)
+
+            async def send_all():
+                return await asyncio.gather(*(
+                    async_service.SendMessage(chat_pb2.SendRequest(sender="alice", receiver=username, body="hi"), None)
+                    for username in usernames
+                ))
+
+            start = time.monotonic()
+            replies = asyncio.run(send_all())
+            # one after another, the ten sends would take a whole window each
+            self.assertLess(time.monotonic() - start, 0.5)
+            self.assertTrue(all(reply.operation == chat_pb2.SUCCESS for reply in replies))
+            async_service.close()
+            service.close_db()
+
+
+class TestUser(unittest.TestCase):
+    def test_mailbox_is_allocated_lazily_and_drained_by_swap(self):
+        user = User("bob")
+        self.assertIsNone(user.undelivered_messages)
+        self.assertEqual(user.get_current_messages(), [])
+        for msg_id in (1, 2, 3):
+            user.queue_message((msg_id, "alice", "hi " + str(msg_id), 0.0))
+        user.queue_message("now", deliver_now=True)
+        self.assertEqual([row[0] for row in user.messages_after(1, limit=1)], [2])
+        self.assertEqual([row[0] for row in user.remove_messages(2)], [1, 2])
+        self.assertEqual([row[0] for row in user.get_current_messages()], [3])
+        self.assertIsNone(user.undelivered_messages)
+        self.assertEqual(user.get_current_messages(deliver_now=True), ["now"])
+
+    def test_messages_are_found_by_id_across_gaps(self):
+        user = User("bob")
+        for msg_id in (2, 5, 9):
+            user.queue_message((msg_id, "alice", "hi", 0.0))
+        self.assertEqual([row[0] for row in user.messages_after(0)], [2, 5, 9])
+        self.assertEqual([row[0] for row in user.messages_after(3)], [5, 9])
+        self.assertEqual([row[0] for row in user.messages_after(5)], [9])
+        self.assertEqual(user.messages_after(9), [])
+        self.assertEqual([row[0] for row in user.remove_messages(6)], [2, 5])
+        self.assertEqual([row[0] for row in user.remove_messages(100)], [9])
+        self.assertIsNone(user.undelivered_messages)
+        self.assertFalse(hasattr(user, "__dict__"))
+
+
+class TestMailboxCache(unittest.TestCase):
+    """Runs a ChatService with its mailbox cache on, on a temp database."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db = os.path.join(self.tmpdir.name, "user_database")
+        self.service = ChatService()
+        self.service.start_db(self.db)
+        self.service.start_mailboxes(1 << 20, flush_ms=10)
+        for username in ("alice", "bob"):
+            self.service.create_account_processing(chat_pb2.ClientMessage(info=username))
+
+    def tearDown(self):
+        self.service.close_db()
+        self.tmpdir.cleanup()
+
+    def stored(self, sql):
+        conn = sqlite3.connect(self.db)
+        rows = conn.execute(sql).fetchall()
+        conn.close()
+        return rows
+
+    def test_writes_are_served_from_memory_and_written_back(self):
+        for i in range(3):
+            self.service.send_request_processing(chat_pb2.SendRequest(sender="alice", receiver="bob", body="hi " + str(i)))
+        inbox = self.service.fetch_msg_processing(chat_pb2.FetchRequest(user="bob", limit=2))
+        self.assertEqual([message.body for message in inbox.messages], ["hi 0", "hi 1"])
+        self.service.ack_msg_processing(chat_pb2.AckRequest(user="bob", up_to_id=inbox.messages[-1].id))
+
+        self.service.mailboxes.flush()
+        self.assertEqual(self.stored("SELECT body FROM messages"), [("hi 2",)])
+        # a standalone server keeps no log, only a count of its writes: two accounts, three sends, an ack
+        self.assertEqual(self.stored("SELECT COUNT(*) FROM replication_log"), [(0,)])
+        self.assertEqual(self.stored("SELECT version FROM data_version"), [(6,)])
+
+        self.assertEqual(self.service.view_msg_processing(chat_pb2.ClientMessage(info="bob")).info, "hi 2")
+        self.service.mailboxes.flush()
+        self.assertEqual(self.stored("SELECT body FROM messages"), [])
+
+    def test_idle_mailboxes_are_evicted_and_reloaded(self):
+        self.service.mailboxes.max_bytes = 3 * mailboxes.MAILBOX_BYTES
+        for i in range(10):
+            username = "user" + str(i)
+            self.service.create_account_processing(chat_pb2.ClientMessage(info=username))
+            self.service.send_request_processing(chat_pb2.SendRequest(sender="alice", receiver=username, body="hi"))
+        self.service.mailboxes.flush()
+        self.assertLessEqual(self.service.mailboxes.size, self.service.mailboxes.max_bytes)
+        self.assertNotIn("user0", self.service.mailboxes.mailboxes)
+        # the evicted inbox comes back from the table, ids and all
+        self.assertEqual(self.service.view_inbox_processing(chat_pb2.ClientMessage(info="user0")).messages[0].body, "hi")
+
+    def test_pending_writes_survive_close_but_not_deletion(self):
+        self.service.send_request_processing(chat_pb2.SendRequest(sender="bob", receiver="alice", body="kept"))
+        self.service.send_request_processing(chat_pb2.SendRequest(sender="alice", receiver="bob", body="dropped"))
+        self.service.delete_account_processing(chat_pb2.ClientMessage(info="bob"))
+        self.service.close_db()
+
+        self.service = ChatService()
+        self.service.start_db(self.db)
+        self.assertEqual(self.stored("SELECT receiver, body FROM messages"), [("alice", "kept")])
+
+
+class TestWorkers(unittest.TestCase):
+    """Runs two worker services on one temp database, linked the way --workers links its processes."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        db = os.path.join(self.tmpdir.name, "user_database")
+        self.workers = []
+        for index in range(2):
+            service = ChatService()
+            service.start_db(db)
+            service.start_bus(db + ".workers", index, 2)
+            self.workers.append(service)
+
+    def tearDown(self):
+        for service in self.workers:
+            service.close_db()
+        self.tmpdir.cleanup()
+
+    def wait_for(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return condition()
+
+    def test_accounts_reach_the_other_worker(self):
+        first, second = self.workers
+        first.create_account_processing(chat_pb2.ClientMessage(info="alice"))
+        # known at once, whether or not the announcement has arrived yet
+        self.assertTrue(second.is_valid_user("alice"))
+        self.assertEqual(
+            second.create_account_processing(chat_pb2.ClientMessage(info="alice")).operation,
+            chat_pb2.ACCOUNT_ALREADY_EXISTS,
+        )
+        second.delete_account_processing(chat_pb2.ClientMessage(info="alice"))
+        self.assertTrue(self.wait_for(lambda: "alice" not in first.usernames))
+
+    def test_lost_deletion_is_caught_on_write(self):
+        first, second = self.workers
+        first.create_account_processing(chat_pb2.ClientMessage(info="alice"))
+        self.assertTrue(second.is_valid_user("alice"))
+        # the announcement of the deletion never reaches the other worker
+        peers, first.bus.peers = first.bus.peers, []
+        first.delete_account_processing(chat_pb2.ClientMessage(info="alice"))
+        first.bus.peers = peers
+        self.assertIn("alice", second.usernames)
+
+        self.assertEqual(second.send_processing("bob", "alice", "hi"), chat_pb2.FAILURE)
+        self.assertNotIn("alice", second.usernames)
+        second.c.execute("SELECT COUNT(*) FROM messages WHERE receiver = 'alice'")
+        self.assertEqual(second.c.fetchone()[0], 0)
+
+    def test_message_reaches_subscription_on_the_other_worker(self):
+        first, second = self.workers
+        first.create_account_processing(chat_pb2.ClientMessage(info="alice"))
+        subscription = queue.Queue()
+        second.subscribers["alice"] = [subscription]
+        self.assertEqual(first.send_processing("bob", "alice", "hi"), chat_pb2.SUCCESS)
+        self.assertEqual(subscription.get(timeout=5)[1], "hi")
+        # too long for one datagram, so the other worker reads the body from the database
+        long_message = "x" * 100000
+        self.assertEqual(first.send_processing("bob", "alice", long_message), chat_pb2.SUCCESS)
+        self.assertEqual(subscription.get(timeout=5)[1], long_message)
+
+
+class TestReplication(unittest.TestCase):
+    """Runs a primary and a backup in-process, each on its own port and temp database."""
+
+    def start_replica(self, name, role):
+        service = ChatService()
+        service.start_db(os.path.join(self.tmpdir.name, name), role=role)
+        server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+        chat_pb2_grpc.add_ChatServiceServicer_to_server(service, server)
+        chat_pb2_grpc.add_ReplicationServiceServicer_to_server(ReplicationServicer(service), server)
+        port = server.add_insecure_port("localhost:0")
+        server.start()
+        channel = grpc.insecure_channel("localhost:" + str(port))
+        self.replicas.append((service, server, channel))
+        return service, "localhost:" + str(port), channel
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.replicas = []
+        self.primary, self.primary_address, primary_channel = self.start_replica("user_database", ChatService.PRIMARY)
+        self.backup, backup_address, backup_channel = self.start_replica("user_database_2", ChatService.BACKUP)
+        self.primary.start_replication([backup_address], heartbeat_seconds=0.1)
+        self.primary_stub = ChatServiceStub(primary_channel)
+        self.backup_stub = ChatServiceStub(backup_channel)
+        self.backup_status = chat_pb2_grpc.ReplicationServiceStub(backup_channel)
+        self.chat_client = Client(write_once=True)
+        self.addCleanup(self.chat_client.close)
+
+    def tearDown(self):
+        for service, server, channel in self.replicas:
+            channel.close()
+            server.stop(None)
+            service.close_db()
+        self.tmpdir.cleanup()
+
+    def wait_for_backup(self):
+        deadline = time.monotonic() + 5
+        while self.backup.applied_seq < self.primary.last_log_seq() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_writes_reach_backup_in_order(self):
+        stubs = [self.backup_stub, self.primary_stub]
+        self.assertEqual(self.chat_client.create_account("alice", stubs), 0)
+        self.assertEqual(self.chat_client.create_account("bob", stubs), 0)
+        for i in range(3):
+            self.assertEqual(self.chat_client.send_message("alice", "bob", "hi " + str(i), stubs), 0)
+        self.wait_for_backup()
+
+        self.assertTrue(self.backup.is_valid_user("bob"))
+        received_info = self.backup_stub.FetchMessages(chat_pb2.FetchRequest(user="bob"))
+        self.assertEqual([message.body for message in received_info.messages], ["hi 0", "hi 1", "hi 2"])
+        # message ids match the primary's, so cursors work against either replica
+        primary_info = self.primary_stub.FetchMessages(chat_pb2.FetchRequest(user="bob"))
+        self.assertEqual(
+            [message.id for message in received_info.messages],
+            [message.id for message in primary_info.messages],
+        )
+
+        self.primary_stub.AckMessages(chat_pb2.AckRequest(user="bob", up_to_id=primary_info.messages[1].id))
+        self.chat_client.delete_account("alice", stubs)
+        self.wait_for_backup()
+        received_info = self.backup_stub.FetchMessages(chat_pb2.FetchRequest(user="bob"))
+        self.assertEqual([message.body for message in received_info.messages], ["hi 2"])
+        self.assertFalse(self.backup.is_valid_user("alice"))
+
+    def test_backup_rejects_writes(self):
+        with self.assertRaises(grpc.RpcError) as raised:
+            self.backup_stub.CreateAccountClient(chat_pb2.ClientMessage(info="alice"))
+        self.assertEqual(raised.exception.code(), grpc.StatusCode.FAILED_PRECONDITION)
+        self.assertFalse(self.backup.is_valid_user("alice"))
+
+    def test_status_reports_lag(self):
+        for i in range(5):
+            self.primary.create_account_processing(chat_pb2.ClientMessage(info="user" + str(i)))
+        self.wait_for_backup()
+        status = self.backup_status.ReplicationStatus(chat_pb2.ClientMessage())
+        self.assertEqual(status.role, ChatService.BACKUP)
+        self.assertEqual(status.applied_seq, 5)
+        self.assertEqual(status.lag, 0)
+
+        status = self.primary.replication_status()
+        self.assertEqual(status.applied_seq, 5)
+        self.assertEqual(status.replicas[0].acked_seq, 5)
+        self.assertEqual(status.replicas[0].lag, 0)
+
+
+    def fill_primary(self):
+        for username in ("alice", "bob", "carol"):
+            self.primary.create_account_processing(chat_pb2.ClientMessage(info=username))
+        for i in range(5):
+            self.primary.send_processing("alice", "bob", "hi " + str(i))
+        self.primary.delete_account_processing(chat_pb2.ClientMessage(info="carol"))
+        self.primary.ack_msg_processing(chat_pb2.AckRequest(user="bob", up_to_id=2))
+
+    def assert_in_sync(self, backup):
+        self.assertEqual(backup.applied_seq, self.primary.last_log_seq())
+        self.assertEqual(backup.usernames, self.primary.usernames)
+        self.assertEqual(backup.user_digests(""), self.primary.user_digests(""))
+
+    def test_restarted_backup_catches_up_from_log(self):
+        self.fill_primary()
+        late, _, _ = self.start_replica("user_database_3", ChatService.BACKUP)
+        resyncer = Resyncer(late, self.primary_address, batch_size=2)
+        self.assertEqual(resyncer.catch_up(), self.primary.last_log_seq())
+        self.assert_in_sync(late)
+        resyncer.channel.close()
+
+    def test_far_behind_backup_installs_snapshot(self):
+        self.fill_primary()
+        late, _, _ = self.start_replica("user_database_3", ChatService.BACKUP)
+        resyncer = Resyncer(late, self.primary_address, batch_size=2, snapshot_lag=3)
+        self.assertEqual(resyncer.catch_up(), self.primary.last_log_seq())
+        self.assert_in_sync(late)
+
+        # after the snapshot the log picks up where it left off
+        self.primary.send_processing("alice", "bob", "after snapshot")
+        resyncer.catch_up()
+        self.assert_in_sync(late)
+        resyncer.channel.close()
+
+    def test_snapshot_compacts_log_and_bootstraps_with_tail(self):
+        self.fill_primary()
+        self.wait_for_backup()
+        seq = self.primary.take_snapshot()
+        self.assertTrue(os.path.exists(self.primary.snapshot_path))
+        self.primary.c.execute("SELECT MIN(seq), MAX(seq) FROM replication_log")
+        self.assertEqual(self.primary.c.fetchone(), (seq, seq))
+        self.primary.send_processing("alice", "bob", "tail")
+
+        # the entries a new replica needs are gone, so it loads the snapshot and then the tail
+        late, _, _ = self.start_replica("user_database_3", ChatService.BACKUP)
+        resyncer = Resyncer(late, self.primary_address)
+        self.assertEqual(resyncer.catch_up(), seq + 1)
+        self.assert_in_sync(late)
+        resyncer.channel.close()
+
+    def test_installed_snapshot_keeps_backups_vote(self):
+        self.primary.save_vote(7, "localhost:3001")
+        self.fill_primary()
+        self.primary.take_snapshot()
+        late, _, _ = self.start_replica("user_database_3", ChatService.BACKUP)
+        late.save_vote(3, "localhost:3003")
+        resyncer = Resyncer(late, self.primary_address)
+        resyncer.install_snapshot()
+        resyncer.channel.close()
+        self.assertEqual(late.load_vote(), (3, "localhost:3003"))
+        self.assertEqual(late.last_log_seq(), self.primary.last_log_seq())
+        late.c.execute("SELECT version FROM data_version")
+        self.assertEqual(late.c.fetchone()[0], self.primary.last_log_seq())
+
+    def test_snapshot_keeps_log_a_backup_still_needs(self):
+        self.primary.create_account_processing(chat_pb2.ClientMessage(info="alice"))
+        self.wait_for_backup()
+        acked_seq = self.primary.replicator.progress()[0][1]
+        # the backup goes down, so nothing after this is acknowledged
+        self.replicas[1][1].stop(None)
+        self.fill_primary()
+        seq = self.primary.take_snapshot()
+        self.assertGreater(seq, acked_seq + 1)
+        self.primary.c.execute("SELECT MIN(seq), MAX(seq) FROM replication_log")
+        self.assertEqual(self.primary.c.fetchone(), (acked_seq + 1, seq))
+        entries = [entry for batch in self.primary.log_batches(acked_seq, 256) for entry in batch.entries]
+        self.assertEqual(entries[0].seq, acked_seq + 1)
+
+    def test_anti_entropy_repairs_divergence(self):
+        self.fill_primary()
+        self.wait_for_backup()
+        self.backup.c.execute("DELETE FROM messages WHERE body = 'hi 3'")
+        self.backup.c.execute("INSERT INTO users (user_name, incoming_messages) VALUES ('mallory', '')")
+        self.backup.conn.commit()
+        self.backup.usernames.add("mallory")
+
+        resyncer = Resyncer(self.backup, self.primary_address, batch_size=1)
+        self.assertEqual(resyncer.anti_entropy(), 2)
+        self.assert_in_sync(self.backup)
+        self.assertEqual(resyncer.anti_entropy(), 0)
+        resyncer.channel.close()
+
+
+class TestElection(unittest.TestCase):
+    """Runs three electing servers in-process, each on its own port and temp database."""
+
+    ELECTION_TIMEOUT = 0.2
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.replicas = []
+        for i in range(3):
+            service = ChatService()
+            service.start_db(os.path.join(self.tmpdir.name, "user_database_" + str(i)))
+            server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+            chat_pb2_grpc.add_ChatServiceServicer_to_server(service, server)
+            chat_pb2_grpc.add_ReplicationServiceServicer_to_server(ReplicationServicer(service), server)
+            address = "localhost:" + str(server.add_insecure_port("localhost:0"))
+            server.start()
+            channel = grpc.insecure_channel(address)
+            self.replicas.append((service, server, channel, address))
+        addresses = [address for _, _, _, address in self.replicas]
+        for service, _, _, address in self.replicas:
+            peers = [peer for peer in addresses if peer != address]
+            service.start_election(address, peers, self.ELECTION_TIMEOUT)
+        self.stubs = [ChatServiceStub(channel) for _, _, channel, _ in self.replicas]
+
+    def tearDown(self):
+        for service, server, channel, _ in self.replicas:
+            channel.close()
+            server.stop(None)
+            service.close_db()
+        self.tmpdir.cleanup()
+
+    def wait_for_leader(self, replicas):
+        deadline = time.monotonic() + 20 * self.ELECTION_TIMEOUT
+        while time.monotonic() < deadline:
+            leaders = [replica for replica in replicas if replica[0].role == ChatService.PRIMARY]
+            terms = set(replica[0].elector.current() for replica in replicas)
+            # one primary, and every server agrees on it and its term
+            if len(leaders) == 1 and len(terms) == 1:
+                return leaders[0]
+            time.sleep(0.02)
+        self.fail("no leader was elected")
+
+    def test_one_leader_is_elected_and_known_to_all(self):
+        service, _, _, address = self.wait_for_leader(self.replicas)
+        for stub in self.stubs:
+            reply = stub.WhoIsLeader(chat_pb2.ClientMessage())
+            self.assertEqual(reply.leader, address)
+            self.assertEqual(reply.term, service.elector.current()[0])
+
+    def test_client_is_redirected_to_leader(self):
+        leader = self.wait_for_leader(self.replicas)
+        client = Client(write_once=True)
+        self.addCleanup(client.close)
+        self.assertEqual(client.create_account("alice", self.stubs), 0)
+        self.assertIs(client.leader_stub, self.stubs[self.replicas.index(leader)])
+        self.assertTrue(leader[0].is_valid_user("alice"))
+
+    def test_leader_cut_off_from_majority_steps_down(self):
+        leader = self.wait_for_leader(self.replicas)
+        leader_stub = self.stubs[self.replicas.index(leader)]
+        self.assertEqual(leader_stub.CreateAccountClient(chat_pb2.ClientMessage(info="alice")).operation, chat_pb2.SUCCESS)
+
+        # both followers go quiet without electing anyone, as if the leader were partitioned off
+        for service, server, _, _ in self.replicas:
+            if service is not leader[0]:
+                service.elector.stop()
+                server.stop(None)
+        deadline = time.monotonic() + 10 * self.ELECTION_TIMEOUT
+        while leader[0].role == ChatService.PRIMARY and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(leader[0].role, ChatService.BACKUP)
+        self.assertFalse(leader[0].elector.has_lease())
+        with self.assertRaises(grpc.RpcError) as raised:
+            leader_stub.CreateAccountClient(chat_pb2.ClientMessage(info="bob"))
+        self.assertEqual(raised.exception.code(), grpc.StatusCode.FAILED_PRECONDITION)
+        self.assertFalse(leader[0].is_valid_user("bob"))
+
+    def test_new_leader_is_elected_after_failure(self):
+        leader = self.wait_for_leader(self.replicas)
+        service, server, channel, _ = leader
+        old_term = service.elector.current()[0]
+        service.create_account_processing(chat_pb2.ClientMessage(info="alice"))
+        deadline = time.monotonic() + 5
+        while not all(replica[0].is_valid_user("alice") for replica in self.replicas) and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        # crash the leader
+        self.replicas.remove(leader)
+        channel.close()
+        server.stop(None)
+        service.close_db()
+
+        new_leader = self.wait_for_leader(self.replicas)[0]
+        self.assertGreater(new_leader.elector.current()[0], old_term)
+        self.assertTrue(new_leader.is_valid_user("alice"))
+
+
+class TestAsyncServer(unittest.TestCase):
+    """Runs an AsyncChatService on grpc.aio in an event loop thread, backed by a temp database."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.service = ChatService()
+        self.service.start_db(os.path.join(self.tmpdir.name, "user_database"))
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.loop_thread.start()
+        self.async_service = AsyncChatService(self.service)
+        port = self.run_on_loop(self.start_server())
+        self.channel = grpc.insecure_channel("localhost:" + str(port))
+        self.stub = ChatServiceStub(self.channel)
+        self.chat_client = Client()
+        self.addCleanup(self.chat_client.close)
+
+    async def start_server(self):
+        self.server = grpc.aio.server()
+        chat_pb2_grpc.add_ChatServiceServicer_to_server(self.async_service, self.server)
+        port = self.server.add_insecure_port("localhost:0")
+        await self.server.start()
+        return port
+
+    def run_on_loop(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(10)
+
+    def tearDown(self):
+        self.channel.close()
+        self.run_on_loop(self.server.stop(None))
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loop_thread.join()
+        self.loop.close()
+        self.async_service.close()
+        self.service.close_db()
+        self.tmpdir.cleanup()
+
+    def test_send_list_and_fetch(self):
+        self.assertEqual(self.chat_client.create_account("alice", [self.stub]), 0)
+        self.assertEqual(self.chat_client.create_account("bob", [self.stub]), 0)
+        self.assertEqual(self.chat_client.create_account("bob", [self.stub]), 1)
+        self.assertEqual(self.chat_client.send_message("alice", "bob", "hi", [self.stub]), 0)
+        self.assertEqual(self.chat_client.send_messages_bulk([("alice", "bob", "bulk")], [self.stub]), [0])
+        self.assertEqual(self.chat_client.list_accounts_matching("*", [self.stub]), ["alice", "bob"])
+        received_info = self.stub.FetchMessages(chat_pb2.FetchRequest(user="bob"))
+        self.assertEqual([message.body for message in received_info.messages], ["hi", "bulk"])
+        # reads carry the same data version the thread-pool server would report
+        _, call = self.stub.LoginClient.with_call(chat_pb2.ClientMessage(info="bob"))
+        self.assertEqual(dict(call.trailing_metadata()), dict(self.service.version_metadata()))
+
+    def test_leader_without_lease_rejects_writes(self):
+        self.service.create_account_processing(chat_pb2.ClientMessage(info="bob"))
+        # a leader whose peers have stopped answering, before its elector thread steps it down
+        elector = Elector(self.service, "localhost:3001", ["localhost:3002", "localhost:3003"])
+        elector.state = Elector.LEADER
+        elector.leader = "localhost:3001"
+        self.service.role = ChatService.PRIMARY
+        self.service.elector = elector
+        try:
+            with self.assertRaises(grpc.RpcError) as raised:
+                self.stub.SendMessage(chat_pb2.SendRequest(sender="alice", receiver="bob", body="hi"))
+            self.assertEqual(raised.exception.code(), grpc.StatusCode.FAILED_PRECONDITION)
+            self.assertEqual(dict(raised.exception.trailing_metadata())["x-leader"], "localhost:3001")
+        finally:
+            self.service.elector = None
+            elector.executor.shutdown()
+            for channel in elector.channels:
+                channel.close()
+        self.assertEqual(self.service.fetch_msg_processing(chat_pb2.FetchRequest(user="bob")).messages, [])
+
+    def test_more_subscriptions_than_threads(self):
+        # far more open streams than the thread-pool server's 10 workers could hold
+        usernames = ["user" + str(i) for i in range(50)]
+        for username in usernames:
+            self.service.create_account_processing(chat_pb2.ClientMessage(info=username))
+        subscriptions = [self.stub.SubscribeMessages(chat_pb2.ClientMessage(info=username)) for username in usernames]
+        try:
+            deadline = time.monotonic() + 5
+            while len(self.service.subscribers) < len(usernames) and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(len(self.service.subscribers), len(usernames))
+            # unary calls are still served while every stream is open
+            self.assertEqual(self.chat_client.login("user0", [self.stub]), 0)
+            for username in usernames:
+                self.chat_client.send_message("user0", username, "ping " + username, [self.stub])
+            for username, subscription in zip(usernames, subscriptions):
+                self.assertEqual(next(subscription).info, "ping " + username)
+        finally:
+            for subscription in subscriptions:
+                subscription.cancel()
+
+
+class TestSharding(unittest.TestCase):
+    """Runs one standalone server per shard in-process, each on its own port and temp database."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.services = {}
+        self.servers = []
+        self.addresses = {}
+        for shard in ("a", "b", "c"):
+            service = ChatService()
+            service.start_db(os.path.join(self.tmpdir.name, "user_database_shard_" + shard))
+            server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+            chat_pb2_grpc.add_ChatServiceServicer_to_server(service, server)
+            self.addresses[shard] = "localhost:" + str(server.add_insecure_port("localhost:0"))
+            server.start()
+            self.services[shard] = service
+            self.servers.append(server)
+
+    def tearDown(self):
+        for server in self.servers:
+            server.stop(None)
+        for service in self.services.values():
+            service.close_db()
+        self.tmpdir.cleanup()
+
+    def shard_map(self, shards):
+        return ShardMap({shard: [self.addresses[shard]] for shard in shards})
+
+    def test_adding_a_shard_moves_only_its_share_of_users(self):
+        usernames = ["user" + str(i) for i in range(10000)]
+        old_map, new_map = ShardMap({"a": [], "b": [], "c": []}), ShardMap({"a": [], "b": [], "c": [], "d": []})
+        moves = moved_users(usernames, old_map, new_map)
+        self.assertTrue(0.2 < len(moves) / len(usernames) < 0.3)
+        self.assertTrue(all(new_shard == "d" for _, _, new_shard in moves))
+        # virtual nodes keep every shard's share close to even
+        for shard in new_map.names():
+            share = sum(1 for username in usernames if new_map.owner(username) == shard) / len(usernames)
+            self.assertTrue(0.15 < share < 0.35)
+
+    def test_client_routes_each_user_to_its_shard(self):
+        shard_map = self.shard_map(["a", "b"])
+        client = Client(shard_map=shard_map)
+        self.addCleanup(client.close)
+        usernames = ["user" + str(i) for i in range(20)]
+        for username in usernames:
+            self.assertEqual(client.create_account(username, []), 0)
+            self.assertEqual(client.login(username, []), 0)
+        for username in usernames:
+            owner = shard_map.owner(username)
+            self.assertIn(username, self.services[owner].usernames)
+            self.assertNotIn(username, self.services["b" if owner == "a" else "a"].usernames)
+
+        # listings gather every shard and stay sorted
+        self.assertEqual(client.list_accounts_matching("user1*", []), sorted(u for u in usernames if u.startswith("user1")))
+        self.assertEqual(sorted(client.list_accounts([]).info.split("\n")), sorted(usernames))
+
+        self.assertEqual(client.send_message("user0", "user1", "hi", []), 0)
+        records = [("user0", username, "bulk") for username in usernames] + [("user0", "nobody", "lost")]
+        self.assertEqual(client.send_messages_bulk(records, []), [0] * len(usernames) + [1])
+        inbox = self.services[shard_map.owner("user1")].fetch_msg_processing(chat_pb2.FetchRequest(user="user1"))
+        self.assertEqual([message.body for message in inbox.messages], ["hi", "bulk"])
+
+    def test_migration_moves_users_and_their_inboxes(self):
+        old_map, new_map = self.shard_map(["a", "b"]), self.shard_map(["a", "b", "c"])
+        old_client = Client(shard_map=old_map)
+        self.addCleanup(old_client.close)
+        usernames = ["user" + str(i) for i in range(30)]
+        for username in usernames:
+            old_client.create_account(username, [])
+            old_client.send_message("sender", username, "before " + username, [])
+
+        migrator_client = Client()
+        self.addCleanup(migrator_client.close)
+        migrator = Migrator(old_map, new_map, migrator_client)
+        moves = migrator.moves()
+        self.assertTrue(moves)
+        self.assertEqual(migrator.prepare(), len(moves))
+        # clients switch to the new map between the two steps, and keep sending
+        new_client = Client(shard_map=new_map)
+        self.addCleanup(new_client.close)
+        for username, _, _ in moves:
+            self.assertEqual(new_client.send_message("sender", username, "during " + username, []), 0)
+        self.assertEqual(migrator.migrate(), (len(moves), len(moves)))
+        self.assertEqual(migrator.moves(), [])
+        migrator.close()
+
+        for username in usernames:
+            owner = new_map.owner(username)
+            for shard, service in self.services.items():
+                self.assertEqual(username in service.usernames, shard == owner)
+            inbox = self.services[owner].fetch_msg_processing(chat_pb2.FetchRequest(user=username))
+            expected = ["before " + username]
+            if any(username == moved for moved, _, _ in moves):
+                expected.append("during " + username)
+            self.assertEqual(sorted(message.body for message in inbox.messages), expected)
+
+    def test_migration_off_unreplicated_servers_keeps_every_message(self):
+        # shard "old" is servers a and b, written to by fan-out, shard "new" is server c
+        old_map = ShardMap({"old": [self.addresses["a"], self.addresses["b"]]})
+        new_map = ShardMap({"new": [self.addresses["c"]]})
+        writer = Client(shard_map=old_map, required_acks=2)
+        self.addCleanup(writer.close)
+        # messages only server a stored push its ids ahead of server b's
+        self.services["a"].create_account_processing(chat_pb2.ClientMessage(info="padding"))
+        for i in range(7):
+            self.services["a"].send_processing("sender", "padding", "pad " + str(i))
+        self.assertEqual(writer.create_account("bob", []), 0)
+        for i in range(5):
+            self.assertEqual(writer.send_message("alice", "bob", "hi " + str(i), []), 0)
+        self.services["b"].send_processing("alice", "bob", "only on b")
+        ids = [
+            [message.id for message in self.services[server].fetch_msg_processing(chat_pb2.FetchRequest(user="bob")).messages]
+            for server in ("a", "b")
+        ]
+        self.assertNotEqual(ids[0], ids[1][:5])
+
+        migrator_client = Client()
+        migrator_client.FETCH_LIMIT = 2
+        self.addCleanup(migrator_client.close)
+        migrator = Migrator(old_map, new_map, migrator_client)
+        self.addCleanup(migrator.close)
+        migrator.prepare()
+        # padding moves too, with the seven messages only server a had
+        self.assertEqual(migrator.migrate(), (2, 13))
+        inbox = self.services["c"].fetch_msg_processing(chat_pb2.FetchRequest(user="bob"))
+        self.assertEqual(
+            sorted(message.body for message in inbox.messages), sorted(["hi " + str(i) for i in range(5)] + ["only on b"])
+        )
+        # the deletion reaches the slower old server in the background
+        deadline = time.monotonic() + 5
+        while "bob" in self.services["a"].usernames | self.services["b"].usernames and time.monotonic() < deadline:
+            time.sleep(0.01)
+        for server in ("a", "b"):
+            self.assertNotIn("bob", self.services[server].usernames)
+
+
+class TestMetrics(unittest.TestCase):
+    """Runs a ChatService behind the metrics interceptor, with the metrics endpoint on a free port."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.service = ChatService()
+        self.service.start_db(os.path.join(self.tmpdir.name, "user_database"))
+        self.metrics = Metrics()
+        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=10), interceptors=[MetricsInterceptor(self.metrics)])
+        chat_pb2_grpc.add_ChatServiceServicer_to_server(self.service, self.server)
+        chat_pb2_grpc.add_ReplicationServiceServicer_to_server(ReplicationServicer(self.service), self.server)
+        port = self.server.add_insecure_port("localhost:0")
+        self.server.start()
+        self.channel = grpc.insecure_channel("localhost:" + str(port))
+        self.stub = ChatServiceStub(self.channel)
+        self.http_server = serve_metrics(self.metrics, 0)
+
+    def tearDown(self):
+        self.http_server.shutdown()
+        self.http_server.server_close()
+        self.channel.close()
+        self.server.stop(None)
+        self.service.close_db()
+        self.tmpdir.cleanup()
+
+    def scrape(self):
+        url = "http://localhost:" + str(self.http_server.server_address[1]) + "/metrics"
+        with urllib.request.urlopen(url) as response:
+            samples = {}
+            for line in response.read().decode().splitlines():
+                if not line.startswith("#"):
+                    name, value = line.rsplit(" ", 1)
+                    samples[name] = float(value)
+            return samples
+
+    def test_calls_are_counted_by_method_and_code(self):
+        for username in ("alice", "bob"):
+            self.stub.CreateAccountClient(chat_pb2.ClientMessage(info=username))
+        self.stub.SendMessage(chat_pb2.SendRequest(sender="alice", receiver="bob", body="hi"))
+        with self.assertRaises(grpc.RpcError):
+            chat_pb2_grpc.ReplicationServiceStub(self.channel).RequestVote(chat_pb2.VoteRequest(term=1))
+
+        samples = self.scrape()
+        create = 'service="ChatService",method="CreateAccountClient"'
+        self.assertEqual(samples["chat_rpc_requests_total{" + create + ',code="OK"}'], 2)
+        self.assertEqual(samples["chat_rpc_latency_seconds_count{" + create + "}"], 2)
+        self.assertEqual(samples["chat_rpc_latency_seconds_bucket{" + create + ',le="+Inf"}'], 2)
+        self.assertEqual(samples["chat_rpc_request_bytes_total{" + create + "}"], len("alice") + len("bob") + 4)
+        vote = 'service="ReplicationService",method="RequestVote"'
+        self.assertEqual(samples["chat_rpc_requests_total{" + vote + ',code="FAILED_PRECONDITION"}'], 1)
+        send = 'service="ChatService",method="SendMessage"'
+        self.assertEqual(samples["chat_rpc_in_flight{" + send + "}"], 0)
+
+    def test_open_stream_is_in_flight_until_cancelled(self):
+        self.stub.CreateAccountClient(chat_pb2.ClientMessage(info="alice"))
+        subscription = self.stub.SubscribeMessages(chat_pb2.ClientMessage(info="alice"))
+        self.stub.SendMessage(chat_pb2.SendRequest(sender="bob", receiver="alice", body="hi"))
+        self.assertEqual(next(subscription).info, "hi")
+        subscribe = 'service="ChatService",method="SubscribeMessages"'
+        self.assertEqual(self.scrape()["chat_rpc_in_flight{" + subscribe + "}"], 1)
+        subscription.cancel()
+        deadline = time.monotonic() + 5
+        while self.scrape()["chat_rpc_in_flight{" + subscribe + "}"] and time.monotonic() < deadline:
+            time.sleep(0.05)
+        samples = self.scrape()
+        self.assertEqual(samples["chat_rpc_in_flight{" + subscribe + "}"], 0)
+        self.assertEqual(samples["chat_rpc_requests_total{" + subscribe + ',code="CANCELLED"}'], 1)
+        self.assertGreater(samples["chat_rpc_response_bytes_total{" + subscribe + "}"], 0)
+
+
+class TestProfiler(unittest.TestCase):
+    """Runs a ChatService started with a Profiler that logs every operation as slow."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.metrics = Metrics()
+        self.slow = []
+        self.service = ChatService()
+        self.service.start_db(
+            os.path.join(self.tmpdir.name, "user_database"), profiler=Profiler(self.metrics, 0, self.slow.append)
+        )
+        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=10), interceptors=[MetricsInterceptor(self.metrics)])
+        chat_pb2_grpc.add_ChatServiceServicer_to_server(self.service, self.server)
+        port = self.server.add_insecure_port("localhost:0")
+        self.server.start()
+        self.channel = grpc.insecure_channel("localhost:" + str(port))
+        self.stub = ChatServiceStub(self.channel)
+
+    def tearDown(self):
+        self.channel.close()
+        self.server.stop(None)
+        self.service.close_db()
+        self.tmpdir.cleanup()
+
+    def test_locks_statements_and_commits_are_timed(self):
+        for username in ("alice", "bob"):
+            self.stub.CreateAccountClient(chat_pb2.ClientMessage(info=username))
+        self.stub.SendMessage(chat_pb2.SendRequest(sender="alice", receiver="bob", body="hi"))
+
+        samples = {}
+        for line in self.metrics.exposition().splitlines():
+            if not line.startswith("#"):
+                name, value = line.rsplit(" ", 1)
+                samples[name] = float(value)
+        self.assertEqual(samples['chat_lock_wait_seconds_count{lock="accounts",method="CreateAccountClient"}'], 2)
+        self.assertEqual(samples['chat_lock_hold_seconds_count{lock="user",method="SendMessage"}'], 1)
+        self.assertGreaterEqual(samples['chat_commit_seconds_count{method="SendMessage"}'], 1)
+        self.assertTrue(any(name.startswith('chat_sql_seconds_count{statement="INSERT INTO messages') for name in samples))
+        self.assertIn("[SLOW]", self.slow[0])
+        self.assertTrue(any(line.endswith("commit in SendMessage") for line in self.slow))
+        # the profiled connections still work with the backup API
+        self.service.take_snapshot()
+
+    def test_statements_are_normalized(self):
+        self.assertEqual(
+            normalize_sql("SELECT id FROM messages\n  WHERE receiver IN (?, ?,?) AND id > 42 AND body = 'it''s'"),
+            "SELECT id FROM messages WHERE receiver IN (?, ...) AND id > ? AND body = ?",
+        )
+
+
+class TestMigration(unittest.TestCase):
+    def test_legacy_inbox_is_migrated(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db = os.path.join(tmpdir, "user_database")
+            conn = sqlite3.connect(db)
+            conn.execute(
+                "CREATE TABLE users ([user_id] INTEGER PRIMARY KEY, [user_name] TEXT, [incoming_messages] TEXT)"
+            )
+            conn.execute("INSERT INTO users (user_name, incoming_messages) VALUES ('bob', 'one\ntwo')")
+            conn.execute("INSERT INTO users (user_name, incoming_messages) VALUES ('alice', '')")
+            conn.commit()
+            conn.close()
+
+            service = ChatService()
+            service.start_db(db)
+            received_info = service.view_msg_processing(chat_pb2.ClientMessage(info="bob"))
+            self.assertEqual(received_info.info, "one\ntwo")
+            service.c.execute("SELECT incoming_messages FROM users WHERE user_name = 'bob'")
+            self.assertEqual(service.c.fetchone()[0], "")
+            service.close_db()
+
+
 if __name__ == "__main__":
     unittest.main()
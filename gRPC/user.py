@@ -1,7 +1,16 @@
-from queue import Queue
+import bisect
+import threading
 
 
 class User:
+    # fixed attributes instead of a per-instance __dict__, so an idle user costs a few
+    # dozen bytes and a server can hold millions of them
+    __slots__ = ("username", "logged_in", "undelivered_messages", "immediate_messages")
+
+    # users share these locks by username hash, instead of every queue having its own
+    LOCK_SHARDS = 64
+    LOCKS = [threading.Lock() for _ in range(LOCK_SHARDS)]
+
     def __init__(self, username):
         """
         Initializes a User object with the given username and default attributes.
@@ -15,14 +24,19 @@ class User:
         # Initialize username and if the user is actively logged in
         self.username = username
         self.logged_in = True
-        # Create a queue for messages when the user is logged out
-        self.undelivered_messages = Queue()
-        # Create a queue for messages when the user is logged in
-        self.immediate_messages = Queue()
+        # Messages for when the user is logged out, allocated with the first one
+        self.undelivered_messages = None
+        # Messages for when the user is logged in, allocated with the first one
+        self.immediate_messages = None
+
+    @property
+    def lock(self):
+        """The lock shared by every user whose username hashes to the same shard."""
+        return self.LOCKS[hash(self.username) % self.LOCK_SHARDS]
 
     def queue_message(self, message, deliver_now=False):
         """
-        Queues the given message in either the immediate or undelivered messages queue.
+        Queues the given message in either the immediate or undelivered messages.
 
         Args:
         - message (str): The message to be queued.
@@ -31,31 +45,77 @@ class User:
         Returns:
         None
         """
-        # if it should be delivered now, put in immediate_messages
-        if deliver_now:
-            self.immediate_messages.put(message)
-        # otherwise, put in undelivered_messages
-        else:
-            self.undelivered_messages.put(message)
+        with self.lock:
+            # if it should be delivered now, put in immediate_messages
+            if deliver_now:
+                if self.immediate_messages is None:
+                    self.immediate_messages = []
+                self.immediate_messages.append(message)
+            # otherwise, put in undelivered_messages
+            else:
+                if self.undelivered_messages is None:
+                    self.undelivered_messages = []
+                self.undelivered_messages.append(message)
 
     def get_current_messages(self, deliver_now=False):
         """
-        Returns a list of messages in either the immediate or undelivered messages queue.
+        Returns a list of messages in either the immediate or undelivered messages, and removes them.
 
         Args:
         - deliver_now (bool): Determines whether the message should be delivered immediately. Defaults to False.
 
         Returns:
-        A list of messages in either the immediate or undelivered messages queue.
-        """
-        # stores messages popped from queue to be returned
-        messages = []
-        # if it should be delivered now, get from immediate_messages
-        if deliver_now:
-            while self.immediate_messages.empty() == False:
-                messages.append(self.immediate_messages.get())
-        # otherwise, get from undelivered_messages
-        else:
-            while self.undelivered_messages.empty() == False:
-                messages.append(self.undelivered_messages.get())
-        return messages
\ No newline at end of file
+        A list of messages in either the immediate or undelivered messages, oldest first.
+        """
+        # swap the whole list out, leaving nothing allocated behind
+        with self.lock:
+            if deliver_now:
+                messages, self.immediate_messages = self.immediate_messages, None
+            else:
+                messages, self.undelivered_messages = self.undelivered_messages, None
+        return messages or []
+
+    def messages_after(self, after_id=0, limit=None):
+        """
+        Returns the undelivered messages after the given id without removing them. Used
+        when the undelivered messages are (id, sender, body, created_at) rows in id order.
+
+        Args:
+        - after_id (int): Only messages with a greater id are returned. Defaults to 0.
+        - limit (int): The most messages to return. Defaults to all of them.
+
+        Returns:
+        A list of messages, oldest first.
+        """
+        with self.lock:
+            messages = self.undelivered_messages or []
+            start = bisect.bisect_left(messages, after(after_id))
+            return messages[start:] if limit is None else messages[start:start + limit]
+
+    def remove_messages(self, up_to_id):
+        """
+        Removes the undelivered messages up to and including the given id. Used when the
+        undelivered messages are (id, sender, body, created_at) rows in id order.
+
+        Args:
+        - up_to_id (int): The id of the last message to remove.
+
+        Returns:
+        A list of the removed messages.
+        """
+        with self.lock:
+            messages = self.undelivered_messages or []
+            end = bisect.bisect_left(messages, after(up_to_id))
+            removed = messages[:end]
+            # free the list once it is empty, like a fresh user
+            self.undelivered_messages = messages[end:] or None
+        return removed
+
+
+def after(message_id):
+    """
+    Returns a key that sorts after every (id, ...) row with an id up to message_id and
+    before every later one, so rows can be bisected without bisect's key argument,
+    which needs Python 3.10.
+    """
+    return (message_id + 1,)
@@ -0,0 +1,176 @@
+import json
+import multiprocessing
+import os
+import socket
+import threading
+
+# messages longer than this are announced without their body, which the receiving
+# worker reads from the database instead
+MAX_DATAGRAM = 1 << 16
+
+
+def free_host(hosts):
+    """
+    Returns the first of the given addresses nothing is listening on yet. A server
+    started with --workers binds its port with SO_REUSEPORT, so it cannot find a free
+    port by trying to bind it the way a single server does.
+
+    Args:
+    - hosts (list): host:port addresses, in order of preference.
+
+    Returns:
+    str: The first free address.
+
+    Raises:
+    RuntimeError: If every address is taken.
+    """
+    for host in hosts:
+        name, port = host.rsplit(":", 1)
+        probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # a port only in TIME_WAIT counts as free, as it does for grpc itself
+        probe.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            probe.bind((name, int(port)))
+            return host
+        except OSError:
+            continue
+        finally:
+            probe.close()
+    raise RuntimeError("no free port among " + ", ".join(hosts))
+
+
+def run_workers(target, count, *args):
+    """
+    Forks count processes running target(*args, index) and waits for all of them.
+    Nothing may have created a grpc channel or server in this process yet, so the
+    children start with clean gRPC state.
+
+    Args:
+    - target: The function each worker runs.
+    - count (int): Number of workers.
+    - args: Passed to target before the worker's index.
+
+    Returns:
+    None
+    """
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=target, args=args + (index,)) for index in range(count)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+
+class WorkerBus:
+    """
+    Connects the worker processes of a server started with --workers. They share the
+    database file, which SQLite's WAL mode lets every process read and write, but each
+    keeps its own username index and its own open subscriptions. So each worker binds a
+    Unix datagram socket in a directory next to the database and sends the others every
+    account it creates or deletes and every message it commits, for them to apply to
+    their index or push to their subscribers.
+    """
+
+    def __init__(self, service, directory, index, count, send_timeout=1.0, reload_seconds=5.0):
+        """
+        Binds this worker's socket and starts listening. Peers that are not up yet miss
+        what is sent before they start, which their startup reads from the database.
+
+        Args:
+        - service (ChatService): This worker's service.
+        - directory (str): Directory holding one socket per worker.
+        - index (int): This worker's number, from 0.
+        - count (int): Number of workers.
+        - send_timeout (float): Seconds to wait on a peer too busy to receive before
+          giving up on it.
+        - reload_seconds (float): How long the listener may sit idle before it reloads
+          the username index from the database, in case an announcement was lost.
+
+        Returns:
+        None
+        """
+        self.service = service
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, str(index) + ".sock")
+        # left behind by an earlier run
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.socket.bind(self.path)
+        self.socket.settimeout(reload_seconds)
+        self.sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sender.settimeout(send_timeout)
+        self.peers = [os.path.join(directory, str(peer) + ".sock") for peer in range(count) if peer != index]
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def send(self, event):
+        data = json.dumps(event).encode()
+        if len(data) > MAX_DATAGRAM:
+            # only a message can be this long; the receiving worker reads its body itself
+            del event["body"]
+            data = json.dumps(event).encode()
+        for peer in self.peers:
+            try:
+                self.sender.sendto(data, peer)
+            except OSError:
+                # the peer has not started yet, has exited, or is not keeping up
+                pass
+
+    def publish_message(self, receiver, msg_id, msg):
+        """Tells the other workers a message was committed, for their subscribers."""
+        self.send({"receiver": receiver, "id": msg_id, "body": msg})
+
+    def publish_accounts(self, accounts):
+        """
+        Tells the other workers accounts were created or deleted.
+
+        Args:
+        - accounts (dict): Maps each changed username to True if it now exists.
+
+        Returns:
+        None
+        """
+        self.send({"accounts": accounts})
+
+    def receive(self, event):
+        if "accounts" in event:
+            self.service.update_usernames(event["accounts"])
+            return
+        msg = event.get("body")
+        if msg is None:
+            self.service.c.execute("SELECT body FROM messages WHERE id = ?", (event["id"],))
+            row = self.service.c.fetchone()
+            # already delivered and removed from the inbox by another worker
+            if row is None:
+                return
+            msg = row[0]
+        self.service.deliver(event["receiver"], event["id"], msg)
+
+    def run(self):
+        """Listener thread loop: applies every event the other workers send."""
+        while True:
+            try:
+                data = self.socket.recv(MAX_DATAGRAM)
+            except socket.timeout:
+                # announcements are sent best-effort, so catch up on any that were dropped
+                self.service.load_usernames()
+                continue
+            if not self.running:
+                break
+            self.receive(json.loads(data))
+        self.socket.close()
+
+    def stop(self):
+        self.running = False
+        # wake the listener, which is blocked in recv
+        self.sender.sendto(b"", self.path)
+        self.thread.join()
+        self.sender.close()
+        os.remove(self.path)